@@ -33,6 +33,12 @@ import re  # 添加正则表达式模块用于过滤表情符号
 
 import uuid
 import hashlib
+
+
+import base64
+
+
+import csv
 from urllib.parse import urlparse, urljoin
 
 
@@ -62,6 +68,7 @@ from scheduler.thread_manager import MyThread
 
 
 from tts import tts_voice
+from tts import tts_stream
 
 
 from utils import util, config_util
@@ -80,6 +87,9 @@ from ai_module import nlp_cemotion
 
 
 from core import stream_manager
+from core import tts_pipeline
+from utils.tts_cache import get_tts_cache, load_config as load_tts_cache_config
+from utils import audio_meta
 
 
 
@@ -172,6 +182,10 @@ can_auto_play = True
 
 
 auto_play_lock = threading.RLock()
+# say 合成阶段发现会话已被打断时的返回值，输出阶段据此直接跳过
+_SAY_ABORTED = object()
+# 放入 sound_query 的停止哨兵，唤醒阻塞中的播放线程退出
+_PLAY_STOP = object()
 
 
 
@@ -238,6 +252,7 @@ class FeiFei:
 
 
         self.sound_query = Queue()
+        self.tts_pipeline = tts_pipeline.TTSPipeline()  # 预合成流水线，按会话顺序交付合成结果
 
 
         self.think_mode_users = {}  # 使用字典存储每个用户的think模式状态
@@ -252,11 +267,14 @@ class FeiFei:
         self.tts_cache = {}
         self.tts_cache_limit = 1000
         self.tts_cache_lock = threading.Lock()
+        self.tts_busy_time = time.time()  # 最近一次实时合成开始的时间，预合成只在空闲时进行
         self.user_audio_conv_map = {}  # 仅用于音频片段的连续序号（避免文本序号空洞导致乱序/缺包）
         self.human_audio_order_map = {}
         self.human_audio_order_lock = threading.Lock()
         self.human_audio_reorder_wait_seconds = 0.2
         self.human_audio_first_wait_seconds = 1.2
+        self.human_audio_stream_map = {}  # (username, conversation_id) -> 分块音频按句排队状态
+        self.human_audio_stream_lock = threading.Lock()
 
     
 
@@ -949,6 +967,9 @@ class FeiFei:
         return hashlib.sha1(raw.encode("utf-8")).hexdigest()
 
     def __get_tts_cache(self, key):
+        disk_cache = get_tts_cache()
+        if disk_cache is not None:
+            return disk_cache.get(key)
         with self.tts_cache_lock:
             file_url = self.tts_cache.get(key)
         if not file_url:
@@ -963,6 +984,10 @@ class FeiFei:
     def __set_tts_cache(self, key, file_url):
         if not file_url:
             return
+        disk_cache = get_tts_cache()
+        if disk_cache is not None:
+            disk_cache.put(key, file_url)
+            return
         with self.tts_cache_lock:
             self.tts_cache[key] = file_url
             while len(self.tts_cache) > self.tts_cache_limit:
@@ -971,6 +996,93 @@ class FeiFei:
                 except Exception:
                     break
 
+    def __get_audio_length(self, file_url):
+        """音频时长（秒）：优先取 TTS 缓存里记录的时长，其次读文件头，都不行再用 pydub 解码。"""
+        disk_cache = get_tts_cache()
+        audio_length = disk_cache.get_duration(file_url) if disk_cache is not None else None
+        if audio_length is None:
+            audio_length = audio_meta.get_duration(file_url)
+        if audio_length is None:
+            if file_url.endswith('.wav'):
+                audio_length = len(AudioSegment.from_wav(file_url)) / 1000.0
+            elif file_url.endswith('.mp3'):
+                audio_length = len(AudioSegment.from_mp3(file_url)) / 1000.0
+            else:
+                raise ValueError(f"无法识别的音频文件: {file_url}")
+        return audio_length
+
+    def __prepare_tts_text(self, text):
+        """与 say 合成阶段相同的文本清洗，保证预合成与实际播报得到同一个缓存键。"""
+        tts_text = self.__remove_prestart_tags(text) if text else text
+        if not tts_text:
+            return ""
+        tts_text = re.sub(r'!\[.*?\]\(https?://[^\s\)]+\)', '', tts_text).strip()
+        if tts_text.replace("*", "").strip() == "":
+            return ""
+        filtered_text = self.__normalize_tts_text(self.__remove_emojis(tts_text.replace("*", "")))
+        if filtered_text is None or filtered_text.strip() == "":
+            return ""
+        return filtered_text.replace('\n', '')
+
+    def __wait_tts_idle(self, idle_seconds):
+        """等到距最近一次实时合成已过 idle_seconds 且没有在播放，避免预合成与 say 抢占 TTS。"""
+        while self.__running:
+            wait = self.tts_busy_time + idle_seconds - time.time()
+            if wait <= 0 and not self.speaking:
+                return True
+            time.sleep(max(wait, 1.0))
+        return False
+
+    def __prewarm_tts_cache(self):
+        """预合成 QA 答案、唤醒回复等固定话术（默认关闭，会调用付费 TTS），只在空闲时逐句进行。"""
+        disk_cache = get_tts_cache()
+        conf = load_tts_cache_config()
+        if disk_cache is None or not conf.get("prewarm", False):
+            return
+        answers = ["在呢，你说？"]
+        answers.extend(str(t) for t in (conf.get("prewarm_texts") or []) if t)
+        qa_file = config_util.config["interact"].get("QnA")
+        if qa_file and os.path.isfile(qa_file):
+            try:
+                with open(qa_file, 'r', encoding='utf-8') as f:
+                    reader = csv.reader(f)
+                    next(reader, None)  # 跳过表头
+                    answers.extend(row[1] for row in reader if len(row) >= 2 and row[1].strip())
+            except Exception as e:
+                util.log(1, f"读取 QA 文件失败，跳过预合成: {e}")
+        # QA 答案播报时会先按句切分，这里用同样的分句器得到与 say 一致的句子
+        from utils.stream_text_processor import get_processor
+        processor = get_processor()
+        sentences = []
+        for answer in answers:
+            segmenter = processor.new_segmenter()
+            pieces = segmenter.feed(answer)
+            tail, rest = segmenter.flush()
+            sentences.extend(pieces + tail + ([rest] if rest else []))
+        mood_voice = self.__get_mood_voice()
+        limit = int(conf.get("prewarm_max", 20))
+        idle_seconds = float(conf.get("prewarm_idle_seconds", 30))
+        synthesized = 0
+        for sentence in dict.fromkeys(sentences):
+            if synthesized >= limit or not self.__running:
+                break
+            filtered_text = self.__prepare_tts_text(sentence)
+            if not filtered_text:
+                continue
+            key = self.__build_tts_cache_key(filtered_text, mood_voice)
+            if disk_cache.contains(key):
+                continue
+            if not self.__wait_tts_idle(idle_seconds):
+                break
+            try:
+                if disk_cache.put(key, self.sp.to_sample(filtered_text, mood_voice)):
+                    synthesized += 1
+                    disk_cache.prewarmed += 1
+            except Exception as e:
+                util.log(1, f"TTS 预合成失败: {e}")
+        if synthesized:
+            util.log(1, f"TTS 缓存预合成完成，新增 {synthesized} 句")
+
     def __send_human_audio_ordered(self, content, username, conversation_id, conversation_msg_no, is_end=False):
         now = time.time()
         sent_messages = []
@@ -1087,6 +1199,66 @@ class FeiFei:
             wsa_server.get_instance().add_cmd(message)
         return len(sent_messages)
 
+    def __open_human_audio_stream(self, interact):
+        """在 say 中按句子顺序登记分块音频流；未启用或数字人端未连接时不登记，合成仍走整句文件。"""
+        username = interact.data.get("user", "User")
+        if interact.data.get('audio') is not None or not tts_stream.load_config().get("enabled", True):
+            return
+        if not wsa_server.get_instance().is_connected(username):
+            return
+        stream_id = interact.data.get("conversation_msg_no")
+        key = (username, interact.data.get("conversation_id", "") or "")
+        with self.human_audio_stream_lock:
+            state = self.human_audio_stream_map.setdefault(key, {"order": [], "pending": {}})
+            state["order"].append(stream_id)
+        interact.data["audio_stream_id"] = stream_id
+
+    def __send_human_audio_chunk(self, interact, text, pcm, sample_rate, channels, index, is_last):
+        """tts_stream 的分块回调：本句排在最前时直接推送，否则暂存到前面的句子交付之后再推送。"""
+        username = interact.data.get("user", "User")
+        conv_id = interact.data.get("conversation_id", "") or ""
+        if stream_manager.new_instance().should_stop_generation(username, conversation_id=interact.data.get("conversation_id")):
+            return False
+        stream_id = interact.data.get("audio_stream_id")
+        content = {'Topic': 'human', 'Data': {'Key': 'audio_chunk', 'Value': base64.b64encode(pcm).decode('ascii'), 'Format': 'pcm_s16le', 'SampleRate': sample_rate, 'Channels': channels, 'Index': index, 'IsLast': 1 if is_last else 0, 'Text': text, 'CONV_ID': conv_id, 'CONV_MSG_NO': stream_id}, 'Username': username}
+        with self.human_audio_stream_lock:
+            state = self.human_audio_stream_map.get((username, conv_id))
+            if state is None:
+                # 会话已被打断清理
+                return False
+            if state["order"] and state["order"][0] != stream_id:
+                state["pending"].setdefault(stream_id, []).append(content)
+                return True
+        wsa_server.get_instance().add_cmd(content)
+        return True
+
+    def __close_human_audio_stream(self, interact, is_end):
+        """句子交付时出队，并推送下一句已暂存的分块。"""
+        username = interact.data.get("user", "User")
+        key = (username, interact.data.get("conversation_id", "") or "")
+        flushed = []
+        with self.human_audio_stream_lock:
+            state = self.human_audio_stream_map.get(key)
+            if state is None:
+                return
+            if "audio_stream_id" in interact.data:
+                stream_id = interact.data["audio_stream_id"]
+                if stream_id in state["order"]:
+                    state["order"].remove(stream_id)
+                state["pending"].pop(stream_id, None)
+            if state["order"]:
+                flushed = state["pending"].pop(state["order"][0], [])
+            elif is_end:
+                del self.human_audio_stream_map[key]
+        for content in flushed:
+            wsa_server.get_instance().add_cmd(content)
+
+    def cancel_human_audio_streams(self, username):
+        """用户打断时丢弃其未推送的分块，正在进行的流式合成在下一块时停止。"""
+        with self.human_audio_stream_lock:
+            for key in [k for k in self.human_audio_stream_map if k[0] == username]:
+                del self.human_audio_stream_map[key]
+
     def say(self, interact, text, type = ""):
 
 
@@ -1535,136 +1707,177 @@ class FeiFei:
             
 
 
-            result = None
+            self.__open_human_audio_stream(interact)
+            # 合成交给预合成流水线：后续句子与当前句并发合成，结果按 conversation_msg_no 顺序交付
+            if tts_pipeline.load_config().get("enabled", True):
+                self.tts_pipeline.submit(
+                    (username, interact.data.get("conversation_id", "") or ""),
+                    interact.data.get("conversation_msg_no"),
+                    lambda: self.__synthesize_say_audio(interact, text, is_end, is_prestart_content),
+                    lambda result: self.__deliver_say_audio(interact, text, result, is_first, is_end, is_prestart_content, pipelined=True),
+                )
+                return None
+            result = self.__synthesize_say_audio(interact, text, is_end, is_prestart_content)
+            return self.__deliver_say_audio(interact, text, result, is_first, is_end, is_prestart_content)
 
+        except BaseException as e:
 
-            audio_url = interact.data.get('audio', None)#透传的音频
 
+            print(e) 
 
 
+        return None
 
 
-            # 移除 prestart 标签内容，不进行TTS
+    
 
 
-            tts_text = self.__remove_prestart_tags(text) if text else text
-            # 移除 markdown 图片语法，避免TTS朗读图片链接
-            if tts_text:
-                tts_text = re.sub(r'!\[.*?\]\(https?://[^\s\)]+\)', '', tts_text).strip()
+    def __synthesize_say_audio(self, interact, text, is_end, is_prestart_content):
+        """say 的合成阶段：透传音频下载或 TTS 合成，返回音频文件路径；会话已被打断时返回 _SAY_ABORTED。"""
+        result = None
+        audio_url = interact.data.get('audio', None)#透传的音频
 
 
 
 
 
-            if audio_url is not None:#透传音频下载
+        # 移除 prestart 标签内容，不进行TTS
 
 
-                file_name = 'sample-' + str(int(time.time() * 1000)) + audio_url[-4:]
+        tts_text = self.__remove_prestart_tags(text) if text else text
+        # 移除 markdown 图片语法，避免TTS朗读图片链接
+        if tts_text:
+            tts_text = re.sub(r'!\[.*?\]\(https?://[^\s\)]+\)', '', tts_text).strip()
 
 
-                result = self.download_wav(audio_url, './samples/', file_name)
 
 
-            elif config_util.config["interact"]["playSound"] or wsa_server.get_instance().get_client_output(interact.data.get("user")) or self.__is_send_remote_device_audio(interact):#tts
 
+        if audio_url is not None:#透传音频下载
 
-                if tts_text != None and tts_text.replace("*", "").strip() != "":
 
+            file_name = 'sample-' + str(int(time.time() * 1000)) + audio_url[-4:]
 
-                    # 检查是否需要停止TTS处理（按会话）
 
+            result = self.download_wav(audio_url, './samples/', file_name)
 
-                    if stream_manager.new_instance().should_stop_generation(
 
+        elif config_util.config["interact"]["playSound"] or wsa_server.get_instance().get_client_output(interact.data.get("user")) or self.__is_send_remote_device_audio(interact):#tts
 
-                        interact.data.get("user", "User"),
 
+            if tts_text != None and tts_text.replace("*", "").strip() != "":
 
-                        conversation_id=interact.data.get("conversation_id")
 
+                # 检查是否需要停止TTS处理（按会话）
 
-                    ):
 
+                if stream_manager.new_instance().should_stop_generation(
 
-                        util.printInfo(1, interact.data.get('user'), 'TTS处理被打断，跳过音频合成')
 
+                    interact.data.get("user", "User"),
 
-                        return None
 
+                    conversation_id=interact.data.get("conversation_id")
 
 
+                ):
 
 
-                    # 先过滤表情符号，然后再合成语音
+                    util.printInfo(1, interact.data.get('user'), 'TTS处理被打断，跳过音频合成')
 
 
-                    filtered_text = self.__remove_emojis(tts_text.replace("*", ""))
-                    filtered_text = self.__normalize_tts_text(filtered_text)
+                    return _SAY_ABORTED
 
 
-                    if filtered_text is not None and filtered_text.strip() != "":
 
 
-                        util.printInfo(1,  interact.data.get('user'), '合成音频...')
 
+                # 先过滤表情符号，然后再合成语音
 
-                        tm = time.time()
 
+                filtered_text = self.__remove_emojis(tts_text.replace("*", ""))
+                filtered_text = self.__normalize_tts_text(filtered_text)
 
-                        filtered_text = filtered_text.replace('\n', '')
-                        mood_voice = self.__get_mood_voice()
-                        cache_key = self.__build_tts_cache_key(filtered_text, mood_voice)
-                        cache_result = self.__get_tts_cache(cache_key)
-                        if cache_result is not None:
-                            result = cache_result
-                            util.printInfo(1, interact.data.get('user'), 'TTS cache hit')
-                        else:
-                            result = self.sp.to_sample(filtered_text, mood_voice)
-                            self.__set_tts_cache(cache_key, result)
 
+                if filtered_text is not None and filtered_text.strip() != "":
 
-                        # 合成完成后再次检查会话是否仍有效，避免继续输出旧会话结果
 
+                    util.printInfo(1,  interact.data.get('user'), '合成音频...')
 
-                        try:
 
+                    tm = time.time()
 
-                            user_for_stop = interact.data.get("user", "User")
 
+                    filtered_text = filtered_text.replace('\n', '')
+                    self.tts_busy_time = tm
+                    mood_voice = self.__get_mood_voice()
+                    cache_key = self.__build_tts_cache_key(filtered_text, mood_voice)
+                    cache_result = self.__get_tts_cache(cache_key)
+                    if cache_result is not None:
+                        result = cache_result
+                        util.printInfo(1, interact.data.get('user'), 'TTS cache hit')
+                    elif "audio_stream_id" in interact.data:
+                        # 数字人端在线时边合成边推送分块，首块到达即可开始播放
+                        result, streamed, complete = tts_stream.synthesize(
+                            self.sp, filtered_text, mood_voice,
+                            lambda pcm, rate, channels, index, is_last: self.__send_human_audio_chunk(interact, text, pcm, rate, channels, index, is_last),
+                        )
+                        # 分块没能完整发出时，整句消息不带 Streamed，由客户端按整句播放
+                        interact.data["audio_streamed"] = streamed
+                        # 被打断或回退前的残缺流不进缓存，避免以后一直播放截断的音频
+                        if complete:
+                            self.__set_tts_cache(cache_key, result)
+                    else:
+                        result = self.sp.to_sample(filtered_text, mood_voice)
+                        self.__set_tts_cache(cache_key, result)
 
-                            conv_id_for_stop = interact.data.get("conversation_id")
 
+                    # 合成完成后再次检查会话是否仍有效，避免继续输出旧会话结果
 
-                            if stream_manager.new_instance().should_stop_generation(user_for_stop, conversation_id=conv_id_for_stop):
 
+                    try:
 
-                                return None
 
+                        user_for_stop = interact.data.get("user", "User")
 
-                        except Exception:
 
+                        conv_id_for_stop = interact.data.get("conversation_id")
 
-                            pass
 
+                        if stream_manager.new_instance().should_stop_generation(user_for_stop, conversation_id=conv_id_for_stop):
 
-                        util.printInfo(1,  interact.data.get("user"), "合成音频完成. 耗时: {} ms 文件:{}".format(math.floor((time.time() - tm) * 1000), result))
 
+                            return _SAY_ABORTED
 
-            else:
+
+                    except Exception:
 
 
-                # prestart 内容不应该触发机器人表情重置
+                        pass
 
 
-                if is_end and not is_prestart_content and wsa_server.get_web_instance().is_connected(interact.data.get('user')):
+                    util.printInfo(1,  interact.data.get("user"), "合成音频完成. 耗时: {} ms 文件:{}".format(math.floor((time.time() - tm) * 1000), result))
 
 
-                    wsa_server.get_web_instance().add_cmd({"panelMsg": "", 'Username' : interact.data.get('user'), 'robot': f'{cfg.fay_url}/robot/Normal.jpg'})
+        else:
 
 
+            # prestart 内容不应该触发机器人表情重置
 
 
+            if is_end and not is_prestart_content and wsa_server.get_web_instance().is_connected(interact.data.get('user')):
 
+
+                wsa_server.get_web_instance().add_cmd({"panelMsg": "", 'Username' : interact.data.get('user'), 'robot': f'{cfg.fay_url}/robot/Normal.jpg'})
+        return result
+
+    def __deliver_say_audio(self, interact, text, result, is_first, is_end, is_prestart_content, pipelined=False):
+        """say 的输出阶段：分配数字人音频序号并进入音频输出处理。"""
+        self.__close_human_audio_stream(interact, is_end)
+        if result is _SAY_ABORTED:
+            return None
+        try:
+            username = interact.data.get("user", "User")
             # 为数字人音频单独维护连续序号，避免 conversation_msg_no 因无音频片段产生空洞
             audio_conv_id = interact.data.get("conversation_id", "") or ""
             audio_conv_key = (username, audio_conv_id)
@@ -1692,6 +1905,10 @@ class FeiFei:
                     return result
 
 
+                if pipelined:
+                    # 流水线按会话顺序逐句交付，在交付线程内同步处理即可保证入播放队列的顺序
+                    self.__process_output_audio(result, interact, text)
+                    return result
                 if is_end:#TODO 临时方案：如果结束标记，则延迟1秒处理,免得is end比前面的音频tts要快
 
 
@@ -1701,24 +1918,11 @@ class FeiFei:
                 MyThread(target=self.__process_output_audio, args=[result, interact, text]).start()
 
 
-                return result         
-
-
-                
-
-
+                return result
         except BaseException as e:
-
-
-            print(e) 
-
-
+            print(e)
         return None
 
-
-    
-
-
     #下载wav
 
 
@@ -1846,13 +2050,14 @@ class FeiFei:
         while self.__running:
 
 
-            time.sleep(0.01)
+            # 阻塞等待下一段音频，stop() 放入哨兵唤醒退出
+            item = self.sound_query.get()
 
 
-            if not self.sound_query.empty():  # 如果队列不为空则播放音频
+            if item is not _PLAY_STOP:
 
 
-                file_url, audio_length, interact = self.sound_query.get()
+                file_url, audio_length, interact = item
 
 
 
@@ -2167,22 +2372,10 @@ class FeiFei:
                     audio_length = 0
 
 
-                elif file_url.endswith('.wav'):
-
-
-                    audio = AudioSegment.from_wav(file_url)
-
-
-                    audio_length = len(audio) / 1000.0  # 时长以秒为单位
-
-
-                elif file_url.endswith('.mp3'):
-
-
-                    audio = AudioSegment.from_mp3(file_url)
+                else:
 
 
-                    audio_length = len(audio) / 1000.0  # 时长以秒为单位
+                    audio_length = self.__get_audio_length(file_url)
 
 
             except Exception as e:
@@ -2236,7 +2429,7 @@ class FeiFei:
                 if file_url is not None:
 
 
-                    content = {'Topic': 'human', 'Data': {'Key': 'audio', 'Value': os.path.abspath(file_url), 'HttpValue': f'{cfg.fay_url}/audio/' + os.path.basename(file_url),  'Text': text, 'Time': audio_length, 'Type': interact.interleaver, 'IsFirst': 1 if interact.data.get("isfirst", False) else 0,  'IsEnd': 1 if interact.data.get("isend", False) else 0, 'CONV_ID' : conv_id_for_send, 'CONV_MSG_NO' : conv_msg_no_for_send  }, 'Username' : interact.data.get('user'), 'robot': f'{cfg.fay_url}/robot/Speaking.jpg'}
+                    content = {'Topic': 'human', 'Data': {'Key': 'audio', 'Value': os.path.abspath(file_url), 'HttpValue': f'{cfg.fay_url}/audio/' + os.path.basename(file_url),  'Text': text, 'Time': audio_length, 'Type': interact.interleaver, 'IsFirst': 1 if interact.data.get("isfirst", False) else 0,  'IsEnd': 1 if interact.data.get("isend", False) else 0, 'CONV_ID' : conv_id_for_send, 'CONV_MSG_NO' : conv_msg_no_for_send, 'Streamed': 1 if interact.data.get("audio_streamed") else 0  }, 'Username' : interact.data.get('user'), 'robot': f'{cfg.fay_url}/robot/Speaking.jpg'}
 
 
                     # 计算 Sentiment
@@ -2468,6 +2661,7 @@ class FeiFei:
 
 
         MyThread(target=self.__play_sound).start()
+        MyThread(target=self.__prewarm_tts_cache, daemon=True).start()
 
 
 
@@ -2482,6 +2676,17 @@ class FeiFei:
         self.__running = False
 
 
+        self.sound_query.put(_PLAY_STOP)
+
+
+        stream_manager.new_instance().stop()
+
+
+        disk_cache = get_tts_cache()
+        if disk_cache is not None:
+            disk_cache.flush()
+
+
         self.speaking = False
 
 
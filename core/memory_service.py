@@ -27,22 +27,20 @@ Fay 记忆操作的唯一权威入口。
       路径，保持现状。
     - 新的外部写入（外部 agent/MCP/前端 API）全部走本模块 remember()。
       本模块内部也做了"先算 importance/embedding，后持锁"的拆分，并会
-      在持锁期间立刻把 nodes.json / embeddings.json 刷盘，避免 Fay 异常
+      在持锁之后立刻把新节点追加到 memory.log 刷盘，避免 Fay 异常
       重启丢失外部写入。
 """
 
 from __future__ import annotations
 
 import os
-import json
-import threading
 from typing import Iterable
 
 from utils import util
 
 # 走既有的 agent / memory_stream / member_db 通道，避免重复实现。
 # 这些都是现成函数：
-#   - create_agent / get_user_memory_dir / agent_lock / get_current_time_step
+#   - create_agent / get_user_memory_dir / get_user_lock / get_current_time_step
 #     来自 llm/nlp_cognitive_stream.py
 #   - get_text_embedding / generate_importance_score 在同一处被封装
 from llm import nlp_cognitive_stream as ncs
@@ -148,34 +146,19 @@ def _normalize_tags(
 # 落盘
 # -----------------------------------------------------------------------------
 
-_flush_lock = threading.Lock()
-
-
 def _flush_agent_to_disk(username: str | None, agent) -> None:
-    """把 agent 的 memory_stream 序列化到磁盘。外部写入路径专用。
+    """把 agent 的 memory_stream 增量刷到磁盘。外部写入路径专用。
 
-    - 夜间定时任务有自己的落盘逻辑，因此我们只在外部 remember() 调用时触发本函数，
-      防止高频写入撞车。
-    - 不持 agent_lock：调用方已经在持锁期间完成了内存修改，这里只是 I/O。
+    - 只把新追加的节点写进 memory.log（O(1)），日志过长时由 memory_store
+      自动压缩成快照，因此外部高频 remember(flush=True) 不会每次重写全部记忆。
+    - 夜间定时任务有自己的落盘逻辑，因此我们只在外部 remember() 调用时触发本函数。
+    - 持该用户的锁写日志，避免与同一用户的全量保存交错；其他用户不受影响。
     """
     try:
         memory_dir = ncs.get_user_memory_dir(username)
-        memory_stream_dir = os.path.join(memory_dir, "memory_stream")
-        os.makedirs(memory_stream_dir, exist_ok=True)
-
-        nodes_data = []
-        for node in agent.memory_stream.seq_nodes:
-            if node is not None and hasattr(node, "package"):
-                try:
-                    nodes_data.append(node.package())
-                except Exception as e:
-                    util.log(1, f"[memory_service] 打包节点失败: {str(e)}")
-
-        with _flush_lock:
-            with open(os.path.join(memory_stream_dir, "nodes.json"), "w", encoding="utf-8") as f:
-                json.dump(nodes_data, f, ensure_ascii=False, indent=2)
-            with open(os.path.join(memory_stream_dir, "embeddings.json"), "w", encoding="utf-8") as f:
-                json.dump(agent.memory_stream.embeddings or {}, f, ensure_ascii=False, indent=2)
+        os.makedirs(os.path.join(memory_dir, "memory_stream"), exist_ok=True)
+        with ncs.get_user_lock(username):
+            agent.flush(memory_dir)
     except Exception as e:
         util.log(1, f"[memory_service] 落盘失败: {str(e)}")
 
@@ -206,7 +189,7 @@ def remember(
         extra_tags: 额外 tag（建议带命名空间前缀，如 "domain:quant", "symbol:AAPL"）。
         node_type: memory_stream 的节点类型：observation / conversation / reflection。
             外部调用一般用 observation。
-        flush: 是否立刻把 nodes.json / embeddings.json 刷到磁盘。默认 True。
+        flush: 是否立刻把新节点追加写入记忆日志。默认 True。
 
     返回:
         {"ok": True, "node_id": int, "tags": [...]}  或  {"ok": False, "error": "..."}
@@ -229,12 +212,12 @@ def remember(
         util.log(1, f"[memory_service] 生成 embedding 失败，使用空向量: {str(e)}")
         embedding = []
 
-    # 2) 持锁：写内存数据结构
+    # 2) 持该用户的锁：写内存数据结构
     try:
-        agent = ncs.create_agent(username)
-        if agent is None or agent.memory_stream is None:
-            return {"ok": False, "error": "agent 未就绪"}
-        with ncs.agent_lock:
+        with ncs.get_user_lock(username):
+            agent = ncs.create_agent(username)
+            if agent is None or agent.memory_stream is None:
+                return {"ok": False, "error": "agent 未就绪"}
             time_step = ncs.get_current_time_step(username)
             ms = agent.memory_stream
             new_node = ms.append_prepared_node(
@@ -273,7 +256,7 @@ def search(
         agent = ncs.create_agent(username)
         if agent is None or agent.memory_stream is None:
             return []
-        with ncs.agent_lock:
+        with ncs.get_user_lock(username):
             time_step = ncs.get_current_time_step(username)
             retrieved = agent.memory_stream.retrieve(
                 [query], time_step, n_count=n, curr_filter=node_type,
@@ -300,7 +283,7 @@ def get_recent(
         agent = ncs.create_agent(username)
         if agent is None or agent.memory_stream is None:
             return []
-        with ncs.agent_lock:
+        with ncs.get_user_lock(username):
             seq = list(agent.memory_stream.seq_nodes)
         if node_type != "all":
             seq = [x for x in seq if x.node_type == node_type]
@@ -324,7 +307,7 @@ def get_active_rules(username: str | None, *, n: int = 50) -> list[dict]:
         agent = ncs.create_agent(username)
         if agent is None or agent.memory_stream is None:
             return []
-        with ncs.agent_lock:
+        with ncs.get_user_lock(username):
             seq = list(agent.memory_stream.seq_nodes)
         required = {"kind:rule", "persistent:true"}
         matched = [x for x in seq if required.issubset(set(x.tags or []))]
@@ -341,7 +324,7 @@ def get_reflections(username: str | None, *, n: int = 10) -> list[dict]:
         agent = ncs.create_agent(username)
         if agent is None or agent.memory_stream is None:
             return []
-        with ncs.agent_lock:
+        with ncs.get_user_lock(username):
             seq = list(agent.memory_stream.seq_nodes)
         matched = [
             x for x in seq
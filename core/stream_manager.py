@@ -1,6 +1,5 @@
 ﻿# -*- coding: utf-8 -*-
 import threading
-import time
 from utils import stream_sentence
 from scheduler.thread_manager import MyThread
 import fay_booter
@@ -222,6 +221,10 @@ class StreamManager:
         try:
             while True:
                 item = sound_queue.get_nowait()  # 非阻塞获取
+                if not isinstance(item, tuple):
+                    # 播放线程的停止哨兵等非音频项原样保留
+                    temp_items.append(item)
+                    continue
                 file_url, audio_length, interact = item
                 item_user = interact.data.get('user', '')
                 if item_user != username:
@@ -248,6 +251,13 @@ class StreamManager:
         注意：此方法假设调用者已持有必要的锁
         """
         fay_core = fay_booter.feiFei
+        # 取消尚未交付的预合成，避免打断后旧句子继续进入播放队列
+        pipeline = getattr(fay_core, "tts_pipeline", None)
+        if pipeline is not None:
+            pipeline.cancel(username)
+        cancel_streams = getattr(fay_core, "cancel_human_audio_streams", None)
+        if cancel_streams is not None:
+            cancel_streams(username)
         # 只清理特定用户的音频项，保留其他用户的音频
         self._clear_user_specific_audio(username, fay_core.sound_query)
 
@@ -289,11 +299,21 @@ class StreamManager:
 
     def listen(self, username, stream, nlp_stream):
         while self.running:
-            sentence = stream.read()
+            # 阻塞等待写入通知，句子到达即处理；stop() 关闭流时返回 None 并退出
+            sentence = stream.read(timeout=None)
             if sentence:
                 self.execute(username, sentence)
-            else:
-                time.sleep(0.1)
+            elif stream.closed:
+                break
+
+    def stop(self):
+        """关闭所有用户的文本流，唤醒并结束监听线程；之后再取流会重新创建流与监听线程。"""
+        with self.stream_lock:
+            for stream in list(self.streams.values()) + list(self.nlp_streams.values()):
+                stream.close()
+            self.streams.clear()
+            self.nlp_streams.clear()
+            self.listener_threads.clear()
 
     def execute(self, username, sentence):
         """
@@ -341,7 +361,6 @@ class StreamManager:
             effective_cid = producer_cid if producer_cid is not None else getattr(self, 'conversation_ids', {}).get(username, "")
             interact = Interact("stream", 1, {"user": username, "msg": sentence, "isfirst": is_first, "isend": is_end, "conversation_id": effective_cid})
             fay_core.say(interact, sentence, type="qa" if is_qa else "")  # 调用核心处理模块进行响应
-        time.sleep(0.01)  # 短暂休眠以控制处理频率
 
 
 
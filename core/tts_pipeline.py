@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+TTS 预合成流水线。
+
+流式回复的每一句由 StreamManager 的监听线程依次调用 FeiFei.say：原先 say 内同步合成，
+下一句要等上一句合成完才开始，合成慢于播放时句间就会出现空白。这里把合成放进有界线程池，
+最多同时合成 lookahead 句；合成结果按 conversation_msg_no 的顺序逐句交给后续的输出处理
+（面板、数字人、播放队列），先合成完的句子等前面的句子交付后再交付。
+用户打断（should_stop_generation）时取消尚未开始的合成并丢弃待交付的句子。
+
+配置（config.json 的 tts_pipeline，可选）：
+  enabled     是否启用（关闭时 say 内同步合成，与原流程一致）
+  lookahead   同时合成的句子数
+"""
+import bisect
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from scheduler.thread_manager import MyThread
+from utils import util
+
+DEFAULT_CONFIG = {
+    "enabled": True,
+    "lookahead": 3,
+}
+
+
+def load_config():
+    conf = dict(DEFAULT_CONFIG)
+    cfg = sys.modules.get("utils.config_util")
+    try:
+        if cfg is not None and cfg.config:
+            conf.update(cfg.config.get("tts_pipeline", {}) or {})
+    except Exception:
+        pass
+    return conf
+
+
+class _Job:
+    __slots__ = ("seq", "order", "deliver", "future", "done", "result", "submitted_at")
+
+    def __init__(self, seq, order, deliver):
+        self.seq = seq
+        self.order = order
+        self.deliver = deliver
+        self.future = None
+        self.done = False
+        self.result = None
+        self.submitted_at = time.perf_counter()
+
+    def __lt__(self, other):
+        return (self.seq, self.order) < (other.seq, other.order)
+
+
+class TTSPipeline:
+    """按会话排序交付的并发合成队列；key 通常为 (username, conversation_id)。"""
+
+    def __init__(self, lookahead=None):
+        self._lock = threading.Lock()
+        self._lookahead = lookahead
+        self._executor = None
+        self._jobs = {}        # key -> 按 (seq, 提交顺序) 排序的待交付任务
+        self._draining = set()  # 正在由交付线程处理的 key
+        self._order = 0
+        self.stats = {"submitted": 0, "delivered": 0, "cancelled": 0}
+
+    def _get_executor(self):
+        if self._executor is None:
+            workers = self._lookahead or int(load_config().get("lookahead", 3))
+            self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="tts-lookahead")
+        return self._executor
+
+    def submit(self, key, seq, synthesize, deliver):
+        """
+        提交一句：synthesize() 在线程池中执行并返回合成结果，
+        deliver(result) 在该 key 之前的句子都交付之后按顺序调用。
+        """
+        with self._lock:
+            self._order += 1
+            job = _Job(seq if seq is not None else 0, self._order, deliver)
+            bisect.insort(self._jobs.setdefault(key, []), job)
+            self.stats["submitted"] += 1
+            job.future = self._get_executor().submit(synthesize)
+        job.future.add_done_callback(lambda future, key=key, job=job: self._on_done(key, job, future))
+        return job.future
+
+    def _on_done(self, key, job, future):
+        try:
+            job.result = None if future.cancelled() else future.result()
+        except Exception as e:
+            util.log(1, f"TTS 预合成出错: {e}")
+            job.result = None
+        with self._lock:
+            job.done = True
+            if key in self._draining or key not in self._jobs:
+                return
+            self._draining.add(key)
+        # 交付（音频时长、数字人推送、入播放队列）可能较慢，放到独立线程，不占用合成线程
+        MyThread(target=self._drain, args=(key,), daemon=True).start()
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                jobs = self._jobs.get(key)
+                if not jobs or not jobs[0].done:
+                    self._draining.discard(key)
+                    if jobs is not None and not jobs:
+                        del self._jobs[key]
+                    return
+                job = jobs.pop(0)
+                self.stats["delivered"] += 1
+            try:
+                job.deliver(job.result)
+            except Exception as e:
+                util.log(1, f"TTS 结果交付出错: {e}")
+
+    def cancel(self, username, conversation_id=None):
+        """取消某用户（或其某个会话）未交付的句子；正在合成的结果完成后直接丢弃。"""
+        cancelled = 0
+        with self._lock:
+            for key in list(self._jobs):
+                if key[0] != username or (conversation_id is not None and key[1] != conversation_id):
+                    continue
+                for job in self._jobs.pop(key):
+                    job.future.cancel()
+                    cancelled += 1
+            self.stats["cancelled"] += cancelled
+        return cancelled
+
+    def pending(self, key=None):
+        with self._lock:
+            if key is not None:
+                return len(self._jobs.get(key, []))
+            return sum(len(jobs) for jobs in self._jobs.values())
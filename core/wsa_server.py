@@ -15,6 +15,7 @@ class MyServer:
         self.__host = host  # ip
         self.__port = port  # 端口号
         self.__listCmd = []  # 要发送的信息的列表
+        self.__cmd_event = None  # 有新消息时置位，唤醒发送协程（在服务端事件循环中创建）
         self.__clients = list() 
         self.__server: Serve = None
         self.__event_loop: AbstractEventLoop = None
@@ -75,9 +76,17 @@ class MyServer:
         return False
 
     # 发送处理        
+    # 等待新消息：列表为空时挂起，add_cmd / stop_server 置位事件后唤醒
+    async def __wait_cmd(self):
+        while self.__running and len(self.__listCmd) == 0:
+            self.__cmd_event.clear()
+            if len(self.__listCmd) > 0:
+                break
+            await self.__cmd_event.wait()
+
     async def __producer_handler(self, websocket, path):
         while self.__running:
-            await asyncio.sleep(0.01)
+            await self.__wait_cmd()
             if len(self.__listCmd) > 0:
                 message = await self.__producer()
                 if message:
@@ -191,6 +200,7 @@ class MyServer:
     def __connect(self):
         self.__event_loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.__event_loop)
+        self.__cmd_event = asyncio.Event()
         self.__isExecute = True
         if self.__server:
             util.log(1, 'server already exist')
@@ -206,8 +216,20 @@ class MyServer:
         # keep unicode (emoji/中文) intact for websocket consumers
         jsonStr = json.dumps(content, ensure_ascii=False)
         self.__listCmd.append(jsonStr)
+        self.__notify_cmd()
         # util.log('命令 {}'.format(content))
 
+    # 从任意线程唤醒发送协程
+    def __notify_cmd(self):
+        loop = self.__event_loop
+        if loop is None or self.__cmd_event is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self.__cmd_event.set)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
     # 开启服务
     def start_server(self):
         MyThread(target=self.__connect).start()
@@ -216,6 +238,7 @@ class MyServer:
     def stop_server(self):
         self.__running = False
         self.isConnect = False
+        self.__notify_cmd()
         if self.__server is None:
             return
         self.__server.close()
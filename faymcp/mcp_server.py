@@ -433,7 +433,7 @@ async def _handle_call_tool(name: str, arguments: Dict[str, Any]) -> list[TextCo
 async def _handle_memory_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
     """派发 memory_* 工具到 core.memory_service 的同名函数。
 
-    走 asyncio.to_thread 是因为 memory_service 内部会拿 agent_lock 并做 I/O，
+    走 asyncio.to_thread 是因为 memory_service 内部会拿用户锁并做 I/O，
     不能阻塞 MCP 事件循环。
     """
     if memory_service is None:
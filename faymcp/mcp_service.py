@@ -13,7 +13,7 @@ from datetime import datetime
 from typing import Any, Dict, List
 from flask_cors import CORS
 from faymcp.mcp_client import McpClient
-from faymcp import tool_registry, prestart_registry, resource_registry
+from faymcp import tool_registry, prestart_registry, resource_registry, prestart_runner, tool_result_cache
 from utils import util
 
 
@@ -172,6 +172,8 @@ def _attach_prestart_metadata(server_id: int, tools: List[Dict[str, Any]]) -> Li
         item["prestart_params"] = dict(cfg.get("params", {})) if isinstance(cfg, dict) else {}
         item["include_history"] = cfg.get("include_history", True) if isinstance(cfg, dict) else True
         item["allow_function_call"] = cfg.get("allow_function_call", False) if isinstance(cfg, dict) else False
+        item["cache_ttl"] = cfg.get("cache_ttl", 0) if isinstance(cfg, dict) else 0
+        item["cache_stats"] = tool_result_cache.tool_stats(server_id, name) if name else {}
         enriched.append(item)
     return enriched
 
@@ -222,6 +224,9 @@ def connect_to_real_mcp(server):
         def _enabled_lookup(tool_name: str, sid=server_id):
             return get_tool_state(sid, tool_name)
 
+        # 重新连接后工具实现可能已变化，丢弃该服务器的缓存结果
+        tool_result_cache.invalidate(server_id)
+
         # 如果已存在旧连接，先断开并清理（防止重复连接）
         if server_id in mcp_clients:
             try:
@@ -581,6 +586,7 @@ def disconnect_server(server_id):
 
             # 更新工具可用状态
             tool_registry.mark_all_unavailable(server_id)
+            tool_result_cache.invalidate(server_id)
 
             save_mcp_servers(mcp_servers)
             return jsonify({"message": f"服务器 {server['name']} 已断开连接", "server": server})
@@ -702,6 +708,7 @@ def update_mcp_server(server_id):
 
     # 保存配置
     save_mcp_servers(mcp_servers)
+    tool_result_cache.invalidate(server_id)
 
     # 如果需要自动重连
     if auto_reconnect:
@@ -766,6 +773,7 @@ def delete_server(server_id):
             # 删除服务器
             deleted_server = mcp_servers.pop(i)
             tool_registry.remove_server(server_id)
+            tool_result_cache.invalidate(server_id)
             save_mcp_servers(mcp_servers)
             return jsonify({"message": f"服务器 {deleted_server['name']} 已删除", "server": deleted_server})
     return jsonify({"error": "服务器未找到"}), 404
@@ -1143,6 +1151,7 @@ def toggle_tool_state(server_id, tool_name):
         # 设置工具状态
         set_tool_state(server_id, tool_name, enabled)
         tool_registry.update_tool_enabled(server_id, tool_name, enabled)
+        tool_result_cache.invalidate(server_id, tool_name)
         
         util.log(1, f"工具 {tool_name} 在服务器 {server['name']} 上已{'启用' if enabled else '禁用'}")
         
@@ -1193,6 +1202,13 @@ def set_prestart_tool(server_id, tool_name):
         params = data.get("params", {}) or {}
         include_history = bool(data.get("include_history", True))
         allow_function_call = bool(data.get("allow_function_call", False))
+        try:
+            cache_ttl = max(0.0, float(data.get("cache_ttl", 0) or 0))
+        except (TypeError, ValueError):
+            return jsonify({
+                "success": False,
+                "message": "缓存时间必须是数字（秒）"
+            }), 400
         
         if params and not isinstance(params, dict):
             return jsonify({
@@ -1206,12 +1222,15 @@ def set_prestart_tool(server_id, tool_name):
                 tool_name, 
                 params if isinstance(params, dict) else {},
                 include_history=include_history,
-                allow_function_call=allow_function_call
+                allow_function_call=allow_function_call,
+                cache_ttl=cache_ttl
             )
             action = "启用"
         else:
             prestart_registry.remove_prestart(server_id, tool_name)
             action = "取消"
+        # 参数模板或缓存时间变化后旧结果不再可信
+        tool_result_cache.invalidate(server_id, tool_name)
 
         tools = tool_registry.get_server_tools(
             server_id,
@@ -1228,6 +1247,7 @@ def set_prestart_tool(server_id, tool_name):
             "prestart_params": params if isinstance(params, dict) else {},
             "include_history": include_history if enabled else True,
             "allow_function_call": allow_function_call if enabled else False,
+            "cache_ttl": cache_ttl if enabled else 0,
             "tools": tools
         })
     except Exception as e:
@@ -1391,8 +1411,11 @@ def call_prestart_tool(server_id, tool_name):
                 "error": server_or_error
             }), 500
 
-        # 调用工具（跳过启用状态检查）
-        call_success, result = call_mcp_tool(server_id, tool_name, params, skip_enabled_check=True)
+        # 调用工具（跳过启用状态检查），配置了缓存时间的工具复用缓存结果
+        call_success, result = tool_result_cache.call_cached(
+            server_id, tool_name, params, tool_config.get('cache_ttl', 0) if tool_config else 0,
+            lambda: call_mcp_tool(server_id, tool_name, params, skip_enabled_check=True),
+        )
 
         # 如果是临时连接且不需要保持，断开连接
         if is_temp_connection and not keep_connection:
@@ -1459,6 +1482,47 @@ def call_prestart_tool(server_id, tool_name):
         }), 500
 
 
+def _format_prestart_result(base, result, include_history, allow_function_call):
+    """把预启动工具的原始返回序列化为接口结果。"""
+    def serialize_object(obj):
+        if obj is None:
+            return None
+        if isinstance(obj, (str, int, float, bool)):
+            return obj
+        if isinstance(obj, dict):
+            return {k: serialize_object(v) for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return [serialize_object(item) for item in obj]
+        if hasattr(obj, '__dict__'):
+            return {k: serialize_object(v) for k, v in vars(obj).items()}
+        return str(obj)
+
+    serialized_result = serialize_object(result)
+
+    text_content = ""
+    if isinstance(serialized_result, list):
+        for item in serialized_result:
+            if isinstance(item, dict) and 'text' in item:
+                text_content += item['text'] + "\n"
+            elif isinstance(item, str):
+                text_content += item + "\n"
+    elif isinstance(serialized_result, dict) and 'text' in serialized_result:
+        text_content = serialized_result['text']
+    elif isinstance(serialized_result, str):
+        text_content = serialized_result
+    else:
+        text_content = str(serialized_result)
+
+    return dict(
+        base,
+        success=True,
+        result=serialized_result,
+        text=text_content.strip(),
+        include_history=include_history,
+        allow_function_call=allow_function_call,
+    )
+
+
 # API路由 - 批量调用所有预启动工具（自动连接服务器）
 @app.route('/api/mcp/prestart/call', methods=['POST'])
 def call_all_prestart_tools():
@@ -1494,7 +1558,8 @@ def call_all_prestart_tools():
                 "message": "没有配置预启动工具"
             })
 
-        results: List[Dict[str, Any]] = []
+        results: List[Any] = []
+        pending_calls = []  # (results 中的位置, 标签, 调用函数)
         temp_connected_servers: List[int] = []
 
         for server_id, tool_map in configs.items():
@@ -1533,7 +1598,7 @@ def call_all_prestart_tools():
             if is_temp_connection:
                 temp_connected_servers.append(server_id)
 
-            # 调用该服务器上的所有预启动工具
+            # 收集该服务器上的所有预启动工具，稍后统一并发调用
             for tool_name, cfg in tool_map.items():
                 # 过滤工具
                 if filter_tool_names and tool_name not in filter_tool_names:
@@ -1542,6 +1607,7 @@ def call_all_prestart_tools():
                 params = cfg.get("params", {}) if isinstance(cfg, dict) else {}
                 include_history = cfg.get("include_history", True) if isinstance(cfg, dict) else True
                 allow_function_call = cfg.get("allow_function_call", False) if isinstance(cfg, dict) else False
+                cache_ttl = cfg.get("cache_ttl", 0) if isinstance(cfg, dict) else 0
 
                 # 替换占位符
                 try:
@@ -1549,66 +1615,34 @@ def call_all_prestart_tools():
                 except Exception:
                     filled_params = params or {}
 
-                # 调用工具
-                try:
-                    call_success, result = call_mcp_tool(server_id, tool_name, filled_params, skip_enabled_check=True)
-
-                    if call_success:
-                        def serialize_object(obj):
-                            if obj is None:
-                                return None
-                            if isinstance(obj, (str, int, float, bool)):
-                                return obj
-                            if isinstance(obj, dict):
-                                return {k: serialize_object(v) for k, v in obj.items()}
-                            if isinstance(obj, (list, tuple)):
-                                return [serialize_object(item) for item in obj]
-                            if hasattr(obj, '__dict__'):
-                                return {k: serialize_object(v) for k, v in vars(obj).items()}
-                            return str(obj)
-
-                        serialized_result = serialize_object(result)
-
-                        text_content = ""
-                        if isinstance(serialized_result, list):
-                            for item in serialized_result:
-                                if isinstance(item, dict) and 'text' in item:
-                                    text_content += item['text'] + "\n"
-                                elif isinstance(item, str):
-                                    text_content += item + "\n"
-                        elif isinstance(serialized_result, dict) and 'text' in serialized_result:
-                            text_content = serialized_result['text']
-                        elif isinstance(serialized_result, str):
-                            text_content = serialized_result
-                        else:
-                            text_content = str(serialized_result)
-
-                        results.append({
-                            "server_id": server_id,
-                            "server_name": server.get("name", f"Server {server_id}"),
-                            "tool": tool_name,
-                            "success": True,
-                            "result": serialized_result,
-                            "text": text_content.strip(),
-                            "include_history": include_history,
-                            "allow_function_call": allow_function_call
-                        })
-                    else:
-                        results.append({
-                            "server_id": server_id,
-                            "server_name": server.get("name", f"Server {server_id}"),
-                            "tool": tool_name,
-                            "success": False,
-                            "error": result
-                        })
-                except Exception as e:
-                    results.append({
-                        "server_id": server_id,
-                        "server_name": server.get("name", f"Server {server_id}"),
-                        "tool": tool_name,
-                        "success": False,
-                        "error": str(e)
-                    })
+                base = {
+                    "server_id": server_id,
+                    "server_name": server.get("name", f"Server {server_id}"),
+                    "tool": tool_name,
+                }
+                results.append((base, include_history, allow_function_call))
+                pending_calls.append((
+                    len(results) - 1,
+                    tool_name,
+                    lambda server_id=server_id, tool_name=tool_name, filled_params=filled_params, cache_ttl=cache_ttl:
+                        tool_result_cache.call_cached(
+                            server_id, tool_name, filled_params, cache_ttl,
+                            lambda: call_mcp_tool(server_id, tool_name, filled_params, skip_enabled_check=True),
+                        ),
+                ))
+
+        # 并发调用，按配置顺序回填结果；超时的工具标记为失败
+        outcomes = prestart_runner.run_calls([
+            (label, fn, (results[index][0]["server_id"], label)) for index, label, fn in pending_calls
+        ])
+        for (index, _, _), outcome in zip(pending_calls, outcomes):
+            base, include_history, allow_function_call = results[index]
+            if outcome.success:
+                results[index] = _format_prestart_result(base, outcome.result, include_history, allow_function_call)
+            elif outcome.status == "timeout":
+                results[index] = dict(base, success=False, error="调用超时")
+            else:
+                results[index] = dict(base, success=False, error=outcome.result)
 
         if not keep_connection and temp_connected_servers:
             for server_id in temp_connected_servers:
@@ -1642,6 +1676,25 @@ def call_all_prestart_tools():
             "error": f"批量调用预启动工具失败: {str(e)}"
         }), 500
 
+# API路由 - 工具结果缓存统计
+@app.route('/api/mcp/tool-cache', methods=['GET'])
+def get_tool_cache_stats():
+    return jsonify({"success": True, "stats": tool_result_cache.stats()})
+
+# API路由 - 清空工具结果缓存（可按 server_id / tool 过滤）
+@app.route('/api/mcp/tool-cache', methods=['DELETE'])
+def clear_tool_cache():
+    data = request.get_json(silent=True) or {}
+    server_id = data.get('server_id', request.args.get('server_id'))
+    tool_name = data.get('tool', request.args.get('tool'))
+    try:
+        server_id = int(server_id) if server_id not in (None, '') else None
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "server_id 必须是整数"}), 400
+    removed = tool_result_cache.invalidate(server_id, tool_name or None)
+    util.log(1, f"已清除 {removed} 条MCP工具缓存结果")
+    return jsonify({"success": True, "removed": removed, "stats": tool_result_cache.stats()})
+
 # 启动连接检查
 def start_connection_check():
     """
@@ -5,6 +5,8 @@ Persisted registry for MCP prestart tools.
 
 A prestart tool will be invoked automatically before LLM reasoning. This
 module tracks per-server tool selections and their parameter templates.
+``cache_ttl`` (seconds, 0 = off) lets idempotent tools reuse results through
+``tool_result_cache``.
 """
 
 from __future__ import annotations
@@ -46,10 +48,12 @@ def _ensure_loaded() -> None:
                     params = cfg.get("params", {}) if isinstance(cfg, Mapping) else {}
                     include_history = cfg.get("include_history", True) if isinstance(cfg, Mapping) else True
                     allow_function_call = cfg.get("allow_function_call", False) if isinstance(cfg, Mapping) else False
+                    cache_ttl = cfg.get("cache_ttl", 0) if isinstance(cfg, Mapping) else 0
                     normalized[str(name)] = {
                         "params": params if isinstance(params, Mapping) else {},
                         "include_history": include_history,
-                        "allow_function_call": allow_function_call
+                        "allow_function_call": allow_function_call,
+                        "cache_ttl": _coerce_ttl(cache_ttl)
                     }
                 if normalized:
                     loaded[server_id] = normalized
@@ -58,6 +62,13 @@ def _ensure_loaded() -> None:
             _prestart = {}
 
 
+def _coerce_ttl(value: Any) -> float:
+    try:
+        return max(0.0, float(value or 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
 def _save_locked() -> None:
     os.makedirs(os.path.dirname(_data_file), exist_ok=True)
     with open(_data_file, "w", encoding="utf-8") as f:
@@ -83,7 +94,7 @@ def get_server_map(server_id: int) -> Dict[str, Dict[str, Any]]:
         return dict(_prestart.get(server_id, {}))
 
 
-def set_prestart(server_id: int, tool_name: str, params: Dict[str, Any], include_history: bool = True, allow_function_call: bool = False) -> None:
+def set_prestart(server_id: int, tool_name: str, params: Dict[str, Any], include_history: bool = True, allow_function_call: bool = False, cache_ttl: float = 0) -> None:
     """Enable prestart for a tool with parameter template and options."""
     if not tool_name:
         return
@@ -93,7 +104,8 @@ def set_prestart(server_id: int, tool_name: str, params: Dict[str, Any], include
         server_map[str(tool_name)] = {
             "params": params or {},
             "include_history": include_history,
-            "allow_function_call": allow_function_call
+            "allow_function_call": allow_function_call,
+            "cache_ttl": _coerce_ttl(cache_ttl)
         }
         _save_locked()
 
@@ -120,3 +132,11 @@ def is_prestart(server_id: int, tool_name: str) -> bool:
     with _lock:
         return tool_name in _prestart.get(int(server_id), {})
 
+
+
+def get_cache_ttl(server_id: int, tool_name: str) -> float:
+    """Return the result cache TTL configured for a tool (0 when not cached)."""
+    _ensure_loaded()
+    with _lock:
+        cfg = _prestart.get(int(server_id), {}).get(tool_name)
+        return cfg.get("cache_ttl", 0) if isinstance(cfg, dict) else 0
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Concurrent execution of prestart MCP tool calls.
+
+Prestart tools used to run one after another before the LLM prompt was built,
+so time-to-first-token was the sum of their latencies. ``run_calls`` runs
+each batch on its own thread pool and waits with a per-tool timeout (counted
+from when the call actually starts) and a global budget; results come back in
+the submitted (configured) order and slow or failed tools are reported so
+callers can skip them.
+
+A timed-out call cannot be cancelled and keeps its worker thread until it
+returns. Until then later batches skip that tool (status ``skipped``) instead
+of piling more threads onto a hung server; calls that have not timed out
+never block each other, so concurrent users each get their own call.
+
+Config (``mcp_prestart`` in config.json, optional):
+  max_workers    max concurrent calls within one batch
+  tool_timeout   seconds a single tool may take once started
+  total_budget   seconds all prestart tools may take together
+"""
+
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from utils import util
+
+DEFAULT_CONFIG = {
+    "max_workers": 8,
+    "tool_timeout": 8.0,
+    "total_budget": 12.0,
+}
+
+# 已超时但仍未返回的调用数，按工具 key 计；大于 0 时跳过该工具
+_hung: Dict[Hashable, int] = {}
+_hung_lock = threading.Lock()
+
+
+@dataclass
+class CallOutcome:
+    """Result of one prestart call; ``status`` is ok / failed / error / timeout / skipped."""
+    label: str
+    status: str
+    result: Any
+    elapsed: float
+
+    @property
+    def success(self) -> bool:
+        return self.status == "ok"
+
+
+def _load_config() -> dict:
+    conf = dict(DEFAULT_CONFIG)
+    cfg = sys.modules.get("utils.config_util")
+    try:
+        if cfg is not None and cfg.config:
+            conf.update(cfg.config.get("mcp_prestart", {}) or {})
+    except Exception:
+        pass
+    return conf
+
+
+def _is_hung(key: Hashable) -> bool:
+    with _hung_lock:
+        return bool(_hung.get(key))
+
+
+class _Call:
+    """Runs one tool in a worker thread and records when it actually started."""
+
+    def __init__(self, key: Hashable, fn: Callable[[], Tuple[bool, Any]]):
+        self.key = key
+        self.fn = fn
+        self.started = threading.Event()
+        self.start_time: Optional[float] = None
+        self.done = False
+        self.hung = False
+
+    def __call__(self) -> Tuple[bool, Any, float]:
+        self.start_time = time.perf_counter()
+        self.started.set()
+        try:
+            success, result = self.fn()
+            return success, result, time.perf_counter() - self.start_time
+        finally:
+            with _hung_lock:
+                self.done = True
+                if self.hung:
+                    count = _hung.get(self.key, 0) - 1
+                    if count > 0:
+                        _hung[self.key] = count
+                    else:
+                        _hung.pop(self.key, None)
+
+    def mark_hung(self) -> None:
+        """Called on timeout: while the call is still running, skip its key."""
+        with _hung_lock:
+            if not self.done and not self.hung:
+                self.hung = True
+                _hung[self.key] = _hung.get(self.key, 0) + 1
+
+
+def run_calls(
+    calls: Sequence[Tuple],
+    *,
+    tool_timeout: Optional[float] = None,
+    total_budget: Optional[float] = None,
+    log_prefix: str = "预启动工具",
+) -> List[CallOutcome]:
+    """
+    Run ``(label, fn)`` or ``(label, fn, key)`` tuples concurrently; ``fn``
+    returns ``(success, result)`` like ``call_mcp_tool``. ``key`` identifies
+    the tool (defaults to ``label``). Returns one ``CallOutcome`` per call,
+    in order.
+
+    A timed-out call keeps running (MCP calls cannot be cancelled mid-flight)
+    but its result is discarded; until it returns, calls with the same key
+    are skipped. Calls that are merely in flight do not block the key.
+    """
+    if not calls:
+        return []
+    conf = _load_config()
+    tool_timeout = float(tool_timeout if tool_timeout is not None else conf.get("tool_timeout", 8.0))
+    total_budget = float(total_budget if total_budget is not None else conf.get("total_budget", 12.0))
+
+    start = time.perf_counter()
+    budget_deadline = start + total_budget
+    pending = []
+    for entry in calls:
+        label, fn = entry[0], entry[1]
+        key = entry[2] if len(entry) > 2 else label
+        pending.append((label, None if _is_hung(key) else _Call(key, fn)))
+
+    runnable = [call for _, call in pending if call is not None]
+    # 每批单独建池：上一批超时未返回的调用不会占住这一批的工作线程
+    executor = None
+    if runnable:
+        max_workers = max(1, min(len(runnable), int(conf.get("max_workers", 8))))
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mcp-prestart")
+    futures = [(label, call, executor.submit(call) if call is not None else None) for label, call in pending]
+
+    outcomes: List[CallOutcome] = []
+    for label, call, future in futures:
+        if future is None:
+            outcomes.append(CallOutcome(label, "skipped", "上一次调用超时仍未结束", 0.0))
+            continue
+        # 单工具超时从真正开始执行时计算，且不超过全局预算
+        if not call.started.wait(max(0.0, budget_deadline - time.perf_counter())):
+            if not future.cancel():
+                call.mark_hung()
+            outcomes.append(CallOutcome(label, "timeout", None, 0.0))
+            continue
+        remaining = min(call.start_time + tool_timeout, budget_deadline) - time.perf_counter()
+        try:
+            success, result, elapsed = future.result(timeout=max(0.0, remaining))
+            outcomes.append(CallOutcome(label, "ok" if success else "failed", result, elapsed))
+        except FutureTimeoutError:
+            call.mark_hung()
+            outcomes.append(CallOutcome(label, "timeout", None, time.perf_counter() - call.start_time))
+        except Exception as exc:
+            outcomes.append(CallOutcome(label, "error", str(exc), time.perf_counter() - call.start_time))
+    if executor is not None:
+        executor.shutdown(wait=False)
+
+    total = time.perf_counter() - start
+    timings = ", ".join(
+        f"{o.label}={o.elapsed * 1000:.0f}ms" + ("" if o.success else f"({o.status})") for o in outcomes
+    )
+    util.log(1, f"{log_prefix} {len(outcomes)} 个并发完成，耗时 {total * 1000:.0f}ms: {timings}")
+    return outcomes
@@ -11,7 +11,7 @@ from __future__ import annotations
 
 from typing import Any, Dict, List, Optional, Tuple
 
-from faymcp import prestart_registry, tool_registry, resource_registry
+from faymcp import prestart_registry, tool_registry, resource_registry, tool_result_cache
 
 
 _RESOURCE_TEXT_MAX_CHARS = 8000  # 注入 prompt 的资源文本总上限
@@ -106,6 +106,7 @@ def list_runnable_prestart_tools() -> List[Dict[str, Any]]:
                     "params": params if isinstance(params, dict) else {},
                     "include_history": cfg.get("include_history", True),
                     "allow_function_call": cfg.get("allow_function_call", False),
+                    "cache_ttl": cfg.get("cache_ttl", 0),
                 }
             )
 
@@ -119,15 +120,28 @@ def call_tool(
     *,
     skip_enabled_check: bool = False,
 ) -> Tuple[bool, Any]:
-    """Call an MCP tool through the in-process service."""
+    """
+    Call an MCP tool through the in-process service. Tools with a prestart
+    ``cache_ttl`` are served from ``tool_result_cache`` while fresh.
+    """
     try:
         from faymcp import mcp_service
     except Exception as exc:
         return False, str(exc)
 
-    return mcp_service.call_mcp_tool(
+    try:
+        ttl = prestart_registry.get_cache_ttl(server_id, tool_name)
+    except Exception:
+        ttl = 0
+    return tool_result_cache.call_cached(
         server_id,
         tool_name,
-        params or {},
-        skip_enabled_check=skip_enabled_check,
+        params,
+        ttl,
+        lambda: mcp_service.call_mcp_tool(
+            server_id,
+            tool_name,
+            params or {},
+            skip_enabled_check=skip_enabled_check,
+        ),
     )
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+TTL + LRU cache for idempotent MCP tool results.
+
+Many prestart tools are pure functions of the question (knowledge lookups) or
+change slowly (schedule listings), yet they used to hit the MCP server on
+every turn. A tool opts in by setting ``cache_ttl`` (seconds) in its prestart
+registry entry; results are keyed on (server_id, tool, normalized params) and
+only successful calls are stored.
+
+Config (``mcp_tool_cache`` in config.json, optional):
+  enabled       global switch
+  max_entries   LRU size limit shared by all tools
+"""
+
+from __future__ import annotations
+
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+DEFAULT_CONFIG = {
+    "enabled": True,
+    "max_entries": 256,
+}
+
+_lock = threading.RLock()
+# key -> (expires_at, result)
+_entries: "OrderedDict[Tuple[int, str, str], Tuple[float, Any]]" = OrderedDict()
+# (server_id, tool) -> {"hits", "misses", "evictions"}
+_stats: Dict[Tuple[int, str], Dict[str, int]] = {}
+
+
+def _load_config() -> dict:
+    conf = dict(DEFAULT_CONFIG)
+    cfg = sys.modules.get("utils.config_util")
+    try:
+        if cfg is not None and cfg.config:
+            conf.update(cfg.config.get("mcp_tool_cache", {}) or {})
+    except Exception:
+        pass
+    return conf
+
+
+def _normalize(value: Any) -> Any:
+    # 字符串去掉首尾空白并合并连续空白，使 "天气 " 与 "天气" 命中同一条缓存
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def make_key(server_id: int, tool_name: str, params: Optional[Dict[str, Any]]) -> Tuple[int, str, str]:
+    """Cache key: server id, tool name and canonical JSON of the normalized params."""
+    canonical = json.dumps(_normalize(params or {}), ensure_ascii=False, sort_keys=True, default=str)
+    return int(server_id), str(tool_name), canonical
+
+
+def _counter(server_id: int, tool_name: str) -> Dict[str, int]:
+    return _stats.setdefault((int(server_id), str(tool_name)), {"hits": 0, "misses": 0, "evictions": 0})
+
+
+def get(key: Tuple[int, str, str]) -> Tuple[bool, Any]:
+    """Return ``(found, result)``; expired entries are dropped on access."""
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            _entries.move_to_end(key)
+            _counter(key[0], key[1])["hits"] += 1
+            return True, entry[1]
+        if entry is not None:
+            del _entries[key]
+        _counter(key[0], key[1])["misses"] += 1
+        return False, None
+
+
+def put(key: Tuple[int, str, str], result: Any, ttl: float) -> None:
+    if ttl <= 0:
+        return
+    max_entries = max(1, int(_load_config().get("max_entries", 256)))
+    with _lock:
+        _entries[key] = (time.monotonic() + ttl, result)
+        _entries.move_to_end(key)
+        while len(_entries) > max_entries:
+            old_key, _ = _entries.popitem(last=False)
+            _counter(old_key[0], old_key[1])["evictions"] += 1
+
+
+def call_cached(
+    server_id: int,
+    tool_name: str,
+    params: Optional[Dict[str, Any]],
+    ttl: Optional[float],
+    call_fn: Callable[[], Tuple[bool, Any]],
+) -> Tuple[bool, Any]:
+    """
+    Return a cached result when fresh, otherwise run ``call_fn`` (returning
+    ``(success, result)`` like ``call_mcp_tool``) and cache it on success.
+    ``ttl`` of 0/None or a disabled cache bypasses it entirely.
+    """
+    try:
+        ttl = float(ttl or 0)
+    except (TypeError, ValueError):
+        ttl = 0.0
+    if ttl <= 0 or not _load_config().get("enabled", True):
+        return call_fn()
+    key = make_key(server_id, tool_name, params)
+    found, result = get(key)
+    if found:
+        return True, result
+    success, result = call_fn()
+    if success:
+        put(key, result, ttl)
+    return success, result
+
+
+def invalidate(server_id: Optional[int] = None, tool_name: Optional[str] = None) -> int:
+    """Drop cached results for a server, a single tool, or everything; returns the count."""
+    with _lock:
+        if server_id is None and tool_name is None:
+            removed = len(_entries)
+            _entries.clear()
+            return removed
+        doomed = [
+            key for key in _entries
+            if (server_id is None or key[0] == int(server_id)) and (tool_name is None or key[1] == tool_name)
+        ]
+        for key in doomed:
+            del _entries[key]
+        return len(doomed)
+
+
+def clear() -> None:
+    """Drop all entries and reset statistics."""
+    with _lock:
+        _entries.clear()
+        _stats.clear()
+
+
+def _summary(counter: Dict[str, int], entries: int) -> Dict[str, Any]:
+    lookups = counter["hits"] + counter["misses"]
+    return {
+        "hits": counter["hits"],
+        "misses": counter["misses"],
+        "evictions": counter["evictions"],
+        "entries": entries,
+        "hit_rate": round(counter["hits"] / lookups, 4) if lookups else 0.0,
+    }
+
+
+def tool_stats(server_id: int, tool_name: str) -> Dict[str, Any]:
+    with _lock:
+        counter = _stats.get((int(server_id), str(tool_name)), {"hits": 0, "misses": 0, "evictions": 0})
+        entries = sum(1 for key in _entries if key[0] == int(server_id) and key[1] == tool_name)
+        return _summary(counter, entries)
+
+
+def stats() -> Dict[str, Any]:
+    """Overall and per-tool hit/miss counters for the management UI."""
+    with _lock:
+        per_entry: Dict[Hashable, int] = {}
+        for key in _entries:
+            per_entry[key[:2]] = per_entry.get(key[:2], 0) + 1
+        tools = [
+            dict(server_id=sid, tool=name, **_summary(counter, per_entry.get((sid, name), 0)))
+            for (sid, name), counter in sorted(_stats.items())
+        ]
+        total = {"hits": 0, "misses": 0, "evictions": 0}
+        for counter in _stats.values():
+            for field in total:
+                total[field] += counter[field]
+        conf = _load_config()
+        return dict(
+            _summary(total, len(_entries)),
+            enabled=bool(conf.get("enabled", True)),
+            max_entries=int(conf.get("max_entries", 256)),
+            tools=tools,
+        )
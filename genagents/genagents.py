@@ -11,6 +11,7 @@ from utils import util
 
 from genagents.modules.interaction import *
 from genagents.modules.memory_stream import *
+from genagents.modules import memory_store
 
 
 # ############################################################################
@@ -20,29 +21,25 @@ from genagents.modules.memory_stream import *
 class GenerativeAgent: 
   def __init__(self, agent_folder=None):
     if agent_folder: 
-      # 检查记忆目录是否存在
-      memory_stream_exists = check_if_file_exists(f"{agent_folder}/memory_stream/nodes.json") and check_if_file_exists(f"{agent_folder}/memory_stream/embeddings.json")
-      
-      # 加载记忆流数据
+      # 加载记忆流数据（二进制矩阵格式，兼容旧版 embeddings.json）
       try:
-        if memory_stream_exists:
-          with open(f"{agent_folder}/memory_stream/embeddings.json", 'r', encoding='utf-8') as json_file:
-            embeddings = json.load(json_file)
-          with open(f"{agent_folder}/memory_stream/nodes.json", 'r', encoding='utf-8') as json_file:
-            nodes = json.load(json_file)
-        else:
-          embeddings = {}
-          nodes = []
+        nodes, embeddings, loaded = memory_store.load_memory_stream(
+          f"{agent_folder}/memory_stream", with_state=True)
       except Exception as e:
         util.log(1, f"加载代理记忆时出错: {str(e)}")
         # 如果加载失败，创建空的记忆
         embeddings = {}
         nodes = []
+        loaded = None
 
       self.id = uuid.uuid4()
       # 从配置文件实时加载数字人属性
       self.scratch = self._load_scratch_from_config()
       self.memory_stream = MemoryStream(nodes, embeddings)
+      memory_store.bind_store_state(f"{agent_folder}/memory_stream", self.memory_stream, loaded)
+      ann_index = memory_store.load_ann_index(f"{agent_folder}/memory_stream")
+      if ann_index is not None:
+        self.memory_stream.ann_index = ann_index
 
     else: 
       self.id = uuid.uuid4()
@@ -123,13 +120,8 @@ class GenerativeAgent:
           self.memory_stream.embeddings = {}
       
       # Saving the agent's memory stream. This includes saving the embeddings 
-      # as well as the nodes. 
-      with open(f"{storage}/memory_stream/embeddings.json", "w", encoding='utf-8') as json_file:
-        json.dump(self.memory_stream.embeddings, 
-                  json_file, ensure_ascii=False, indent=2)
-      with open(f"{storage}/memory_stream/nodes.json", "w", encoding='utf-8') as json_file:
-        json.dump([node.package() for node in self.memory_stream.seq_nodes], 
-                  json_file, ensure_ascii=False, indent=2)
+      # (as a float32 matrix) as well as the nodes. 
+      memory_store.save_memory_stream(f"{storage}/memory_stream", self.memory_stream)
 
       # Saving the agent's meta information. 
       with open(f"{storage}/meta.json", "w", encoding='utf-8') as json_file:
@@ -140,6 +132,28 @@ class GenerativeAgent:
       util.log(1, f"保存代理记忆时出错: {str(e)}")
 
 
+  def flush(self, save_directory):
+    """
+    增量落盘：只把上次落盘之后新增的记忆节点追加到日志，不重写整个记忆文件。
+    没有落盘基线或记忆被整体替换时，自动退化为 save() 同样的全量快照。
+
+    Parameters:
+      save_directory: str - 保存目录的路径
+    Returns: 
+      None
+    """
+    try:
+      if self.memory_stream.embeddings is None:
+          self.memory_stream.embeddings = {}
+      memory_store.flush_memory_stream(f"{save_directory}/memory_stream", self.memory_stream)
+      meta_path = f"{save_directory}/meta.json"
+      if not os.path.exists(meta_path):
+        with open(meta_path, "w", encoding='utf-8') as json_file:
+          json.dump(self.package(), json_file, ensure_ascii=False, indent=2)
+    except Exception as e:
+      util.log(1, f"增量保存代理记忆时出错: {str(e)}")
+
+
   def get_fullname(self): 
     if "first_name" in self.scratch and "last_name" in self.scratch:
       return f"{self.scratch['first_name']} {self.scratch['last_name']}"
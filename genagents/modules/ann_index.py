@@ -0,0 +1,316 @@
+import numpy as np
+
+
+# ##############################################################################
+# ###                        IVF APPROXIMATE NN INDEX                        ###
+# ##############################################################################
+#
+# 纯 NumPy 的倒排文件（IVF）索引：用球面 k-means 把 embedding 聚成 nlist 个
+# 簇，每个节点记下所属簇号。检索时只对与焦点向量最接近的 nprobe 个簇里的
+# 节点算精确余弦，其余节点视为"不相关"，再交给 recency/importance 重排。
+#
+# 索引与 MemoryStream.seq_nodes 逐行对齐（第 i 行 = seq_nodes[i]），簇号 -1
+# 表示该行没有可用 embedding（缺失、维度不符或零向量），这些行永远进入候选集，
+# 与精确路径里 0.5 的兜底分数保持一致。
+
+_GROWTH_MIN = 64
+TRAIN_SAMPLES_PER_LIST = 64
+TRAIN_ITERATIONS = 10
+ASSIGN_CHUNK = 4096
+
+
+def default_nlist(n):
+  """簇数取 sqrt(n)，限制在 [16, 1024]。"""
+  return int(min(1024, max(16, round(np.sqrt(max(n, 1))))))
+
+
+def _dominant_dim(vectors):
+  dims = {}
+  for vec in vectors:
+    length = _length(vec)
+    if length:
+      dims[length] = dims.get(length, 0) + 1
+  if not dims:
+    return None
+  return max(dims.items(), key=lambda kv: kv[1])[0]
+
+
+def _length(vec):
+  if isinstance(vec, np.ndarray):
+    return vec.shape[0] if vec.ndim == 1 and vec.dtype.kind in "iufb" else None
+  if isinstance(vec, (list, tuple)) and vec and isinstance(vec[0], (int, float)):
+    return len(vec)
+  return None
+
+
+def _stack(vectors, dim):
+  """把一组向量堆成 float32 矩阵，维度不符的行置零（分配时会被记为 -1）。"""
+  out = np.zeros((len(vectors), dim), dtype=np.float32)
+  for i, vec in enumerate(vectors):
+    if _length(vec) == dim:
+      out[i] = vec
+  return out
+
+
+def _unit_rows(matrix):
+  norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+  norms[norms == 0] = 1.0
+  return matrix / norms
+
+
+def spherical_kmeans(samples, nlist, iterations=TRAIN_ITERATIONS, seed=0):
+  """
+  球面 k-means（余弦距离）。samples 需已按行归一化；返回 nlist x dim 的单位向量
+  质心。空簇用随机样本重新播种。
+  """
+  rng = np.random.default_rng(seed)
+  n = samples.shape[0]
+  nlist = min(nlist, n)
+  centroids = samples[rng.choice(n, nlist, replace=False)].copy()
+  for _ in range(iterations):
+    labels = np.argmax(samples @ centroids.T, axis=1)
+    sums = np.zeros_like(centroids)
+    np.add.at(sums, labels, samples)
+    counts = np.bincount(labels, minlength=nlist)
+    empty = np.flatnonzero(counts == 0)
+    if empty.size:
+      sums[empty] = samples[rng.choice(n, empty.size, replace=False)]
+    centroids = _unit_rows(sums)
+  return centroids.astype(np.float32)
+
+
+class IvfIndex:
+  """
+  增量维护的 IVF 索引。
+
+  - train()：按当前全部节点训练质心并重新分配，由保存/启动路径调用
+  - append()：append_prepared_node / _add_node 追加节点后调用，只分配新行
+  - sync()：检索前与 seq_nodes 对齐；列表被整体替换时用现有质心整体重分配
+  - candidates()：返回焦点向量最近 nprobe 个簇内的行 + 无 embedding 的行
+  """
+
+  def __init__(self, centroids=None, trained_size=0):
+    self.centroids = centroids
+    self.trained_size = trained_size
+    self._nodes_ref = None
+    self._embeddings_ref = None
+    self._size = 0
+    self._assign = np.zeros(0, dtype=np.int32)
+    self._node_ids = np.zeros(0, dtype=np.int64)
+    # 从磁盘加载、尚未与 seq_nodes 核对的分配结果
+    self._pending = None
+
+
+  @property
+  def trained(self):
+    return self.centroids is not None
+
+
+  @property
+  def dim(self):
+    return None if self.centroids is None else self.centroids.shape[1]
+
+
+  @property
+  def nlist(self):
+    return 0 if self.centroids is None else self.centroids.shape[0]
+
+
+  @property
+  def size(self):
+    return self._size
+
+
+  def needs_training(self, n, min_nodes):
+    """节点数达到阈值且尚未训练，或比上次训练时翻了一倍，需要（重新）训练。"""
+    if n < min_nodes:
+      return False
+    return not self.trained or n >= 2 * self.trained_size
+
+
+  def invalidate(self):
+    """embedding 被外部修改（如维度修复）后调用，下次 sync 时整体重分配。"""
+    self._nodes_ref = None
+    self._pending = None
+
+
+  # ---------------------------------------------------------------------------
+  # 训练与分配
+  # ---------------------------------------------------------------------------
+
+  def train(self, seq_nodes, embeddings, nlist=None, seed=0):
+    """用当前节点的 embedding 训练质心并重新分配全部行。返回是否训练成功。"""
+    embeddings = embeddings or {}
+    vectors = [embeddings.get(node.content) for node in seq_nodes]
+    dim = _dominant_dim(vectors)
+    if dim is None:
+      return False
+    valid = [i for i, vec in enumerate(vectors) if _length(vec) == dim]
+    if not valid:
+      return False
+    nlist = nlist or default_nlist(len(valid))
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(valid), nlist * TRAIN_SAMPLES_PER_LIST)
+    sample_rows = rng.choice(len(valid), sample_size, replace=False)
+    samples = _unit_rows(_stack([vectors[valid[i]] for i in sample_rows], dim))
+    samples = samples[np.linalg.norm(samples, axis=1) > 0]
+    if samples.shape[0] == 0:
+      return False
+    self.centroids = spherical_kmeans(samples, nlist, seed=seed)
+    self.trained_size = len(seq_nodes)
+    self._reassign_all(seq_nodes, embeddings)
+    return True
+
+
+  def _assign_vectors(self, vectors):
+    """批量求最近质心（内积最大即余弦最大），非法/零向量记 -1。"""
+    labels = np.full(len(vectors), -1, dtype=np.int32)
+    dim = self.dim
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+      chunk = vectors[start:start + ASSIGN_CHUNK]
+      block = _stack(chunk, dim)
+      ok = np.array([_length(v) == dim for v in chunk], dtype=bool)
+      ok &= np.any(block != 0, axis=1)
+      if ok.any():
+        labels[start:start + len(chunk)][ok] = np.argmax(block[ok] @ self.centroids.T, axis=1)
+    return labels
+
+
+  def _reassign_all(self, seq_nodes, embeddings):
+    self._nodes_ref = seq_nodes
+    self._embeddings_ref = embeddings
+    self._pending = None
+    self._size = 0
+    self._assign = np.zeros(0, dtype=np.int32)
+    self._node_ids = np.zeros(0, dtype=np.int64)
+    self._append_rows(seq_nodes, embeddings, 0)
+
+
+  def _append_rows(self, seq_nodes, embeddings, start):
+    nodes = seq_nodes[start:]
+    if not nodes:
+      return
+    embeddings = embeddings or {}
+    labels = self._assign_vectors([embeddings.get(node.content) for node in nodes])
+    ids = np.array([getattr(node, "node_id", -1) for node in nodes], dtype=np.int64)
+    self._reserve(self._size + len(nodes))
+    self._assign[self._size:self._size + len(nodes)] = labels
+    self._node_ids[self._size:self._size + len(nodes)] = ids
+    self._size += len(nodes)
+
+
+  def _reserve(self, needed):
+    if needed <= self._assign.shape[0]:
+      return
+    new_cap = max(needed, self._assign.shape[0] * 2, _GROWTH_MIN)
+    assign = np.full(new_cap, -1, dtype=np.int32)
+    assign[:self._size] = self._assign[:self._size]
+    node_ids = np.full(new_cap, -1, dtype=np.int64)
+    node_ids[:self._size] = self._node_ids[:self._size]
+    self._assign = assign
+    self._node_ids = node_ids
+
+
+  # ---------------------------------------------------------------------------
+  # 增量维护
+  # ---------------------------------------------------------------------------
+
+  def append(self, seq_nodes, embeddings):
+    """
+    追加节点后的增量维护：索引与列表同步时只分配新增的行（一次 nlist x dim
+    的乘法）；不同步时什么也不做，留给下次检索前的 sync() 处理，避免在调用方
+    持锁时做全量重分配。
+    """
+    if (not self.trained
+        or seq_nodes is not self._nodes_ref
+        or embeddings is not self._embeddings_ref
+        or len(seq_nodes) < self._size):
+      return
+    self._append_rows(seq_nodes, embeddings, self._size)
+
+
+  def sync(self, seq_nodes, embeddings):
+    """检索前与 seq_nodes 对齐。"""
+    if not self.trained:
+      return
+    if (seq_nodes is self._nodes_ref
+        and embeddings is self._embeddings_ref
+        and len(seq_nodes) >= self._size):
+      self._append_rows(seq_nodes, embeddings, self._size)
+      return
+    if self._pending is not None and self._adopt_pending(seq_nodes, embeddings):
+      return
+    self._reassign_all(seq_nodes, embeddings)
+
+
+  def _adopt_pending(self, seq_nodes, embeddings):
+    """磁盘上的分配结果与当前节点表前缀一致时直接复用，只补分配之后的新行。"""
+    assign, node_ids = self._pending
+    self._pending = None
+    count = assign.shape[0]
+    if count > len(seq_nodes):
+      return False
+    current = np.array([getattr(node, "node_id", -1) for node in seq_nodes[:count]], dtype=np.int64)
+    if not np.array_equal(current, node_ids):
+      return False
+    self._nodes_ref = seq_nodes
+    self._embeddings_ref = embeddings
+    self._size = 0
+    self._reserve(count)
+    self._assign[:count] = assign
+    self._node_ids[:count] = node_ids
+    self._size = count
+    self._append_rows(seq_nodes, embeddings, count)
+    return True
+
+
+  # ---------------------------------------------------------------------------
+  # 查询
+  # ---------------------------------------------------------------------------
+
+  def candidates(self, rows, focal_embedding, nprobe):
+    """
+    在 rows 中挑出候选行：所属簇是焦点向量最近的 nprobe 个簇之一，或没有可用
+    embedding。维度不符或焦点为零向量时返回 None，由调用方走精确路径。
+    """
+    if not self.trained or (rows.size and rows.max() >= self._size):
+      return None
+    focal = np.asarray(focal_embedding, dtype=np.float32)
+    if focal.ndim != 1 or focal.shape[0] != self.dim or not np.any(focal):
+      return None
+    nprobe = max(1, min(int(nprobe), self.nlist))
+    sims = self.centroids @ focal
+    if nprobe < self.nlist:
+      probe = np.argpartition(-sims, nprobe - 1)[:nprobe]
+    else:
+      probe = np.arange(self.nlist)
+    probe_mask = np.zeros(self.nlist + 1, dtype=bool)
+    probe_mask[probe] = True
+    # 簇号 -1 映射到末尾的哨兵位，恒为 True
+    probe_mask[-1] = True
+    return rows[probe_mask[self._assign[rows]]]
+
+
+  # ---------------------------------------------------------------------------
+  # 持久化
+  # ---------------------------------------------------------------------------
+
+  def state(self):
+    """返回可写入 npz 的数组字典。"""
+    return {
+      "centroids": self.centroids,
+      "trained_size": np.array(self.trained_size, dtype=np.int64),
+      "assign": self._assign[:self._size].copy(),
+      "node_ids": self._node_ids[:self._size].copy(),
+    }
+
+
+  @classmethod
+  def from_state(cls, data):
+    index = cls(np.asarray(data["centroids"], dtype=np.float32),
+                int(data["trained_size"]))
+    assign = np.asarray(data["assign"], dtype=np.int32)
+    node_ids = np.asarray(data["node_ids"], dtype=np.int64)
+    if assign.shape == node_ids.shape and (assign < index.nlist).all():
+      index._pending = (assign, node_ids)
+    return index
@@ -0,0 +1,408 @@
+import os
+import json
+import glob
+import base64
+import contextlib
+import threading
+from collections import Counter
+
+import numpy as np
+
+from utils import util
+from genagents.modules.ann_index import IvfIndex
+
+
+# ##############################################################################
+# ###                        MEMORY STREAM ON-DISK STORE                     ###
+# ##############################################################################
+#
+# memory_stream/ 目录布局：
+#   nodes.json             节点表（紧凑 JSON，不含 embedding）
+#   embeddings_index.json  embedding 索引：矩阵文件名、维度、每行对应的 content
+#   embeddings.<gen>.npy   float32 矩阵（N x dim），加载时 mmap，零拷贝
+#   memory.log             追加日志：快照之后新增的节点及其 embedding，每行一条 JSON
+#   ann_index.npz          IVF 近似检索索引：质心 + 每行所属簇（记忆量达到阈值后才有）
+#   embeddings.json        旧版布局（content -> 向量的 JSON），仅用于兼容读取和一次性迁移
+#
+# 矩阵文件按代号递增写新文件再切换索引，而不是原地覆盖：Windows 下已被 mmap
+# 的文件无法被替换，旧代号文件在下一次保存时尽力清理。
+#
+# 写入分两种：
+#   save_memory_stream   全量快照（节点表 + 矩阵），随后清空追加日志
+#   flush_memory_stream  只把上次落盘之后新增的节点追加到日志，O(新增条数)；
+#                        日志条数达到 LOG_COMPACT_RECORDS 时自动压缩成快照
+# 日志每行带写入时的快照代号，加载时只重放与当前快照代号一致、且节点表里
+# 还没有的记录，崩溃发生在快照与清空日志之间也不会重复。
+# 加载后用 bind_store_state 把快照代号和已重放的日志条数挂到 MemoryStream 上，
+# 之后的第一次 flush 直接追加，不必先写一次全量快照。
+
+NODES_FILE = "nodes.json"
+INDEX_FILE = "embeddings_index.json"
+LOG_FILE = "memory.log"
+ANN_FILE = "ann_index.npz"
+LEGACY_EMBEDDINGS_FILE = "embeddings.json"
+STORE_VERSION = 1
+LOG_COMPACT_RECORDS = 500
+
+_store_lock = threading.RLock()
+
+
+class _StoreState:
+  """记录某个 MemoryStream 已落盘到哪里，挂在 memory_stream._store_state 上。"""
+
+  def __init__(self, memory_stream_dir, memory_stream, generation):
+    self.memory_stream_dir = os.path.abspath(memory_stream_dir)
+    self.nodes_ref = memory_stream.seq_nodes
+    self.embeddings_ref = memory_stream.embeddings
+    self.count = len(memory_stream.seq_nodes)
+    self.generation = generation
+    self.log_records = 0
+
+  def matches(self, memory_stream_dir, memory_stream):
+    return (self.memory_stream_dir == os.path.abspath(memory_stream_dir)
+            and self.nodes_ref is memory_stream.seq_nodes
+            and self.embeddings_ref is memory_stream.embeddings
+            and self.count <= len(memory_stream.seq_nodes))
+
+
+def _atomic_write_json(path, data):
+  tmp_path = f"{path}.tmp"
+  with open(tmp_path, "w", encoding="utf-8") as f:
+    json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+  os.replace(tmp_path, path)
+
+
+def _vector_length(vec):
+  if isinstance(vec, np.ndarray):
+    return vec.shape[0] if vec.ndim == 1 else None
+  if isinstance(vec, (list, tuple)):
+    return len(vec)
+  return None
+
+
+def _to_json_vector(vec):
+  if isinstance(vec, np.ndarray):
+    return vec.tolist()
+  return vec
+
+
+def has_memory_files(memory_stream_dir):
+  """判断目录下是否已有可加载的记忆（新格式或旧 JSON 格式）。"""
+  nodes_path = os.path.join(memory_stream_dir, NODES_FILE)
+  if not os.path.exists(nodes_path) or os.path.getsize(nodes_path) <= 2:
+    return False
+  index_path = os.path.join(memory_stream_dir, INDEX_FILE)
+  legacy_path = os.path.join(memory_stream_dir, LEGACY_EMBEDDINGS_FILE)
+  return os.path.exists(index_path) or (
+    os.path.exists(legacy_path) and os.path.getsize(legacy_path) > 2)
+
+
+def _save_embeddings(memory_stream_dir, embeddings):
+  """
+  把 content -> 向量 的字典写成 float32 矩阵 + 索引。
+
+  主维度取出现次数最多的向量长度；其余长度（空向量、维度不一致的旧向量）
+  原样放进索引的 extra 字段，保证往返无损，留给维度检查去修复。
+  """
+  embeddings = embeddings or {}
+  lengths = Counter()
+  for vec in embeddings.values():
+    length = _vector_length(vec)
+    if length:
+      lengths[length] += 1
+  dim = lengths.most_common(1)[0][0] if lengths else 0
+
+  keys = []
+  rows = []
+  extra = {}
+  for content, vec in embeddings.items():
+    if dim and _vector_length(vec) == dim:
+      try:
+        rows.append(np.asarray(vec, dtype=np.float32))
+        keys.append(content)
+        continue
+      except (TypeError, ValueError):
+        pass
+    extra[content] = _to_json_vector(vec)
+
+  matrix = np.stack(rows) if rows else np.zeros((0, dim), dtype=np.float32)
+
+  with _store_lock:
+    index_path = os.path.join(memory_stream_dir, INDEX_FILE)
+    generation = _read_generation(memory_stream_dir) + 1
+    matrix_name = f"embeddings.{generation}.npy"
+    matrix_path = os.path.join(memory_stream_dir, matrix_name)
+    with open(matrix_path, "wb") as f:
+      np.save(f, matrix)
+    _atomic_write_json(index_path, {
+      "version": STORE_VERSION,
+      "generation": generation,
+      "matrix": matrix_name,
+      "dim": dim,
+      "keys": keys,
+      "extra": extra,
+    })
+    _remove_stale_matrices(memory_stream_dir, matrix_name)
+    return generation
+
+
+def _read_generation(memory_stream_dir):
+  index_path = os.path.join(memory_stream_dir, INDEX_FILE)
+  if not os.path.exists(index_path):
+    return -1
+  try:
+    with open(index_path, "r", encoding="utf-8") as f:
+      return int(json.load(f).get("generation", 0))
+  except Exception:
+    return -1
+
+
+def _remove_stale_matrices(memory_stream_dir, current_name):
+  for path in glob.glob(os.path.join(memory_stream_dir, "embeddings.*.npy")):
+    if os.path.basename(path) == current_name:
+      continue
+    try:
+      os.remove(path)
+    except OSError:
+      # 仍被 mmap 占用（Windows），下次保存再清理
+      pass
+
+
+def save_nodes(memory_stream_dir, seq_nodes):
+  nodes_data = []
+  for node in seq_nodes or []:
+    if node is not None and hasattr(node, "package"):
+      try:
+        nodes_data.append(node.package())
+      except Exception as e:
+        util.log(1, f"打包节点失败: {str(e)}")
+  _atomic_write_json(os.path.join(memory_stream_dir, NODES_FILE), nodes_data)
+
+
+def save_memory_stream(memory_stream_dir, memory_stream):
+  """整体保存节点表与 embedding 矩阵（快照），并清空追加日志。"""
+  os.makedirs(memory_stream_dir, exist_ok=True)
+  with _store_lock:
+    # 先写节点表再切换矩阵索引：两步之间崩溃时，旧代号的日志仍会被重放，
+    # 已在节点表中的记录按 node_id 去重
+    save_nodes(memory_stream_dir, memory_stream.seq_nodes)
+    generation = _save_embeddings(memory_stream_dir, memory_stream.embeddings)
+    log_path = os.path.join(memory_stream_dir, LOG_FILE)
+    if os.path.exists(log_path):
+      os.remove(log_path)
+    memory_stream._store_state = _StoreState(memory_stream_dir, memory_stream, generation)
+  try:
+    if hasattr(memory_stream, "ensure_ann_index"):
+      memory_stream.ensure_ann_index()
+    save_ann_index(memory_stream_dir, memory_stream)
+  except Exception as e:
+    util.log(2, f"保存记忆向量索引失败: {str(e)}")
+
+
+def save_ann_index(memory_stream_dir, memory_stream):
+  """
+  保存 IVF 索引（质心 + 每行簇号）。索引未训练时删除旧文件，避免加载到
+  与节点表不匹配的分配结果。
+  """
+  index = getattr(memory_stream, "ann_index", None)
+  ann_path = os.path.join(memory_stream_dir, ANN_FILE)
+  with _store_lock:
+    if index is None or not index.trained:
+      if os.path.exists(ann_path):
+        os.remove(ann_path)
+      return
+    # 与检索线程共用记忆流的索引锁，避免同步簇分配时与检索并发改写
+    with getattr(memory_stream, "_index_lock", None) or contextlib.nullcontext():
+      index.sync(memory_stream.seq_nodes, memory_stream.embeddings)
+      state = index.state()
+    tmp_path = f"{ann_path}.tmp"
+    with open(tmp_path, "wb") as f:
+      np.savez(f, **state)
+    os.replace(tmp_path, ann_path)
+
+
+def load_ann_index(memory_stream_dir):
+  """读取 IVF 索引；不存在或损坏时返回 None（检索走精确路径）。"""
+  ann_path = os.path.join(memory_stream_dir, ANN_FILE)
+  if not os.path.exists(ann_path):
+    return None
+  try:
+    with np.load(ann_path) as data:
+      return IvfIndex.from_state(data)
+  except Exception as e:
+    util.log(2, f"读取记忆向量索引失败，将在下次保存时重建: {str(e)}")
+    return None
+
+
+def flush_memory_stream(memory_stream_dir, memory_stream):
+  """
+  增量落盘：只把上次落盘之后追加的节点写进日志。
+
+  节点列表或 embedding 字典被整体替换、节点变少、或还没有落盘基线（刚加载）
+  时退化为一次全量快照；日志累计达到 LOG_COMPACT_RECORDS 条时同样压缩成快照。
+  """
+  with _store_lock:
+    state = getattr(memory_stream, "_store_state", None)
+    if state is None or not state.matches(memory_stream_dir, memory_stream):
+      save_memory_stream(memory_stream_dir, memory_stream)
+      return
+    end = len(memory_stream.seq_nodes)
+    if end == state.count:
+      return
+    if state.log_records + (end - state.count) >= LOG_COMPACT_RECORDS:
+      save_memory_stream(memory_stream_dir, memory_stream)
+      return
+
+    embeddings = memory_stream.embeddings or {}
+    lines = []
+    for node in memory_stream.seq_nodes[state.count:end]:
+      record = {"gen": state.generation, "node": node.package()}
+      record.update(_encode_log_vector(embeddings.get(node.content)))
+      lines.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+    with open(os.path.join(memory_stream_dir, LOG_FILE), "a", encoding="utf-8") as f:
+      f.write("\n".join(lines) + "\n")
+      f.flush()
+      os.fsync(f.fileno())
+    state.log_records += end - state.count
+    state.count = end
+
+
+def _encode_log_vector(vec):
+  """数值向量按 float32 base64 存，其他情况（空/缺失/非法）原样存 JSON。"""
+  if vec is None:
+    return {}
+  length = _vector_length(vec)
+  if length:
+    try:
+      arr = np.asarray(vec, dtype=np.float32)
+      return {"emb_b64": base64.b64encode(arr.tobytes()).decode("ascii")}
+    except (TypeError, ValueError):
+      pass
+  return {"emb": _to_json_vector(vec)}
+
+
+def _replay_log(memory_stream_dir, nodes, embeddings, generation):
+  """把追加日志中属于快照 generation 的记录重放进 nodes / embeddings，返回重放条数。"""
+  log_path = os.path.join(memory_stream_dir, LOG_FILE)
+  if not os.path.exists(log_path):
+    return 0
+  known_ids = {n.get("node_id") for n in nodes if isinstance(n, dict)}
+  replayed = 0
+  with open(log_path, "r", encoding="utf-8") as f:
+    for line in f:
+      line = line.strip()
+      if not line:
+        continue
+      try:
+        record = json.loads(line)
+      except ValueError:
+        # 崩溃时最后一行可能只写了一半
+        util.log(2, f"跳过损坏的记忆日志记录: {memory_stream_dir}")
+        continue
+      node = record.get("node")
+      if record.get("gen") != generation or not isinstance(node, dict):
+        continue
+      if node.get("node_id") in known_ids:
+        continue
+      nodes.append(node)
+      known_ids.add(node.get("node_id"))
+      if "emb_b64" in record:
+        embeddings[node["content"]] = np.frombuffer(
+          base64.b64decode(record["emb_b64"]), dtype=np.float32)
+      elif "emb" in record:
+        embeddings[node["content"]] = record["emb"]
+      replayed += 1
+  if replayed:
+    util.log(1, f"已从记忆日志恢复 {replayed} 条节点: {memory_stream_dir}")
+  return replayed
+
+
+def load_embeddings(memory_stream_dir):
+  """
+  读取 embedding 字典。新格式下值是 mmap 矩阵的只读行视图（零拷贝）；
+  只有旧版 embeddings.json 时按 JSON 读取，并一次性迁移成新格式。
+  """
+  return _load_embeddings(memory_stream_dir)[0]
+
+
+def _load_embeddings(memory_stream_dir):
+  """返回 (embeddings, 快照代号)；不是从矩阵快照读出的（旧版 JSON、读取失败）代号为 None。"""
+  index_path = os.path.join(memory_stream_dir, INDEX_FILE)
+  if os.path.exists(index_path):
+    try:
+      with open(index_path, "r", encoding="utf-8") as f:
+        index = json.load(f)
+      matrix_path = os.path.join(memory_stream_dir, index["matrix"])
+      matrix = np.load(matrix_path, mmap_mode="r")
+      keys = index.get("keys", [])
+      if matrix.shape[0] != len(keys):
+        raise ValueError(f"矩阵行数 {matrix.shape[0]} 与索引条数 {len(keys)} 不一致")
+      embeddings = {content: matrix[i] for i, content in enumerate(keys)}
+      embeddings.update(index.get("extra", {}))
+      return embeddings, int(index.get("generation", 0))
+    except Exception as e:
+      util.log(2, f"读取 embedding 矩阵失败，尝试旧版 embeddings.json: {str(e)}")
+
+  legacy_path = os.path.join(memory_stream_dir, LEGACY_EMBEDDINGS_FILE)
+  if not os.path.exists(legacy_path) or os.path.getsize(legacy_path) <= 2:
+    return {}, None
+  with open(legacy_path, "r", encoding="utf-8") as f:
+    embeddings = json.load(f)
+  if not os.path.exists(index_path):
+    migrate_legacy(memory_stream_dir, embeddings)
+  return embeddings, None
+
+
+def migrate_legacy(memory_stream_dir, embeddings):
+  """把旧版 embeddings.json 转成矩阵格式，原文件改名为 .bak 保留。"""
+  try:
+    _save_embeddings(memory_stream_dir, embeddings)
+    legacy_path = os.path.join(memory_stream_dir, LEGACY_EMBEDDINGS_FILE)
+    os.replace(legacy_path, f"{legacy_path}.bak")
+    util.log(1, f"已将 embeddings.json 迁移为二进制格式: {memory_stream_dir}")
+  except Exception as e:
+    util.log(2, f"迁移 embeddings.json 失败，继续使用旧格式: {str(e)}")
+
+
+def load_nodes(memory_stream_dir):
+  nodes_path = os.path.join(memory_stream_dir, NODES_FILE)
+  if not os.path.exists(nodes_path) or os.path.getsize(nodes_path) <= 2:
+    return []
+  with open(nodes_path, "r", encoding="utf-8") as f:
+    return json.load(f)
+
+
+def load_memory_stream(memory_stream_dir, with_state=False):
+  """
+  返回 (nodes, embeddings)，供 MemoryStream(nodes, embeddings) 使用。
+  快照之后追加日志里的节点会被一并重放（崩溃恢复）。
+
+  with_state=True 时返回 (nodes, embeddings, loaded)，构造好 MemoryStream 后
+  调用 bind_store_state(memory_stream_dir, memory_stream, loaded)。
+  """
+  with _store_lock:
+    nodes = load_nodes(memory_stream_dir)
+    embeddings, generation = _load_embeddings(memory_stream_dir)
+    if generation is None:
+      _replay_log(memory_stream_dir, nodes, embeddings, _read_generation(memory_stream_dir))
+      loaded = None
+    else:
+      loaded = (generation, _replay_log(memory_stream_dir, nodes, embeddings, generation))
+  if with_state:
+    return nodes, embeddings, loaded
+  return nodes, embeddings
+
+
+def bind_store_state(memory_stream_dir, memory_stream, loaded):
+  """
+  把加载时的快照代号与已重放的日志条数记到 memory_stream._store_state 上，
+  下一次 flush_memory_stream 只追加之后新增的节点。loaded 为 None（旧版格式或
+  矩阵读取失败）时不绑定，第一次 flush 写全量快照。
+  """
+  if loaded is None:
+    return
+  generation, log_records = loaded
+  with _store_lock:
+    state = _StoreState(memory_stream_dir, memory_stream, generation)
+    state.log_records = log_records
+    memory_stream._store_state = state
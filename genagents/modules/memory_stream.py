@@ -1,10 +1,14 @@
 import math
+import time
 import sys
+import threading
 import datetime
 import random
 import string
 import re
 
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from numpy import dot
 from numpy.linalg import norm
 
@@ -13,6 +17,31 @@ from simulation_engine.global_methods import *
 from simulation_engine.gpt_structure import *
 from simulation_engine.llm_json_parser import *
 from utils import util
+from utils import config_util as cfg
+from genagents.modules.retrieval_engine import (
+  RetrievalEngine, normalize_array, top_k_positions)
+from genagents.modules.ann_index import IvfIndex
+
+
+# 近似检索（IVF）默认配置，可在 config.json 的 memory.ann_index 中覆盖：
+#   enabled    是否启用
+#   min_nodes  节点数达到该值才训练/使用索引，小记忆库走精确检索
+#   nprobe     每次检索探查的簇数，0 表示按簇数自动取（nlist / 16，至少 8）
+ANN_DEFAULTS = {"enabled": True, "min_nodes": 20000, "nprobe": 0}
+
+
+def get_ann_config():
+  conf = dict(ANN_DEFAULTS)
+  try:
+    conf.update((cfg.config or {}).get("memory", {}).get("ann_index", {}) or {})
+  except Exception:
+    pass
+  return conf
+
+
+# embedding 维度修复默认参数，可在 config.json 的 memory.embedding_repair 中覆盖
+REPAIR_BATCH_SIZE = 32
+REPAIR_WORKERS = 4
 
 
 def run_gpt_generate_importance(
@@ -349,6 +378,11 @@ def extract_importance(seq_nodes):
 def _is_valid_embedding(vec, expected_dim):
   if vec is None:
     return False
+  if isinstance(vec, np.ndarray):
+    # 从二进制矩阵加载的行视图
+    if vec.ndim != 1 or vec.dtype.kind not in "iuf":
+      return False
+    return expected_dim is None or vec.shape[0] == expected_dim
   if not isinstance(vec, (list, tuple)):
     return False
   if expected_dim is not None and len(vec) != expected_dim:
@@ -469,6 +503,124 @@ class ConceptNode:
     return curr_package
 
 
+# ##############################################################################
+# ###                        EMBEDDING REPAIR JOB                            ###
+# ##############################################################################
+
+class EmbeddingRepairJob:
+  """
+  批量重算维度不一致的记忆 embedding。
+
+  待修复内容按 batch_size 分批，经 encode_texts（先查 embedding 缓存，未命中
+  走批量 /embeddings 接口）在最多 workers 个线程中并行请求；每完成一批就把
+  合法结果原子地写回 memory_stream，并按约 10% 的粒度打印进度。某批失败时
+  该批保持原样，留给之后的在线修复。
+  """
+
+  def __init__(self, memory_stream, contents, expected_dim,
+               batch_size=REPAIR_BATCH_SIZE, workers=REPAIR_WORKERS, on_complete=None):
+    self.memory_stream = memory_stream
+    self.contents = list(contents)
+    self.expected_dim = expected_dim
+    self.batch_size = max(1, batch_size)
+    self.workers = max(1, workers)
+    self.on_complete = on_complete
+    self.total = len(self.contents)
+    self.processed = 0
+    self.fixed = 0
+    self.failed = 0
+    self.state = "pending"
+    self.started_at = None
+    self.finished_at = None
+    self._thread = None
+
+
+  @property
+  def running(self):
+    return self.state in ("pending", "running") and self._thread is not None
+
+
+  def start(self):
+    self._thread = threading.Thread(target=self.run, name="embedding-repair", daemon=True)
+    self._thread.start()
+
+
+  def join(self, timeout=None):
+    if self._thread is not None:
+      self._thread.join(timeout)
+
+
+  def progress(self):
+    return {
+      "state": self.state,
+      "total": self.total,
+      "processed": self.processed,
+      "fixed": self.fixed,
+      "failed": self.failed,
+      "expected_dim": self.expected_dim,
+      "elapsed": round((self.finished_at or time.time()) - self.started_at, 2) if self.started_at else 0.0,
+    }
+
+
+  def _encode(self, batch):
+    from utils.api_embedding_service import get_embedding_service
+    # 与 get_text_embedding 的预处理一致，保证能命中 embedding 缓存
+    texts = [content.replace("\n", " ").strip() for content in batch]
+    return get_embedding_service().encode_texts(texts)
+
+
+  def run(self):
+    self.state = "running"
+    self.started_at = time.time()
+    batches = [self.contents[i:i + self.batch_size]
+               for i in range(0, self.total, self.batch_size)]
+    next_report = 0.1
+    try:
+      with ThreadPoolExecutor(max_workers=self.workers,
+                              thread_name_prefix="embedding-repair") as pool:
+        futures = {pool.submit(self._encode, batch): batch for batch in batches}
+        for future in as_completed(futures):
+          batch = futures[future]
+          try:
+            vectors = future.result()
+          except Exception as e:
+            util.log(2, f"批量修复 embedding 失败（{len(batch)} 条，稍后在线修复）: {str(e)}")
+            vectors = []
+          fixes = {}
+          for content, vec in zip(batch, vectors):
+            if content.strip() and _is_valid_embedding(vec, self.expected_dim):
+              fixes[content] = vec
+          if fixes:
+            self.memory_stream._apply_repaired_embeddings(fixes)
+          self.processed += len(batch)
+          self.fixed += len(fixes)
+          self.failed += len(batch) - len(fixes)
+          if self.processed >= self.total * next_report or self.processed == self.total:
+            util.log(1, f"记忆 embedding 修复进度: {self.processed}/{self.total}，成功 {self.fixed}，失败 {self.failed}")
+            next_report = self.processed / self.total + 0.1
+      self.state = "done"
+    except Exception as e:
+      self.state = "failed"
+      util.log(3, f"记忆 embedding 修复任务异常: {str(e)}")
+    finally:
+      self.finished_at = time.time()
+      if self.fixed:
+        ms = self.memory_stream
+        # 与检索线程互斥：检索期间不替换或作废正在使用的索引
+        with ms._index_lock:
+          if ms.ann_index.trained and ms.ann_index.dim != self.expected_dim:
+            # 换了 embedding 模型：旧维度的质心作废，随后保存时按新维度重新训练
+            ms.ann_index = IvfIndex()
+          else:
+            ms.ann_index.invalidate()
+      util.log(1, f"记忆 embedding 修复结束: 修复 {self.fixed}/{self.total}，耗时 {self.finished_at - self.started_at:.1f}s")
+      if self.on_complete is not None:
+        try:
+          self.on_complete(self)
+        except Exception as e:
+          util.log(2, f"embedding 修复完成回调失败: {str(e)}")
+
+
 # ##############################################################################
 # ###                             MEMORY STREAM                              ###
 # ##############################################################################
@@ -485,13 +637,35 @@ class MemoryStream:
 
     self.embeddings = embeddings
     self._embedding_dim_checked = False
-
-
-  def precheck_embedding_dimensions(self, force: bool = False):
+    # 向量化检索引擎，与 seq_nodes 逐行对齐，按需增量同步
+    self._engine = RetrievalEngine()
+    # 近似检索索引，由 ensure_ann_index() 训练，加载时可由 memory_store 替换
+    self.ann_index = IvfIndex()
+    # 检索引擎与 IVF 索引会在检索时原地扩容/改写，多个用户共用一个记忆流时
+    # 并发检索必须串行；覆盖引擎同步、打分、touch 与新增节点时的索引追加
+    self._index_lock = threading.RLock()
+    # 后台 embedding 维度修复任务及其待写入引擎矩阵的结果
+    self._repair_job = None
+    self._repair_lock = threading.Lock()
+    self._pending_row_fixes = {}
+
+
+  def precheck_embedding_dimensions(self, force: bool = False, background: bool = False,
+                                    on_complete=None):
     """
     启动阶段检查并修复记忆节点 embedding 维度，避免首条消息检索时重算。
+
+    维度不符的节点交给 EmbeddingRepairJob 批量重算（encode_texts 批量接口 +
+    有界线程池）。background=True 时修复在后台线程进行、立即返回，检索期间
+    未修复的节点按 0.5 的中性相关性参与排序；修复完成后调用
+    on_complete(job)，由调用方负责落盘。返回值中 fixed 为已修复条数，
+    pending 为后台待修复条数。
     """
-    result = {"checked": False, "expected_dim": None, "fixed": 0}
+    result = {"checked": False, "expected_dim": None, "fixed": 0, "pending": 0}
+    job = self._repair_job
+    if job is not None and job.running:
+      result.update(checked=True, expected_dim=job.expected_dim, pending=job.total - job.processed)
+      return result
     if self._embedding_dim_checked and not force:
       return result
     # 确保embeddings不为None
@@ -529,44 +703,80 @@ class MemoryStream:
       self._embedding_dim_checked = True
       return result
 
-    fixed = 0
     if self.seq_nodes:
       contents = [node.content for node in self.seq_nodes if node is not None]
     else:
       contents = list(self.embeddings.keys())
 
+    mismatched = []
+    seen = set()
     for content in contents:
-      if content in self.embeddings:
-        node_embedding = self.embeddings[content]
-        if not _is_valid_embedding(node_embedding, expected_dim):
-          # 记录维度不一致的详细信息
-          current_dim = len(node_embedding) if isinstance(node_embedding, (list, tuple)) else "未知"
-          from utils import util
+      if content in seen or content not in self.embeddings:
+        continue
+      seen.add(content)
+      node_embedding = self.embeddings[content]
+      if not _is_valid_embedding(node_embedding, expected_dim):
+        if len(mismatched) < 5:
+          # 只记录前几条详情，换模型后可能有成千上万条
+          current_dim = len(node_embedding) if isinstance(node_embedding, (list, tuple, np.ndarray)) else "未知"
           util.log(2, f"发现维度不一致的embedding: 内容='{content[:30]}...', 当前维度={current_dim}, 期望维度={expected_dim}")
-          
-          try:
-            util.log(1, f"正在重新生成embedding: '{content[:30]}...'")
-            regenerated = get_text_embedding(content)
-            if regenerated is not None and _is_valid_embedding(regenerated, expected_dim):
-              self.embeddings[content] = regenerated
-              fixed += 1
-              util.log(1, f"成功修复embedding维度: '{content[:30]}...' ({current_dim} -> {len(regenerated)})")
-            else:
-              regenerated_dim = len(regenerated) if isinstance(regenerated, (list, tuple)) else "未知"
-              util.log(2, f"重新生成的embedding维度仍不一致: '{content[:30]}...' (期望={expected_dim}, 实际={regenerated_dim})，已忽略")
-          except Exception as e:
-            util.log(2, f"重新生成embedding失败: '{content[:30]}...' - {str(e)}")
+        mismatched.append(content)
 
-    if fixed > 0:
-      from utils import util
-      util.log(1, f"启动阶段已修复 {fixed} 条记忆节点 embedding 维度")
     self._embedding_dim_checked = True
     result["checked"] = True
     result["expected_dim"] = expected_dim
-    result["fixed"] = fixed
+    if not mismatched:
+      return result
+
+    conf = cfg.config.get("memory", {}).get("embedding_repair", {}) if cfg.config else {}
+    job = EmbeddingRepairJob(
+      self, mismatched, expected_dim,
+      batch_size=int(conf.get("batch_size", REPAIR_BATCH_SIZE)),
+      workers=int(conf.get("workers", REPAIR_WORKERS)),
+      on_complete=on_complete)
+    self._repair_job = job
+    util.log(1, f"发现 {len(mismatched)} 条维度不一致的记忆 embedding，"
+                f"{'后台' if background else ''}批量修复中（批大小={job.batch_size}, 并发={job.workers}）")
+    if background:
+      job.start()
+      result["pending"] = job.total
+    else:
+      job.run()
+      result["fixed"] = job.fixed
     return result
 
 
+  def repair_progress(self):
+    """返回最近一次 embedding 修复任务的进度，没有任务时返回 None。"""
+    job = self._repair_job
+    return job.progress() if job is not None else None
+
+
+  def _apply_repaired_embeddings(self, fixes):
+    """
+    修复任务每完成一批调用一次：dict.update 是单次原子操作，检索线程看到的要么是
+    旧向量要么是新向量；引擎矩阵里对应行的刷新排队，由检索线程在安全点执行。
+    """
+    with self._repair_lock:
+      if self.embeddings is None:
+        self.embeddings = {}
+      self.embeddings.update(fixes)
+      self._pending_row_fixes.update(fixes)
+
+
+  def _flush_repaired_rows(self):
+    """在检索线程中把排队的修复结果写进引擎矩阵。"""
+    with self._repair_lock:
+      if not self._pending_row_fixes:
+        return
+      fixes = self._pending_row_fixes
+      self._pending_row_fixes = {}
+    for row, node in enumerate(self.seq_nodes):
+      vec = fixes.get(node.content)
+      if vec is not None:
+        self._engine.set_embedding(row, vec)
+
+
   def count_observations(self): 
     """
     Counting the number of observations (basically, the number of all nodes in 
@@ -586,7 +796,7 @@ class MemoryStream:
 
   def retrieve(self, focal_points, time_step, n_count=120, curr_filter="all",
                hp=[0, 1, 0.5], stateless=False, verbose=False,
-               filter_tags_all=None, filter_tags_any=None):
+               filter_tags_all=None, filter_tags_any=None, with_scores=False):
     """
     Retrieve elements from the memory stream.
 
@@ -603,91 +813,202 @@ class MemoryStream:
         ["kind:rule", "persistent:true"]。None 或空表示不过滤。
       filter_tags_any: 只保留至少带有其中一个 tag 的节点（OR 语义）。
         None 或空表示不过滤。与 filter_tags_all 同时给定时两者都要满足。
+      with_scores: 为 True 时列表元素为 (node, score)，score 为加权后的综合得分，
+        供上层按 token 预算裁剪时先丢低分记忆。
     Returns:
       retrieved: A dictionary whose keys are a focal_pt query str, and whose
         values are a list of nodes that are retrieved for that query str.
     """
-    curr_nodes = []
-
     # If the memory stream is empty, we return an empty dictionary.
     if len(self.seq_nodes) == 0:
       return dict()
 
+    # 确保embeddings不为None
+    if self.embeddings is None:
+      util.log(2, "警告: 在retrieve方法中，embeddings为None，初始化为空字典")
+      self.embeddings = {}
+
+    # 焦点向量需要网络请求，在持锁之前取好
+    focal_embeddings = {focal_pt: self._focal_embedding(focal_pt) for focal_pt in focal_points}
+    with self._index_lock:
+      return self._retrieve_locked(focal_points, focal_embeddings, time_step, n_count, curr_filter,
+                                   hp, stateless, verbose, filter_tags_all, filter_tags_any, with_scores)
+
+
+  def _retrieve_locked(self, focal_points, focal_embeddings, time_step, n_count, curr_filter,
+                       hp, stateless, verbose, filter_tags_all, filter_tags_any, with_scores):
+    engine = self._engine
+    engine.sync(self.seq_nodes, self.embeddings)
+
     # Filtering for the desired node type. curr_filter can be one of the
     # elements: 'all', 'reflection', 'observation', 'conversation'
-    if curr_filter == "all":
-      curr_nodes = list(self.seq_nodes)
-    else:
-      for curr_node in self.seq_nodes:
-        if curr_node.node_type == curr_filter:
-          curr_nodes += [curr_node]
+    rows = engine.rows_of_type(curr_filter)
 
     # tag 过滤：支持 AND + OR 组合
-    if filter_tags_all:
-      required = set(filter_tags_all)
-      curr_nodes = [n for n in curr_nodes if required.issubset(set(n.tags or []))]
-    if filter_tags_any:
-      any_set = set(filter_tags_any)
-      curr_nodes = [n for n in curr_nodes if any_set.intersection(set(n.tags or []))]
-
-    if not curr_nodes:
+    if filter_tags_all or filter_tags_any:
+      required = set(filter_tags_all or [])
+      any_set = set(filter_tags_any or [])
+      kept = []
+      for i in rows:
+        tags = set(self.seq_nodes[i].tags or [])
+        if required and not required.issubset(tags):
+          continue
+        if any_set and not any_set.intersection(tags):
+          continue
+        kept.append(i)
+      rows = np.array(kept, dtype=np.int64)
+
+    if rows.shape[0] == 0:
       return {fp: [] for fp in focal_points}
 
-    # 确保embeddings不为None
-    if self.embeddings is None:
-      util.log(2, "警告: 在retrieve方法中，embeddings为None，初始化为空字典")
-      self.embeddings = {}
+    recency_w, relevance_w, importance_w = hp[0], hp[1], hp[2]
+
+    # 记忆量大时用 IVF 索引预选相关性候选，其余节点只参与 recency/importance 打分
+    ann_conf = get_ann_config()
+    use_ann = (ann_conf.get("enabled") and relevance_w != 0
+               and rows.shape[0] >= ann_conf.get("min_nodes", 0)
+               and self.ann_index.trained)
+    if use_ann:
+      self.ann_index.sync(self.seq_nodes, self.embeddings)
 
     # <retrieved> is the main dictionary that we are returning
     retrieved = dict() 
     for focal_pt in focal_points: 
-      # Calculating the component dictionaries and normalizing them.
-      x = extract_recency(curr_nodes)
-      recency_out = normalize_dict_floats(x, 0, 1)
-      x = extract_importance(curr_nodes)
-      importance_out = normalize_dict_floats(x, 0, 1)  
-      x = extract_relevance(curr_nodes, self.embeddings, focal_pt)
-      relevance_out = normalize_dict_floats(x, 0, 1)
-      
+      # Calculating the component arrays and normalizing them.
+      recency_out = normalize_array(engine.recency(rows), 0, 1)
+      importance_out = normalize_array(engine.importance(rows), 0, 1)
+      relevance_out = normalize_array(
+        self._relevance_scores(rows, focal_embeddings[focal_pt],
+                               ann_nprobe=self._ann_nprobe(ann_conf) if use_ann else None), 0, 1)
+
       # Computing the final scores that combines the component values. 
-      master_out = dict()
-      for key in recency_out.keys(): 
-        recency_w = hp[0]
-        relevance_w = hp[1]
-        importance_w = hp[2]
-        master_out[key] = (recency_w * recency_out[key]
-                         + relevance_w * relevance_out[key] 
-                         + importance_w * importance_out[key])
+      master_out = (recency_w * recency_out
+                    + relevance_w * relevance_out
+                    + importance_w * importance_out)
 
       if verbose: 
-        master_out = top_highest_x_values(master_out, len(master_out.keys()))
-        for key, val in master_out.items(): 
-          print (self.id_to_node[key].content, val)
-          print (recency_w*recency_out[key]*1, 
-                 relevance_w*relevance_out[key]*1, 
-                 importance_w*importance_out[key]*1)
-
-      # Extracting the highest x values.
-      # <master_out> has the key of node.id and value of float. Once we get  
-      # the highest x values, we want to translate the node.id into nodes 
-      # and return the list of nodes.
-      master_out = top_highest_x_values(master_out, n_count)
-      master_nodes = [self.id_to_node[key] for key in list(master_out.keys())]
-
-      # **Sort the master_nodes list by last_retrieved in descending order**
-      master_nodes = sorted(master_nodes, key=lambda node: node.created, reverse=False)
+        for pos in top_k_positions(master_out, len(master_out)):
+          print (self.seq_nodes[rows[pos]].content, master_out[pos])
+          print (recency_w*recency_out[pos]*1, 
+                 relevance_w*relevance_out[pos]*1, 
+                 importance_w*importance_out[pos]*1)
+
+      # Extracting the highest x values, then sort the picked nodes by
+      # creation time (stable, so score order breaks ties).
+      positions = top_k_positions(master_out, n_count)
+      picked = rows[positions]
+      order = np.argsort(engine.created(picked), kind="stable")
+      picked = picked[order]
+      master_nodes = [self.seq_nodes[i] for i in picked]
 
       # We do not want to update the last retrieved time_step for these nodes
       # if we are in a stateless mode. 
       if not stateless: 
         for n in master_nodes: 
           n.last_retrieved = time_step
+        engine.touch(picked, time_step)
         
-      retrieved[focal_pt] = master_nodes
+      if with_scores:
+        scores = master_out[positions][order]
+        retrieved[focal_pt] = [(node, float(score)) for node, score in zip(master_nodes, scores)]
+      else:
+        retrieved[focal_pt] = master_nodes
     
     return retrieved 
 
 
+  def _ann_nprobe(self, ann_conf):
+    nprobe = int(ann_conf.get("nprobe") or 0)
+    if nprobe <= 0:
+      nprobe = max(8, self.ann_index.nlist // 16)
+    return nprobe
+
+
+  def ensure_ann_index(self, force=False):
+    """
+    按配置训练（或在记忆量翻倍后重新训练）IVF 索引。训练需要几百毫秒到数秒，
+    只在启动加载与全量保存时调用，不放在检索路径上。返回本次是否训练了索引。
+    """
+    ann_conf = get_ann_config()
+    if not ann_conf.get("enabled"):
+      return False
+    if self._repair_job is not None and self._repair_job.running:
+      # 维度修复完成前向量不一致，训练留到修复后的保存
+      return False
+    n = len(self.seq_nodes)
+    if not force and not self.ann_index.needs_training(n, ann_conf.get("min_nodes", 0)):
+      return False
+    start = time.time()
+    with self._index_lock:
+      if not self.ann_index.train(self.seq_nodes, self.embeddings):
+        return False
+    util.log(1, f"记忆向量索引训练完成: 节点={n}, 簇数={self.ann_index.nlist}, 耗时={time.time() - start:.2f}s")
+    return True
+
+
+  def _focal_embedding(self, focal_pt):
+    """取焦点句的 embedding，失败或为空时返回 None（相关性统一记 0.5）。"""
+    try:
+      focal_embedding = get_text_embedding(focal_pt)
+    except Exception as e:
+      util.log(3, f"获取焦点嵌入向量时出错: {str(e)}")
+      return None
+    if not isinstance(focal_embedding, (list, tuple)) or not focal_embedding:
+      return None
+    return focal_embedding
+
+
+  def _relevance_scores(self, rows, focal_embedding, ann_nprobe=None):
+    """
+    计算 rows 对应节点与焦点向量的余弦相似度数组，语义与 extract_relevance
+    一致：无 embedding 记 0.5；维度不一致的 embedding 先尝试在线修复。
+    调用方持有 _index_lock。
+
+    给定 ann_nprobe 时只对 IVF 候选行算精确余弦，非候选行记为候选中的最低分，
+    归一化后相关性为 0，仍按 recency/importance 参与排序。
+    """
+    if focal_embedding is None:
+      return np.full(rows.shape[0], 0.5)
+
+    engine = self._engine
+    expected_dim = len(focal_embedding)
+    engine.ensure_matrix(expected_dim)
+    self._flush_repaired_rows()
+    repair_job = self._repair_job
+    if repair_job is not None and repair_job.running:
+      # 后台修复进行中：不在检索路径上逐条重算，未修复的行按 0.5 参与排序
+      return self._ann_or_exact_relevance(rows, focal_embedding, ann_nprobe)
+    for row in engine.invalid_rows(rows):
+      node = self.seq_nodes[row]
+      node_embedding = self.embeddings.get(node.content)
+      # 尝试在线修复：如果 embedding 服务已恢复，重新生成正确维度的向量
+      current_dim = len(node_embedding) if isinstance(node_embedding, (list, tuple)) else "未知"
+      util.log(2, f"检索时发现维度不一致的embedding: 节点ID={node.node_id}, 内容='{node.content[:30]}...', 当前维度={current_dim}, 期望维度={expected_dim}")
+      try:
+        regenerated = get_text_embedding(node.content)
+        if _is_valid_embedding(regenerated, expected_dim):
+          self.embeddings[node.content] = regenerated
+          engine.set_embedding(row, regenerated)
+          util.log(1, f"在线修复embedding成功: '{node.content[:30]}...' ({current_dim} -> {len(regenerated)})")
+        else:
+          util.log(2, "  -> 在线修复失败（维度仍不一致），使用默认分数 0.5")
+      except Exception as repair_err:
+        util.log(2, f"  -> 在线修复异常: {repair_err}，使用默认分数 0.5")
+    return self._ann_or_exact_relevance(rows, focal_embedding, ann_nprobe)
+
+
+  def _ann_or_exact_relevance(self, rows, focal_embedding, ann_nprobe):
+    engine = self._engine
+    if ann_nprobe is not None:
+      candidates = self.ann_index.candidates(rows, focal_embedding, ann_nprobe)
+      if candidates is not None and candidates.shape[0] > 0:
+        scores = engine.relevance(candidates, focal_embedding)
+        out = np.full(rows.shape[0], scores.min(), dtype=np.float64)
+        out[np.searchsorted(rows, candidates)] = scores
+        return out
+    return engine.relevance(rows, focal_embedding)
+
+
   def _add_node(self, time_step, node_type, content, importance, pointer_id, tags=None):
     """
     Adding a new node to the memory stream.
@@ -728,6 +1049,8 @@ class MemoryStream:
         util.log(3, f"获取文本嵌入时出错: {str(e)}")
         # 如果获取嵌入失败，使用空列表代替
         self.embeddings[content] = []
+    with self._index_lock:
+      self.ann_index.append(self.seq_nodes, self.embeddings)
 
     return new_node
 
@@ -763,6 +1086,9 @@ class MemoryStream:
     if self.embeddings is None:
         self.embeddings = {}
     self.embeddings[content] = embedding if embedding is not None else []
+    # 增量维护近似检索索引：只给新节点分配簇
+    with self._index_lock:
+      self.ann_index.append(self.seq_nodes, self.embeddings)
 
     return new_node
 
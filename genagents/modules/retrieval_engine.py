@@ -0,0 +1,283 @@
+import numpy as np
+
+
+# ##############################################################################
+# ###                          RETRIEVAL ENGINE                              ###
+# ##############################################################################
+
+RECENCY_DECAY = 0.99
+_GROWTH_MIN = 64
+
+
+def _to_importance(value):
+  """与 extract_importance 保持一致：无法转成数值的 importance 记为 50.0。"""
+  if isinstance(value, (int, float)):
+    return float(value)
+  try:
+    return float(value)
+  except (TypeError, ValueError):
+    return 50.0
+
+
+def _to_vector(vec, dim):
+  """
+  把一条 embedding 转成 float32 行向量。与 _is_valid_embedding 语义一致：
+  必须是一维数值序列且长度等于 dim，否则返回 None。
+  """
+  if vec is None or isinstance(vec, (str, bytes, dict)):
+    return None
+  try:
+    arr = np.asarray(vec)
+  except Exception:
+    return None
+  if arr.ndim != 1 or arr.dtype.kind not in "iufb":
+    return None
+  if dim is not None and arr.shape[0] != dim:
+    return None
+  return arr.astype(np.float32, copy=False)
+
+
+def normalize_array(values, target_min=0.0, target_max=1.0):
+  """
+  normalize_dict_floats 的向量化版本：把数组线性缩放到 [target_min, target_max]，
+  全部相等时统一取 (target_max - target_min) / 2。
+  """
+  if values.size == 0:
+    return values
+  min_val = values.min()
+  range_val = values.max() - min_val
+  if range_val == 0:
+    return np.full(values.shape, (target_max - target_min) / 2, dtype=np.float64)
+  return (values - min_val) * (target_max - target_min) / range_val + target_min
+
+
+class RetrievalEngine:
+  """
+  与 MemoryStream.seq_nodes 逐行对齐的向量化检索引擎。
+
+  第 i 行对应 seq_nodes[i]，保存：
+    - 连续的 float32 embedding 矩阵及行范数（按当前焦点向量维度构建）
+    - last_retrieved / importance / created / node_type 数组
+  检索时用一次矩阵-向量乘法算出全部余弦相似度，再用 argpartition 取 top-k，
+  权重与归一化方式与 extract_recency / extract_importance / extract_relevance
+  完全一致。
+
+  引擎只缓存数据，不拥有数据：seq_nodes 或 embeddings 被整体替换（加载、清理、
+  夜间保存）时 sync() 会自动重建；只追加节点时增量扩容。
+  """
+
+  def __init__(self):
+    self._nodes_ref = None
+    self._embeddings_ref = None
+    self._size = 0
+    self._capacity = 0
+    self._dim = None
+    self._matrix_dirty = True
+
+    self._last_retrieved = np.zeros(0, dtype=np.float64)
+    self._importance = np.zeros(0, dtype=np.float64)
+    self._created = np.zeros(0, dtype=np.int64)
+    self._types = np.zeros(0, dtype=object)
+    self._matrix = np.zeros((0, 0), dtype=np.float32)
+    self._norms = np.zeros(0, dtype=np.float32)
+    # present: embeddings 中有该内容；valid: 且维度/类型合法
+    self._present = np.zeros(0, dtype=bool)
+    self._valid = np.zeros(0, dtype=bool)
+
+
+  # ---------------------------------------------------------------------------
+  # 数据同步
+  # ---------------------------------------------------------------------------
+
+  def invalidate(self):
+    """强制下次检索时重建（外部直接改写了 embeddings 或节点属性时调用）。"""
+    self._nodes_ref = None
+
+
+  def invalidate_embeddings(self):
+    """仅 embedding 发生变化（如维度修复）时调用，节点元数据保持不变。"""
+    self._matrix_dirty = True
+
+
+  def sync(self, seq_nodes, embeddings):
+    """
+    让引擎与 seq_nodes / embeddings 对齐。列表或字典对象被替换、或节点数变少时
+    全量重建；节点数变多时只追加新增的行。
+    """
+    if (seq_nodes is not self._nodes_ref
+        or embeddings is not self._embeddings_ref
+        or len(seq_nodes) < self._size):
+      self._rebuild(seq_nodes, embeddings)
+      return
+    for i in range(self._size, len(seq_nodes)):
+      self._append_row(seq_nodes[i])
+
+
+  def _rebuild(self, seq_nodes, embeddings):
+    self._matrix_dirty = True
+    self._nodes_ref = seq_nodes
+    self._embeddings_ref = embeddings
+    self._size = 0
+    self._capacity = 0
+    self._reserve(len(seq_nodes))
+    for node in seq_nodes:
+      self._append_row(node)
+
+
+  def _reserve(self, needed):
+    if needed <= self._capacity:
+      return
+    new_cap = max(needed, self._capacity * 2, _GROWTH_MIN)
+
+    def grow(arr, fill=0):
+      out = np.full((new_cap,) + arr.shape[1:], fill, dtype=arr.dtype)
+      out[:self._size] = arr[:self._size]
+      return out
+
+    self._last_retrieved = grow(self._last_retrieved)
+    self._importance = grow(self._importance)
+    self._created = grow(self._created)
+    self._types = grow(self._types, None)
+    self._present = grow(self._present, False)
+    self._valid = grow(self._valid, False)
+    self._norms = grow(self._norms)
+    if self._dim is not None and not self._matrix_dirty:
+      matrix = np.zeros((new_cap, self._dim), dtype=np.float32)
+      matrix[:self._size] = self._matrix[:self._size]
+      self._matrix = matrix
+    self._capacity = new_cap
+
+
+  def _append_row(self, node):
+    self._reserve(self._size + 1)
+    i = self._size
+    self._last_retrieved[i] = getattr(node, "last_retrieved", 0) or 0
+    self._importance[i] = _to_importance(getattr(node, "importance", 50.0))
+    self._created[i] = getattr(node, "created", 0) or 0
+    self._types[i] = getattr(node, "node_type", None)
+    self._size += 1
+    if self._dim is not None and not self._matrix_dirty:
+      self._fill_embedding_row(i, node)
+
+
+  def _fill_embedding_row(self, i, node):
+    embeddings = self._embeddings_ref or {}
+    content = getattr(node, "content", None)
+    present = content in embeddings
+    vec = _to_vector(embeddings[content], self._dim) if present else None
+    self._present[i] = present
+    if vec is None:
+      self._valid[i] = False
+      self._norms[i] = 0.0
+      self._matrix[i] = 0.0
+    else:
+      self._matrix[i] = vec
+      self._norms[i] = np.linalg.norm(self._matrix[i])
+      self._valid[i] = True
+
+
+  def ensure_matrix(self, dim):
+    """按焦点向量维度准备 embedding 矩阵，维度变化或数据失效时重建。"""
+    if dim == self._dim and not self._matrix_dirty:
+      return
+    self._dim = dim
+    self._matrix = np.zeros((self._capacity, dim), dtype=np.float32)
+    self._matrix_dirty = False
+    for i in range(self._size):
+      self._fill_embedding_row(i, self._nodes_ref[i])
+
+
+  def set_embedding(self, row, vec):
+    """单行 embedding 被修复后写回矩阵。"""
+    if self._dim is None or self._matrix_dirty or row >= self._size:
+      return
+    arr = _to_vector(vec, self._dim)
+    self._present[row] = True
+    if arr is None:
+      self._valid[row] = False
+      self._norms[row] = 0.0
+      return
+    self._matrix[row] = arr
+    self._norms[row] = np.linalg.norm(self._matrix[row])
+    self._valid[row] = True
+
+
+  def touch(self, rows, time_step):
+    """检索命中后同步更新 last_retrieved 数组。"""
+    self._last_retrieved[rows] = time_step
+
+
+  # ---------------------------------------------------------------------------
+  # 打分
+  # ---------------------------------------------------------------------------
+
+  def rows_of_type(self, curr_filter):
+    if curr_filter == "all":
+      return np.arange(self._size)
+    return np.flatnonzero(self._types[:self._size] == curr_filter)
+
+
+  def invalid_rows(self, rows):
+    """返回 rows 中"有 embedding 但维度/类型不合法"的行，供在线修复。"""
+    mask = self._present[rows] & ~self._valid[rows]
+    return rows[mask]
+
+
+  def recency(self, rows):
+    lr = self._last_retrieved[rows]
+    return RECENCY_DECAY ** (lr.max() - lr)
+
+
+  def importance(self, rows):
+    return self._importance[rows].copy()
+
+
+  def relevance(self, rows, focal_embedding):
+    """
+    余弦相似度；无 embedding 或 embedding 非法的行取 0.5（与 extract_relevance
+    的兜底值一致），零向量同样按 0.5 处理，避免 NaN 污染归一化。
+    """
+    out = np.full(rows.shape[0], 0.5, dtype=np.float64)
+    valid = self._valid[rows]
+    if not valid.any():
+      return out
+    focal = np.asarray(focal_embedding, dtype=np.float32)
+    focal_norm = float(np.linalg.norm(focal))
+    if focal_norm == 0:
+      return out
+    valid_rows = rows[valid]
+    if valid_rows.shape[0] * 4 >= self._size:
+      # 行数接近全量时直接乘整块矩阵再取行，避免花式索引先复制出 N x dim 的子矩阵
+      dots = (self._matrix[:self._size] @ focal)[valid_rows]
+    else:
+      dots = self._matrix[valid_rows] @ focal
+    denom = self._norms[valid_rows].astype(np.float64) * focal_norm
+    with np.errstate(divide="ignore", invalid="ignore"):
+      sims = dots.astype(np.float64) / denom
+    sims[~np.isfinite(sims)] = 0.5
+    out[valid] = sims
+    return out
+
+
+  def created(self, rows):
+    return self._created[rows]
+
+
+def top_k_positions(scores, k):
+  """
+  取分数最高的 k 个位置，按分数降序返回；同分时位置靠前者优先，与
+  top_highest_x_values 的稳定排序结果一致。用 argpartition 避免全量排序。
+  """
+  n = scores.shape[0]
+  if k <= 0 or n == 0:
+    return np.zeros(0, dtype=np.int64)
+  if k < n:
+    part = np.argpartition(-scores, k - 1)[:k]
+    threshold = scores[part].min()
+    above = np.flatnonzero(scores > threshold)
+    ties = np.flatnonzero(scores == threshold)[:k - above.shape[0]]
+    selected = np.sort(np.concatenate([above, ties]))
+  else:
+    selected = np.arange(n)
+  order = np.argsort(-scores[selected], kind="stable")
+  return selected[order]
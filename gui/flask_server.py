@@ -36,6 +36,8 @@ except Exception:
     from time import sleep as gsleep
 from scheduler.thread_manager import MyThread
 from utils import config_util, util
+from utils.embedding_cache import get_embedding_cache, get_cache_stats
+from utils.tts_cache import get_cache_stats as get_tts_cache_stats
 from core import wsa_server
 from core import fay_core
 from core import content_db
@@ -49,6 +51,8 @@ from core import stream_manager
 # 文字接口读取回复流时的空闲超时（秒）：连续这么久读不到任何数据则判定异常并收尾，
 # 避免因结束标记(_<isend>)丢失导致 /v1/chat/completions 永久挂起。
 _STREAM_READ_IDLE_TIMEOUT = 180
+# 单次阻塞读的等待上限（秒）：句子写入时立即唤醒，超时后检查会话是否已被顶替
+_STREAM_READ_WAIT = 0.5
 
 # 全局变量，用于跟踪当前的genagents服务器
 genagents_server = None
@@ -421,6 +425,20 @@ def _build_embedding_url(base_url: str) -> str:
     return url + "/v1/embeddings"
 
 
+def _cacheable_embedding_inputs(payload):
+    """透传请求只带 model/input（及 float 编码）时可走缓存，返回文本列表，否则返回 None。"""
+    if not set(payload) <= {'model', 'input', 'encoding_format'}:
+        return None
+    if payload.get('encoding_format', 'float') != 'float':
+        return None
+    inputs = payload.get('input')
+    if isinstance(inputs, str):
+        return [inputs]
+    if isinstance(inputs, list) and inputs and all(isinstance(t, str) for t in inputs):
+        return inputs
+    return None
+
+
 def _build_langchain_base_url(base_url: str) -> str:
     if not base_url:
         return ""
@@ -1025,8 +1043,9 @@ def api_delete_user():
                 deleted_memory = True
                 print(f"已删除用户记忆目录: {user_memory_dir}")
 
-            # 清除缓存的 agent 对象
+            # 清除缓存的 agent 对象（含正在淘汰落盘的，避免删除后又被写回）
             try:
+                from llm import nlp_cognitive_stream
                 if hasattr(nlp_cognitive_stream, 'agents') and username in nlp_cognitive_stream.agents:
                     del nlp_cognitive_stream.agents[username]
             except Exception:
@@ -1141,10 +1160,15 @@ def api_get_system_status():
         except Exception:
             remote_audio_status = False
             
+        from llm.nlp_cognitive_stream import get_agent_cache_stats, get_prompt_stats
         return jsonify({
             'server': server_status,
             'digital_human': digital_human_status,
-            'remote_audio': remote_audio_status
+            'remote_audio': remote_audio_status,
+            'embedding_cache': get_cache_stats(),
+            'agent_cache': get_agent_cache_stats(),
+            'prompt_stats': get_prompt_stats(),
+            'tts_cache': get_tts_cache_stats()
         })
     except Exception as e:
         return jsonify({'server': False, 'digital_human': False, 'remote_audio': False, 'error': str(e)}), 500
@@ -1244,8 +1268,12 @@ def gpt_stream_response(last_content, username):
         last_activity = time.time()
         ended = False
         while True:
-            sentence = nlp_Stream.read()
+            # 阻塞等待下一句写入；超时只用于检查会话切换与空闲超时
+            sentence = nlp_Stream.read(timeout=_STREAM_READ_WAIT)
             if sentence is None:
+                # 服务停止时流被关闭，read 不再阻塞，直接收尾
+                if nlp_Stream.closed:
+                    break
                 # 会话已被新的请求顶替：本轮已失效，立即收尾，避免无限丢弃新会话内容
                 if sm.get_conversation_id(username) != conversation_id:
                     break
@@ -1253,7 +1281,6 @@ def gpt_stream_response(last_content, username):
                 if time.time() - last_activity > idle_timeout:
                     util.printInfo(1, username, '[文字沟通接口(流式)] 等待回复超时，提前结束', time.time())
                     break
-                gsleep(0.01)
                 continue
 
             last_activity = time.time()
@@ -1300,7 +1327,6 @@ def gpt_stream_response(last_content, username):
             if is_end:
                 ended = True
                 break
-            gsleep(0.01)
         # 非正常结束（超时/会话切换）时补发一个结束块，保证客户端不会一直等待
         if not ended:
             message = {
@@ -1347,12 +1373,32 @@ def api_send_v1_embeddings():
         if model_name:
             payload['model'] = model_name
 
+    # MCP 知识库等服务反复请求同一段文本时直接从 embedding 缓存返回
+    cache = get_embedding_cache()
+    cache_texts = _cacheable_embedding_inputs(payload) if cache is not None else None
+    if cache_texts is not None:
+        cached = [cache.get(payload.get('model'), text) for text in cache_texts]
+        if all(emb is not None for emb in cached):
+            return jsonify({
+                'object': 'list',
+                'data': [{'object': 'embedding', 'index': i, 'embedding': emb} for i, emb in enumerate(cached)],
+                'model': payload.get('model'),
+                'usage': {'prompt_tokens': 0, 'total_tokens': 0},
+            })
+
     headers = {'Content-Type': 'application/json'}
     if api_key:
         headers['Authorization'] = f'Bearer {api_key}'
 
     try:
         resp = requests.post(embed_url, headers=headers, json=payload, timeout=60)
+        if cache_texts is not None and resp.status_code == 200:
+            try:
+                items = sorted(resp.json().get('data') or [], key=lambda item: item.get('index', 0))
+                if len(items) == len(cache_texts):
+                    cache.put_many(payload.get('model'), cache_texts, [item.get('embedding') for item in items])
+            except Exception as cache_err:
+                util.log(1, f'写入 embedding 缓存失败: {cache_err}')
         content_type = resp.headers.get("Content-Type", "application/json")
         if "charset=" not in content_type.lower():
             content_type = f"{content_type}; charset=utf-8"
@@ -1374,8 +1420,11 @@ def non_streaming_response(last_content, username):
     idle_timeout = _STREAM_READ_IDLE_TIMEOUT
     last_activity = time.time()
     while True:
-        sentence = nlp_Stream.read()
+        sentence = nlp_Stream.read(timeout=_STREAM_READ_WAIT)
         if sentence is None:
+            # 服务停止时流被关闭，返回已累计内容
+            if nlp_Stream.closed:
+                break
             # 会话已被新的请求顶替：本轮已失效，返回已累计内容
             if sm.get_conversation_id(username) != conversation_id:
                 break
@@ -1383,7 +1432,6 @@ def non_streaming_response(last_content, username):
             if time.time() - last_activity > idle_timeout:
                 util.printInfo(1, username, '[文字沟通接口(非流式)] 等待回复超时，返回已生成内容', time.time())
                 break
-            gsleep(0.01)
             continue
 
         last_activity = time.time()
@@ -0,0 +1,292 @@
+"""
+按用户缓存 GenerativeAgent 的 LRU 容器。
+
+nlp_cognitive_stream.agents 原先是无上限的 dict，每个用户的记忆流与 embedding
+一旦加载就常驻内存。AgentCache 保持 dict 的读写接口，另外提供：
+  - 数量 / 内存预算（memory.agent_cache.max_agents / max_memory_mb）：超出时按
+    最近最少使用淘汰，最近 min_idle_seconds 内访问过、或正在后台修复 embedding
+    的 agent 不会被淘汰
+  - 空闲淘汰：超过 idle_seconds 未访问的 agent 由定时任务 evict_idle() 淘汰
+  - 淘汰时先移到"待落盘"区，在后台线程调用 saver 全量保存后再释放；保存完成前
+    用户再次访问会直接复用该对象，不会从磁盘读到旧数据
+  - 指标：常驻数、淘汰数、命中 / 加载次数、估算内存
+  - 按用户的可重入锁 lock_for(username)：读写某个用户的记忆只锁该用户，
+    内部锁只在查表/登记时短暂持有
+
+被淘汰的用户下次 create_agent 时会从磁盘懒加载。
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from utils import util
+
+DEFAULT_CONFIG = {
+    "max_agents": 16,
+    "max_memory_mb": 0,
+    "idle_seconds": 1800,
+    "min_idle_seconds": 60,
+}
+
+_NODE_OVERHEAD = 400  # ConceptNode 对象与属性字典的大致开销（字节）
+
+
+def estimate_agent_bytes(agent):
+    """粗略估算一个 agent 常驻的记忆数据大小（节点 + embedding + 检索引擎矩阵）。"""
+    ms = getattr(agent, "memory_stream", None)
+    if ms is None:
+        return 0
+    total = 0
+    for node in ms.seq_nodes or []:
+        total += _NODE_OVERHEAD + sys.getsizeof(getattr(node, "content", "") or "")
+    for vec in (ms.embeddings or {}).values():
+        if isinstance(vec, np.ndarray):
+            total += vec.nbytes
+        elif isinstance(vec, (list, tuple)):
+            # list 槽位 8 字节 + 每个 float 对象 24 字节
+            total += 56 + 32 * len(vec)
+    engine = getattr(ms, "_engine", None)
+    if engine is not None:
+        total += getattr(engine, "_matrix", np.zeros(0)).nbytes
+    return total
+
+
+class AgentCache:
+    """dict 兼容的 agent LRU 缓存，线程安全。"""
+
+    def __init__(self, saver=None, config_getter=None):
+        self._agents = OrderedDict()
+        self._last_access = {}
+        self._evicting = {}
+        self._size_cache = {}
+        self._user_locks = {}
+        self._saver = saver
+        self._config_getter = config_getter
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.resurrections = 0
+
+    def set_saver(self, saver):
+        self._saver = saver
+
+    def lock_for(self, username):
+        """返回用户专属的 RLock；淘汰、重新加载后仍是同一把锁。"""
+        with self._lock:
+            lock = self._user_locks.get(username)
+            if lock is None:
+                lock = self._user_locks[username] = threading.RLock()
+            return lock
+
+    def _config(self):
+        conf = dict(DEFAULT_CONFIG)
+        if self._config_getter is not None:
+            try:
+                conf.update(self._config_getter() or {})
+            except Exception:
+                pass
+        return conf
+
+    # ------------------------------------------------------------------
+    # dict 接口
+    # ------------------------------------------------------------------
+    def get(self, username, default=None):
+        with self._lock:
+            agent = self._lookup(username)
+            return default if agent is None else agent
+
+    def peek(self, username, default=None):
+        """读取常驻 agent 但不刷新 LRU 位置（定时保存等后台任务使用）。"""
+        with self._lock:
+            return self._agents.get(username, default)
+
+    def __contains__(self, username):
+        with self._lock:
+            return username in self._agents or username in self._evicting
+
+    def __getitem__(self, username):
+        with self._lock:
+            agent = self._lookup(username)
+            if agent is None:
+                raise KeyError(username)
+            return agent
+
+    def __setitem__(self, username, agent):
+        with self._lock:
+            self._evicting.pop(username, None)
+            self._agents[username] = agent
+            self._agents.move_to_end(username)
+            self._last_access[username] = time.time()
+            self._size_cache.pop(username, None)
+            self.loads += 1
+        self.enforce_budget()
+
+    def __delitem__(self, username):
+        with self._lock:
+            found = self._agents.pop(username, None) is not None
+            found = self._evicting.pop(username, None) is not None or found
+            self._last_access.pop(username, None)
+            self._size_cache.pop(username, None)
+            if not found:
+                raise KeyError(username)
+
+    def pop(self, username, default=None):
+        try:
+            agent = self.get(username)
+            del self[username]
+            return agent
+        except KeyError:
+            return default
+
+    def __len__(self):
+        with self._lock:
+            return len(self._agents)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        with self._lock:
+            return list(self._agents.keys())
+
+    def values(self):
+        with self._lock:
+            return list(self._agents.values())
+
+    def items(self):
+        with self._lock:
+            return list(self._agents.items())
+
+    def clear(self):
+        with self._lock:
+            self._agents.clear()
+            self._evicting.clear()
+            self._last_access.clear()
+            self._size_cache.clear()
+
+    def _lookup(self, username):
+        agent = self._agents.get(username)
+        if agent is not None:
+            self._agents.move_to_end(username)
+            self._last_access[username] = time.time()
+            self.hits += 1
+            return agent
+        agent = self._evicting.pop(username, None)
+        if agent is not None:
+            # 落盘尚未完成就被再次访问：直接复用内存中的对象
+            self._agents[username] = agent
+            self._last_access[username] = time.time()
+            self.resurrections += 1
+        return agent
+
+    # ------------------------------------------------------------------
+    # 淘汰
+    # ------------------------------------------------------------------
+    def _agent_bytes(self, username, agent):
+        ms = getattr(agent, "memory_stream", None)
+        count = len(ms.seq_nodes) if ms is not None and ms.seq_nodes is not None else 0
+        cached = self._size_cache.get(username)
+        if cached is None or cached[0] != count:
+            cached = (count, estimate_agent_bytes(agent))
+            self._size_cache[username] = cached
+        return cached[1]
+
+    def _evictable(self, username, agent, now, min_idle):
+        if now - self._last_access.get(username, 0) < min_idle:
+            return False
+        ms = getattr(agent, "memory_stream", None)
+        job = getattr(ms, "_repair_job", None)
+        return not (job is not None and job.running)
+
+    def enforce_budget(self):
+        """超出数量或内存预算时按 LRU 淘汰可淘汰的 agent，返回淘汰数。"""
+        conf = self._config()
+        max_agents = int(conf.get("max_agents") or 0)
+        max_bytes = float(conf.get("max_memory_mb") or 0) * 1024 * 1024
+        min_idle = float(conf.get("min_idle_seconds") or 0)
+        evicted = 0
+        with self._lock:
+            now = time.time()
+            resident = self._resident_bytes() if max_bytes else 0
+            for username in list(self._agents.keys()):
+                over_count = max_agents and len(self._agents) > max_agents
+                over_memory = max_bytes and resident > max_bytes
+                if not over_count and not over_memory:
+                    break
+                agent = self._agents[username]
+                if not self._evictable(username, agent, now, min_idle):
+                    continue
+                if max_bytes:
+                    resident -= self._agent_bytes(username, agent)
+                self._evict(username, "预算")
+                evicted += 1
+        return evicted
+
+    def evict_idle(self):
+        """淘汰超过 idle_seconds 未访问的 agent（由定时任务调用），返回淘汰数。"""
+        conf = self._config()
+        idle = float(conf.get("idle_seconds") or 0)
+        if idle <= 0:
+            return 0
+        evicted = 0
+        with self._lock:
+            now = time.time()
+            for username, agent in list(self._agents.items()):
+                if self._evictable(username, agent, now, idle):
+                    self._evict(username, "空闲")
+                    evicted += 1
+        return evicted + self.enforce_budget()
+
+    def _evict(self, username, reason):
+        agent = self._agents.pop(username)
+        self._evicting[username] = agent
+        self._size_cache.pop(username, None)
+        self.evictions += 1
+        util.log(1, f"agent 缓存淘汰({reason}): {username}，常驻 {len(self._agents)} 个")
+        threading.Thread(target=self._flush_evicted, args=(username, agent),
+                         name=f"agent-evict-{username}", daemon=True).start()
+
+    def _flush_evicted(self, username, agent):
+        with self._lock:
+            if self._evicting.get(username) is not agent:
+                return
+        try:
+            if self._saver is not None:
+                self._saver(username, agent)
+        except Exception as e:
+            util.log(1, f"淘汰 agent 落盘失败，保留在内存中: {username}, {str(e)}")
+            with self._lock:
+                # 落盘失败不能丢数据：放回常驻区
+                if self._evicting.pop(username, None) is agent:
+                    self._agents[username] = agent
+            return
+        with self._lock:
+            if self._evicting.get(username) is agent:
+                del self._evicting[username]
+                self._last_access.pop(username, None)
+
+    # ------------------------------------------------------------------
+    # 指标
+    # ------------------------------------------------------------------
+    def _resident_bytes(self):
+        return sum(self._agent_bytes(u, a) for u, a in self._agents.items())
+
+    def stats(self):
+        conf = self._config()
+        with self._lock:
+            return {
+                "resident": len(self._agents),
+                "evicting": len(self._evicting),
+                "evictions": self.evictions,
+                "hits": self.hits,
+                "loads": self.loads,
+                "resurrections": self.resurrections,
+                "estimated_memory_mb": round(self._resident_bytes() / (1024 * 1024), 2),
+                "max_agents": conf.get("max_agents"),
+                "max_memory_mb": conf.get("max_memory_mb"),
+                "idle_seconds": conf.get("idle_seconds"),
+            }
@@ -0,0 +1,174 @@
+"""
+按 token 预算打包提示词上下文。
+
+原来关联记忆按固定条数（最多 30 条）、对话历史按固定 30 条、工具结果按字符截断注入，
+长轮次容易超出模型窗口，短问题也要付出整份上下文的处理时间。这里把系统提示词拆成
+若干段，用本地分词器（prompt_builder.count_tokens）计数后按优先级分配预算：
+  1. 先把每段压到自己的上限（section_max_tokens）以内
+  2. 总量仍超出 max_prompt_tokens 时，从优先级最低的段开始收缩，直到放得下
+段内收缩时先丢条目（有得分的按得分从低到高，没有得分的从最旧开始），只剩
+一条（或 min_items 条）仍超出时再截断文本；required 段原样保留。
+
+配置（config.json 的 context_budget，可选）：
+  enabled              是否启用
+  max_prompt_tokens    系统提示词 + 对话历史的总预算（不含模型回复）
+  section_max_tokens   各段上限，按段名配置，0 或缺省表示不单独限制
+  section_priority     覆盖代码里的段优先级，数值越大越晚被收缩
+"""
+import sys
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from llm.prompt_builder import count_tokens
+
+DEFAULT_CONFIG = {
+    "enabled": True,
+    "max_prompt_tokens": 8000,
+    "section_max_tokens": {
+        "关联记忆": 1200,
+        "预启动工具结果": 1500,
+        "最新工具结果": 2000,
+        "工具执行摘要": 1200,
+        "历史工具执行": 1200,
+        "对话历史": 3000,
+    },
+    "section_priority": {},
+}
+
+# 每段 / 每条额外计入的 token，覆盖分隔符与消息模板开销，保证打包结果确实放得下
+SECTION_OVERHEAD = 4
+ITEM_OVERHEAD = 1
+TRUNCATION_MARK = "..."
+# 设了 min_items 的段（如最后一条用户消息）截断时至少保留的 token 数
+MIN_KEPT_TOKENS = 32
+
+
+def load_config():
+    conf = dict(DEFAULT_CONFIG)
+    cfg = sys.modules.get("utils.config_util")
+    try:
+        if cfg is not None and cfg.config:
+            user_conf = cfg.config.get("context_budget", {}) or {}
+            conf.update({k: v for k, v in user_conf.items() if k != "section_max_tokens"})
+            conf["section_max_tokens"] = dict(DEFAULT_CONFIG["section_max_tokens"],
+                                              **(user_conf.get("section_max_tokens") or {}))
+    except Exception:
+        pass
+    return conf
+
+
+@dataclass
+class ContextSection:
+    """提示词中的一段；items 为可单独丢弃的条目（单段文本就只有一条）。"""
+    name: str
+    items: List[str]
+    priority: int = 0
+    scores: Optional[List[float]] = None
+    min_items: int = 0
+    required: bool = False
+    truncatable: bool = True
+    render: Optional[Callable[[List[Tuple[int, str]]], str]] = None
+    kept: List[Tuple[int, str]] = field(default_factory=list)
+    tokens: int = 0
+
+    @classmethod
+    def text(cls, name, text, priority=0, **kwargs):
+        text = text.strip() if isinstance(text, str) else ("" if text is None else str(text).strip())
+        return cls(name, [text] if text else [], priority=priority, **kwargs)
+
+    def rendered(self):
+        if self.render is not None:
+            return self.render(self.kept) if self.kept else ""
+        return "\n".join(text for _, text in self.kept)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """把文本截到不超过 max_tokens（按二分查找前缀长度，末尾加省略号）。"""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    budget = max_tokens - count_tokens(TRUNCATION_MARK)
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(text[:mid]) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo] + TRUNCATION_MARK if lo else ""
+
+
+def _section_tokens(section):
+    if not section.kept:
+        return 0
+    return SECTION_OVERHEAD + sum(count_tokens(text) + ITEM_OVERHEAD for _, text in section.kept)
+
+
+def _drop_order(section):
+    # 有得分时先丢低分，否则从最旧（最前）的条目开始丢
+    indices = [i for i, _ in section.kept]
+    if section.scores is not None:
+        return sorted(indices, key=lambda i: (section.scores[i], i))
+    return indices
+
+
+def _shrink(section, target):
+    """把一段收缩到不超过 target 个 token；返回收缩后的 token 数。"""
+    tokens = _section_tokens(section)
+    if section.required or tokens <= target:
+        return tokens
+    # 可截断的段至少留一条用来截断，整段文本（如工具结果）不会因为略超上限就整段丢掉
+    floor = max(section.min_items, 1 if section.truncatable else 0)
+    for index in _drop_order(section):
+        if tokens <= target or len(section.kept) <= floor:
+            break
+        section.kept = [(i, t) for i, t in section.kept if i != index]
+        tokens = _section_tokens(section)
+    if tokens > target and section.kept and section.truncatable:
+        # 截断剩下最长的一条；剩余额度太小时直接丢掉，必须保留的条目则至少留 MIN_KEPT_TOKENS
+        longest = max(range(len(section.kept)), key=lambda k: count_tokens(section.kept[k][1]))
+        index, text = section.kept[longest]
+        allowed = count_tokens(text) - (tokens - target)
+        if allowed < MIN_KEPT_TOKENS:
+            allowed = MIN_KEPT_TOKENS if len(section.kept) <= section.min_items else 0
+        section.kept[longest] = (index, truncate_to_tokens(text, allowed))
+        section.kept = [(i, t) for i, t in section.kept if t]
+        tokens = _section_tokens(section)
+    elif tokens > target and len(section.kept) > section.min_items:
+        section.kept = section.kept[:section.min_items]
+        tokens = _section_tokens(section)
+    return tokens
+
+
+def pack(sections: Sequence[ContextSection], max_tokens=None, conf=None):
+    """
+    按预算收缩各段，结果写回 section.kept / section.tokens。
+    返回 (总 token 数, 收缩前总 token 数)。
+    """
+    conf = conf or load_config()
+    if max_tokens is None:
+        max_tokens = int(conf.get("max_prompt_tokens") or 0)
+    caps = conf.get("section_max_tokens") or {}
+    priority_override = conf.get("section_priority") or {}
+
+    before = 0
+    for section in sections:
+        section.kept = list(enumerate(section.items))
+        section.kept = [(i, t) for i, t in section.kept if t]
+        if section.name in priority_override:
+            section.priority = int(priority_override[section.name])
+        before += _section_tokens(section)
+        cap = int(caps.get(section.name) or 0)
+        section.tokens = _shrink(section, cap) if cap > 0 else _section_tokens(section)
+
+    total = sum(section.tokens for section in sections)
+    if max_tokens > 0 and total > max_tokens:
+        for section in sorted((s for s in sections if not s.required), key=lambda s: s.priority):
+            over = total - max_tokens
+            if over <= 0:
+                break
+            shrunk = _shrink(section, max(0, section.tokens - over))
+            total -= section.tokens - shrunk
+            section.tokens = shrunk
+    return total, before
@@ -9,6 +9,7 @@
 
 import enum
 import json
+import os
 import re
 import threading
 import time
@@ -169,24 +170,111 @@ class ExecutionManager:
 # 大/小模型实例工厂
 # ---------------------------------------------------------------------------
 
+class LLMClientRegistry:
+    """
+    ChatOpenAI 实例注册表。
+
+    按 (role, model, base_url, key, streaming) 复用实例，连同其内部的 HTTP
+    连接池一起复用；配置变化后键随之变化，同一 role/streaming 的旧实例被替换。
+    本地 system.conf 只在文件 mtime 变化时才强制重新读取，mtime 变了但模型相关
+    配置没变时仍复用原实例。
+    """
+
+    # system.conf 不在本地（配置中心 / 环境变量）时，最多每隔这么久重新加载一次
+    CONFIG_RECHECK_SECONDS = 5.0
+
+    def __init__(self):
+        self._clients: Dict[Tuple, ChatOpenAI] = {}
+        self._lock = threading.Lock()
+        self._config_stamp: Optional[Tuple[str, int]] = None
+        self._next_config_check = 0.0
+        self._created = 0
+        self._reused = 0
+
+    def refresh_config(self) -> None:
+        """system.conf 变化（或尚未加载）时重新加载配置。"""
+        stamp = None
+        path = cfg.system_conf_path
+        if path:
+            try:
+                stamp = (path, os.stat(path).st_mtime_ns)
+            except OSError:
+                stamp = None
+        now = time.monotonic()
+        with self._lock:
+            if cfg.system_config is not None and cfg.gpt_model_engine is not None:
+                if stamp is not None and stamp == self._config_stamp:
+                    return
+                if stamp is None and now < self._next_config_check:
+                    return
+            # 本地 system.conf 被修改过：load_config 默认读取进程内缓存，需要强制重新读文件
+            force_reload = (
+                stamp is not None
+                and self._config_stamp is not None
+                and stamp != self._config_stamp
+                and os.path.basename(os.path.dirname(stamp[0])) != "cache_data"
+            )
+            self._next_config_check = now + self.CONFIG_RECHECK_SECONDS
+        cfg.load_config(force_reload=force_reload)
+        path = cfg.system_conf_path
+        try:
+            stamp = (path, os.stat(path).st_mtime_ns) if path else None
+        except OSError:
+            stamp = None
+        with self._lock:
+            self._config_stamp = stamp
+
+    def get(self, role: str, model: str, base_url: str, api_key: str, streaming: bool, **kwargs) -> ChatOpenAI:
+        key = (role, model, base_url, api_key, streaming)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._reused += 1
+                return client
+            for stale in [k for k in self._clients if k[0] == role and k[4] == streaming]:
+                del self._clients[stale]
+            client = ChatOpenAI(
+                model=model,
+                base_url=base_url,
+                api_key=api_key,
+                streaming=streaming,
+                **kwargs,
+            )
+            self._clients[key] = client
+            self._created += 1
+        util.log(1, f"[LLM工厂] 创建{'大' if role == 'big' else '小'}模型实例: model={model}, base_url={base_url}, streaming={streaming}")
+        return client
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clients.clear()
+            self._config_stamp = None
+            self._next_config_check = 0.0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"clients": len(self._clients), "created": self._created, "reused": self._reused}
+
+
+llm_clients = LLMClientRegistry()
+
+
 def _get_llm_instance(role: str = "small", streaming: bool = True) -> ChatOpenAI:
     """
-    获取 LLM 实例。
+    获取 LLM 实例（由 llm_clients 复用，配置未变时不会重复创建）。
     role="big"  → 优先用 system.conf 中的 big_model_* 配置，无配置时降级为小模型
     role="small" → 使用 system.conf 中的 gpt_* 配置
     """
-    cfg.load_config()
+    llm_clients.refresh_config()
 
     if role == "big":
         if cfg.big_model_engine:
-            actual_base_url = cfg.big_model_base_url or cfg.gpt_base_url
-            actual_api_key = cfg.big_model_api_key or cfg.key_gpt_api_key
-            util.log(1, f"[LLM工厂] 使用大模型: model={cfg.big_model_engine}, base_url={actual_base_url}")
-            return ChatOpenAI(
-                model=cfg.big_model_engine,
-                base_url=actual_base_url,
-                api_key=actual_api_key,
-                streaming=streaming,
+            return llm_clients.get(
+                "big",
+                cfg.big_model_engine,
+                cfg.big_model_base_url or cfg.gpt_base_url,
+                cfg.big_model_api_key or cfg.key_gpt_api_key,
+                streaming,
                 timeout=120,
                 max_retries=2,
             )
@@ -194,12 +282,12 @@ def _get_llm_instance(role: str = "small", streaming: bool = True) -> ChatOpenAI
         util.log(1, f"[LLM工厂] 请求大模型但未配置 big_model_engine，降级为小模型: {cfg.gpt_model_engine}")
 
     # small / 降级：使用原始 gpt 配置
-    util.log(1, f"[LLM工厂] 使用小模型: model={cfg.gpt_model_engine}, base_url={cfg.gpt_base_url}")
-    return ChatOpenAI(
-        model=cfg.gpt_model_engine,
-        base_url=cfg.gpt_base_url,
-        api_key=cfg.key_gpt_api_key,
-        streaming=streaming,
+    return llm_clients.get(
+        "small",
+        cfg.gpt_model_engine,
+        cfg.gpt_base_url,
+        cfg.key_gpt_api_key,
+        streaming,
         timeout=60,
         max_retries=1,
     )
@@ -0,0 +1,182 @@
+"""
+本地知识库（llm/data）的倒排索引。
+
+原来的 search_knowledge_base 每次提问都把所有文档重新按句切分、转小写，再对每个
+关键词做子串匹配，耗时随语料总长度线性增长。这里在加载时一次性建好索引：
+  - 分句：与原实现一致，按 。！？ 和换行切分
+  - 分词：英文/数字按单词，中文按相邻两字（bigram，单字片段保留单字），不依赖 jieba
+  - 倒排表：词 -> {句子 id: 词频}，按 BM25 给句子打分，再按文件汇总
+文件变化时只需 update_document / remove_document 重建受影响的文档。
+"""
+import math
+import re
+import threading
+from collections import Counter
+
+import numpy as np
+
+_SENTENCE_SPLIT_RE = re.compile(r'[。！？\n]')
+_TOKEN_RE = re.compile(r'[a-z0-9_]+|[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def split_sentences(content):
+    """按句切分并去掉空句，返回去除首尾空白后的句子列表。"""
+    return [s.strip() for s in _SENTENCE_SPLIT_RE.split(content) if s.strip()]
+
+
+def tokenize(text):
+    """英文/数字取整词，中文连续片段取相邻两字；结果已转小写。"""
+    tokens = []
+    for run in _TOKEN_RE.findall(text.lower()):
+        if run[0] < '\u3400':
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class KnowledgeIndex:
+    """句子级 BM25 倒排索引，支持按文件增量更新，线程安全。"""
+
+    def __init__(self):
+        self._postings = {}      # term -> {sid: tf}
+        self._sentences = {}     # sid -> (file_name, text, length, terms)
+        self._doc_sids = {}      # file_name -> [sid, ...]
+        self._next_sid = 0
+        self._total_length = 0
+        # 查询时用的紧凑表示：term -> (sids, BM25 词频权重)，索引变更后懒重建
+        self._compiled = {}
+        self._generation = 0
+        self._sid_file = np.zeros(0, dtype=np.int32)
+        self._file_ids = {}
+        self._file_names = []
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_documents(cls, documents):
+        index = cls()
+        for file_name, content in documents.items():
+            index.update_document(file_name, content)
+        return index
+
+    def __len__(self):
+        return len(self._doc_sids)
+
+    def __contains__(self, file_name):
+        return file_name in self._doc_sids
+
+    @property
+    def sentence_count(self):
+        return len(self._sentences)
+
+    def update_document(self, file_name, content, sentences=None):
+        """(重新)索引一个文件；sentences 可传入预先切好的句子（例如来自解析缓存）。"""
+        if sentences is None:
+            sentences = split_sentences(content or "")
+        with self._lock:
+            self._remove(file_name)
+            file_id = self._file_ids.get(file_name)
+            if file_id is None:
+                file_id = self._file_ids[file_name] = len(self._file_names)
+                self._file_names.append(file_name)
+            sids = []
+            for text in sentences:
+                counts = Counter(tokenize(text))
+                if not counts:
+                    continue
+                sid = self._next_sid
+                self._next_sid += 1
+                length = sum(counts.values())
+                self._sentences[sid] = (file_name, text, length, tuple(counts))
+                self._total_length += length
+                for term, tf in counts.items():
+                    self._postings.setdefault(term, {})[sid] = tf
+                sids.append(sid)
+            self._doc_sids[file_name] = sids
+            if self._next_sid > self._sid_file.shape[0]:
+                grown = np.full(max(1024, self._next_sid * 2), -1, dtype=np.int32)
+                grown[:self._sid_file.shape[0]] = self._sid_file
+                self._sid_file = grown
+            self._sid_file[sids] = file_id
+            self._generation += 1
+
+    def remove_document(self, file_name):
+        with self._lock:
+            self._remove(file_name)
+            self._generation += 1
+
+    def _remove(self, file_name):
+        for sid in self._doc_sids.pop(file_name, ()):
+            _, _, length, terms = self._sentences.pop(sid)
+            self._total_length -= length
+            self._sid_file[sid] = -1
+            for term in terms:
+                posting = self._postings.get(term)
+                if posting is None:
+                    continue
+                posting.pop(sid, None)
+                if not posting:
+                    del self._postings[term]
+
+    def _compiled_posting(self, term, avg_length):
+        cached = self._compiled.get(term)
+        if cached is not None and cached[0] == self._generation:
+            return cached[1:]
+        posting = self._postings[term]
+        sids = np.fromiter(posting.keys(), dtype=np.int64, count=len(posting))
+        tf = np.fromiter(posting.values(), dtype=np.float32, count=len(posting))
+        lengths = np.fromiter((self._sentences[sid][2] for sid in posting), dtype=np.float32, count=len(posting))
+        weights = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_length))
+        files = self._sid_file[sids]
+        self._compiled[term] = (self._generation, sids, weights, files)
+        return sids, weights, files
+
+    def search(self, query, max_results=3, sentences_per_file=5):
+        """
+        BM25 检索，返回与原 search_knowledge_base 相同的结构：
+        [{'file_name', 'score', 'content'}]，content 为该文件得分最高的若干句。
+        """
+        terms = set(tokenize(query or ""))
+        if not terms:
+            return []
+        with self._lock:
+            n_sentences = len(self._sentences)
+            if not n_sentences:
+                return []
+            avg_length = self._total_length / n_sentences
+            scores = np.zeros(self._next_sid, dtype=np.float32)
+            file_scores = np.zeros(len(self._file_names), dtype=np.float64)
+            matched = False
+            for term in terms:
+                if term not in self._postings:
+                    continue
+                sids, weights, files = self._compiled_posting(term, avg_length)
+                df = sids.shape[0]
+                idf = math.log(1 + (n_sentences - df + 0.5) / (df + 0.5))
+                scores[sids] += idf * weights
+                file_scores += np.bincount(files, weights=idf * weights, minlength=file_scores.shape[0])
+                matched = True
+            if not matched:
+                return []
+
+            results = []
+            for file_id in np.argsort(-file_scores, kind="stable")[:max_results]:
+                if file_scores[file_id] <= 0:
+                    break
+                file_name = self._file_names[file_id]
+                # 同一文件的句子 id 连续分配，只需在该区间内取得分最高的句子
+                doc_sids = self._doc_sids[file_name]
+                first = doc_sids[0]
+                window = scores[first:doc_sids[-1] + 1]
+                order = np.argsort(-window, kind="stable")[:sentences_per_file]
+                results.append({
+                    'file_name': file_name,
+                    'score': round(float(file_scores[file_id]), 4),
+                    'content': '\n'.join(self._sentences[first + int(i)][1] for i in order if window[i] > 0),
+                })
+            return results
@@ -0,0 +1,458 @@
+"""
+本地知识库（llm/data）文件解析与解析结果缓存。
+
+.doc/.docx/.pptx 的文本抽取很慢（.doc 需要启动 Word 或逐字节扫描），原先任一文件
+mtime 变化都会全部重新解析。这里：
+  - 解析结果（文本 + 分句）存到 SQLite（cache_data/knowledge_parse_cache.db），
+    以 (路径, 大小, mtime, 内容 sha1) 为键：大小和 mtime 未变直接命中；只是被 touch
+    或改名、内容未变的文件按 sha1 命中，不重新解析
+  - 未命中的 Office 文件在进程池中并行解析，冷启动时用满所有核
+
+配置（config.json 的 knowledge_base，可选）：
+  parse_cache     是否启用解析缓存，默认 true
+  parse_workers   解析进程数，0 表示按 CPU 核数自动选择
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import docx
+from docx.oxml.table import CT_Tbl
+from docx.oxml.text.paragraph import CT_P
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+try:
+    from pptx import Presentation
+    PPTX_AVAILABLE = True
+except ImportError:
+    PPTX_AVAILABLE = False
+
+# 用于处理 .doc 文件的库
+try:
+    import win32com.client
+    WIN32COM_AVAILABLE = True
+except ImportError:
+    WIN32COM_AVAILABLE = False
+
+from llm.knowledge_index import split_sentences
+from utils import util
+
+_project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+DEFAULT_CONFIG = {
+    "parse_cache": True,
+    "parse_workers": 0,
+    "cache_path": os.path.join(_project_root, "cache_data", "knowledge_parse_cache.db"),
+}
+
+SUPPORTED_EXTENSIONS = ('.docx', '.doc', '.pptx', '.txt', '')
+OFFICE_EXTENSIONS = ('.docx', '.doc', '.pptx')
+
+
+def _load_config():
+    conf = dict(DEFAULT_CONFIG)
+    cfg = sys.modules.get("utils.config_util")
+    try:
+        if cfg is not None and cfg.config:
+            conf.update(cfg.config.get("knowledge_base", {}) or {})
+    except Exception:
+        pass
+    return conf
+
+
+def read_doc_file(file_path):
+    """
+    读取doc文件内容
+    
+    参数:
+        file_path: doc文件路径
+        
+    返回:
+        str: 文档内容
+    """
+    try:
+        # 方法1: 使用 win32com.client（Windows系统，推荐用于.doc文件）
+        if WIN32COM_AVAILABLE:
+            word = None
+            doc = None
+            try:
+                import pythoncom
+                pythoncom.CoInitialize()  # 初始化COM组件
+                
+                word = win32com.client.Dispatch("Word.Application")
+                word.Visible = False
+                doc = word.Documents.Open(file_path)
+                content = doc.Content.Text
+                
+                # 先保存内容，再尝试关闭
+                if content and content.strip():
+                    try:
+                        doc.Close()
+                        word.Quit()
+                    except Exception as close_e:
+                        util.log(1, f"关闭Word应用程序时出错: {str(close_e)}，但内容已成功提取")
+                    
+                    try:
+                        pythoncom.CoUninitialize()  # 清理COM组件
+                    except:
+                        pass
+                    
+                    return content.strip()
+                
+            except Exception as e:
+                util.log(1, f"使用 win32com 读取 .doc 文件失败: {str(e)}")
+            finally:
+                # 确保资源被释放
+                try:
+                    if doc:
+                        doc.Close()
+                except:
+                    pass
+                try:
+                    if word:
+                        word.Quit()
+                except:
+                    pass
+                try:
+                    pythoncom.CoUninitialize()
+                except:
+                    pass
+        
+        # 方法2: 简单的二进制文本提取（备选方案）
+        try:
+            with open(file_path, 'rb') as f:
+                raw_data = f.read()
+                # 尝试提取可打印的文本
+                text_parts = []
+                current_text = ""
+                
+                for byte in raw_data:
+                    char = chr(byte) if 32 <= byte <= 126 or byte in [9, 10, 13] else None
+                    if char:
+                        current_text += char
+                    else:
+                        if len(current_text) > 3:  # 只保留长度大于3的文本片段
+                            text_parts.append(current_text.strip())
+                        current_text = ""
+                
+                if len(current_text) > 3:
+                    text_parts.append(current_text.strip())
+                
+                # 过滤和清理文本
+                filtered_parts = []
+                for part in text_parts:
+                    # 移除过多的重复字符和无意义的片段
+                    if (len(part) > 5 and 
+                        not part.startswith('Microsoft') and 
+                        not all(c in '0123456789-_.' for c in part) and
+                        len(set(part)) > 3):  # 字符种类要多样
+                        filtered_parts.append(part)
+                
+                if filtered_parts:
+                    return '\n'.join(filtered_parts)
+                    
+        except Exception as e:
+            util.log(1, f"使用二进制方法读取 .doc 文件失败: {str(e)}")
+        
+        util.log(1, f"无法读取 .doc 文件 {file_path}，建议转换为 .docx 格式")
+        return ""
+        
+    except Exception as e:
+        util.log(1, f"读取doc文件 {file_path} 时出错: {str(e)}")
+        return ""
+
+
+def read_docx_file(file_path):
+    """
+    读取docx文件内容
+    
+    参数:
+        file_path: docx文件路径
+        
+    返回:
+        str: 文档内容
+    """
+    try:
+        doc = docx.Document(file_path)
+        content = []
+        
+        for element in doc.element.body:
+            if isinstance(element, CT_P):
+                paragraph = Paragraph(element, doc)
+                if paragraph.text.strip():
+                    content.append(paragraph.text.strip())
+            elif isinstance(element, CT_Tbl):
+                table = Table(element, doc)
+                for row in table.rows:
+                    row_text = []
+                    for cell in row.cells:
+                        if cell.text.strip():
+                            row_text.append(cell.text.strip())
+                    if row_text:
+                        content.append(" | ".join(row_text))
+        
+        return "\n".join(content)
+    except Exception as e:
+        util.log(1, f"读取docx文件 {file_path} 时出错: {str(e)}")
+        return ""
+
+
+def read_pptx_file(file_path):
+    """
+    读取pptx文件内容
+    
+    参数:
+        file_path: pptx文件路径
+        
+    返回:
+        str: 演示文稿内容
+    """
+    if not PPTX_AVAILABLE:
+        util.log(1, "python-pptx 库未安装，无法读取 PowerPoint 文件")
+        return ""
+        
+    try:
+        prs = Presentation(file_path)
+        content = []
+        
+        for i, slide in enumerate(prs.slides):
+            slide_content = [f"第{i+1}页："]
+            
+            for shape in slide.shapes:
+                if hasattr(shape, "text") and shape.text.strip():
+                    slide_content.append(shape.text.strip())
+                    
+            if len(slide_content) > 1:  # 有内容才添加
+                content.append("\n".join(slide_content))
+        
+        return "\n\n".join(content)
+    except Exception as e:
+        util.log(1, f"读取pptx文件 {file_path} 时出错: {str(e)}")
+        return ""
+
+
+def read_knowledge_file(file_path):
+    """
+    读取单个知识库文件的文本内容
+    
+    返回:
+        str: 文件内容；无法解码时返回 None
+    """
+    file_extension = os.path.splitext(file_path)[1].lower()
+    if file_extension == '.docx':
+        return read_docx_file(file_path)
+    if file_extension == '.doc':
+        return read_doc_file(file_path)
+    if file_extension == '.pptx':
+        return read_pptx_file(file_path)
+    # 尝试作为文本文件读取
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except UnicodeDecodeError:
+        try:
+            with open(file_path, 'r', encoding='gbk') as f:
+                return f.read()
+        except UnicodeDecodeError:
+            util.log(1, f"无法解码文件: {os.path.basename(file_path)}")
+            return None
+
+
+def parse_knowledge_file(file_path):
+    """解析文件并分句，返回 (content, sentences)；进程池的工作函数。"""
+    content = read_knowledge_file(file_path)
+    if not content or not content.strip():
+        return None, []
+    return content, split_sentences(content)
+
+
+def _file_sha1(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ParsedDocCache:
+    """SQLite 解析结果缓存，线程安全；打不开数据库时退化为不缓存。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._failed = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _db(self):
+        if self._conn is not None or self._failed:
+            return self._conn
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS parsed_docs ("
+                "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime REAL NOT NULL, "
+                "sha1 TEXT NOT NULL, content TEXT NOT NULL, sentences TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_parsed_docs_sha1 ON parsed_docs(sha1)")
+            conn.commit()
+            self._conn = conn
+        except Exception as e:
+            util.log(1, f"知识库解析缓存不可用，将直接解析文件: {str(e)}")
+            self._failed = True
+        return self._conn
+
+    def lookup(self, file_path, size, mtime):
+        """
+        查找缓存。
+
+        返回:
+            tuple: (命中的 (content, sentences) 或 None, 文件 sha1 或 None)
+        """
+        with self._lock:
+            conn = self._db()
+            if conn is None:
+                return None, None
+            try:
+                row = conn.execute(
+                    "SELECT size, mtime, sha1, content, sentences FROM parsed_docs WHERE path = ?",
+                    (file_path,)).fetchone()
+                if row is not None and row[0] == size and row[1] == mtime:
+                    self.hits += 1
+                    return (row[3], json.loads(row[4])), row[2]
+                # 大小/mtime 变了：按内容哈希再查一次（touch、复制、改名的文件不必重新解析）
+                sha1 = _file_sha1(file_path)
+                row = conn.execute(
+                    "SELECT content, sentences FROM parsed_docs WHERE sha1 = ? AND size = ? LIMIT 1",
+                    (sha1, size)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None, sha1
+                conn.execute(
+                    "INSERT OR REPLACE INTO parsed_docs (path, size, mtime, sha1, content, sentences) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", (file_path, size, mtime, sha1, row[0], row[1]))
+                conn.commit()
+                self.hits += 1
+                return (row[0], json.loads(row[1])), sha1
+            except (sqlite3.Error, OSError, ValueError) as e:
+                util.log(1, f"读取知识库解析缓存失败: {str(e)}")
+                return None, None
+
+    def store(self, file_path, size, mtime, sha1, content, sentences):
+        with self._lock:
+            conn = self._db()
+            if conn is None:
+                return
+            try:
+                if sha1 is None:
+                    sha1 = _file_sha1(file_path)
+                conn.execute(
+                    "INSERT OR REPLACE INTO parsed_docs (path, size, mtime, sha1, content, sentences) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (file_path, size, mtime, sha1, content, json.dumps(sentences, ensure_ascii=False)))
+                conn.commit()
+            except (sqlite3.Error, OSError) as e:
+                util.log(1, f"写入知识库解析缓存失败: {str(e)}")
+
+    def prune(self, keep_paths):
+        """删除不在 keep_paths 中的条目（文件已删除）。"""
+        with self._lock:
+            conn = self._db()
+            if conn is None:
+                return
+            try:
+                keep = set(keep_paths)
+                stale = [(p,) for (p,) in conn.execute("SELECT path FROM parsed_docs") if p not in keep]
+                if stale:
+                    conn.executemany("DELETE FROM parsed_docs WHERE path = ?", stale)
+                    conn.commit()
+            except sqlite3.Error as e:
+                util.log(1, f"清理知识库解析缓存失败: {str(e)}")
+
+
+_parse_cache = None
+_parse_cache_lock = threading.Lock()
+
+
+def get_parse_cache():
+    """全局解析缓存；配置 knowledge_base.parse_cache=false 时返回 None。"""
+    global _parse_cache
+    if _parse_cache is None:
+        with _parse_cache_lock:
+            if _parse_cache is None:
+                conf = _load_config()
+                if conf.get("parse_cache", True):
+                    _parse_cache = ParsedDocCache(conf.get("cache_path") or DEFAULT_CONFIG["cache_path"])
+                else:
+                    _parse_cache = False
+    return _parse_cache or None
+
+
+def _parse_workers(pending):
+    workers = int(_load_config().get("parse_workers") or 0)
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return max(1, min(workers, pending))
+
+
+def load_knowledge_files(file_paths):
+    """
+    解析一批知识库文件，已缓存的直接返回，其余的 Office 文件放进进程池并行解析。
+
+    返回:
+        dict: 文件路径 -> (content, sentences)；空文件或解析失败的文件不包含在内
+    """
+    cache = get_parse_cache()
+    results = {}
+    pending = []  # (path, size, mtime, sha1)
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            continue
+        hit, sha1 = (None, None)
+        if cache is not None:
+            hit, sha1 = cache.lookup(file_path, stat.st_size, stat.st_mtime)
+        if hit is not None:
+            if hit[0]:
+                results[file_path] = hit
+            continue
+        pending.append((file_path, stat.st_size, stat.st_mtime, sha1))
+
+    def _store(item, parsed):
+        content, sentences = parsed
+        if cache is not None and content is not None:
+            cache.store(item[0], item[1], item[2], item[3], content, sentences)
+        if content:
+            results[item[0]] = (content, sentences)
+
+    office = [item for item in pending if os.path.splitext(item[0])[1].lower() in OFFICE_EXTENSIONS]
+    plain = [item for item in pending if item not in office]
+    for item in plain:
+        _store(item, parse_knowledge_file(item[0]))
+
+    workers = _parse_workers(len(office)) if office else 1
+    if workers > 1:
+        start = time.time()
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for item, parsed in zip(office, pool.map(parse_knowledge_file, [item[0] for item in office])):
+                    _store(item, parsed)
+            util.log(1, f"并行解析 {len(office)} 个知识库文件完成（{workers} 进程），耗时 {time.time() - start:.2f}s")
+            office = []
+        except Exception as e:
+            # 进程池不可用（受限环境、打包程序等）时退回当前进程逐个解析
+            util.log(1, f"知识库进程池解析失败，改为顺序解析: {str(e)}")
+            office = [item for item in office if item[0] not in results]
+    for item in office:
+        _store(item, parse_knowledge_file(item[0]))
+
+    return results
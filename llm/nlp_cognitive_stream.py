@@ -24,28 +24,11 @@ except Exception:
 # 新增：本地知识库相关导入
 import re
 from pathlib import Path
-import docx
-from docx.document import Document
-from docx.oxml.table import CT_Tbl
-from docx.oxml.text.paragraph import CT_P
-from docx.table import _Cell, Table
-from docx.text.paragraph import Paragraph
-try:
-    from pptx import Presentation
-    PPTX_AVAILABLE = True
-except ImportError:
-    PPTX_AVAILABLE = False
-
-# 用于处理 .doc 文件的库
-try:
-    import win32com.client
-    WIN32COM_AVAILABLE = True
-except ImportError:
-    WIN32COM_AVAILABLE = False
 
 from utils import util
 import utils.config_util as cfg
 from genagents.genagents import GenerativeAgent
+from genagents.modules import memory_store
 from genagents.modules.memory_stream import ConceptNode, generate_importance_score
 from simulation_engine.gpt_structure import get_text_embedding
 from urllib3.exceptions import InsecureRequestWarning
@@ -54,6 +37,12 @@ from core import content_db
 from core import stream_manager
 from core import member_db
 from faymcp import runtime_bridge as mcp_runtime
+from faymcp import prestart_runner
+from llm.agent_cache import AgentCache
+from llm.knowledge_index import KnowledgeIndex
+from llm.knowledge_loader import SUPPORTED_EXTENSIONS, get_parse_cache, load_knowledge_files
+from llm import context_packer, prompt_builder, speculative_stream
+from llm.speculative_stream import SpeculativeStream
 from llm.execution_manager import (
     ExecutionManager, ExecutionState, ExecutionStatus,
     get_execution_manager, _get_llm_instance,
@@ -65,8 +54,20 @@ cfg.load_config()
 # 禁用不安全请求警告
 requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
 
-agents = {}  # type: dict[str, GenerativeAgent]
-agent_lock = threading.RLock()  # 使用可重入锁保护agent对象
+# 按用户缓存的 agent：超出数量/内存预算或长时间空闲时落盘并淘汰，下次 create_agent 懒加载
+agents = AgentCache(config_getter=lambda: cfg.config.get('memory', {}).get('agent_cache', {}))  # type: AgentCache
+
+# 按用户加锁：读写某个用户的 agent / 记忆只持该用户的锁，不同用户之间互不阻塞；
+# 锁表登记由 AgentCache 内部锁短暂保护
+def get_user_lock(username=None):
+    """返回用户专属的可重入锁（username 为空时对应默认用户 User，与 create_agent 一致）。"""
+    try:
+        isolate = cfg.config["memory"]["isolate_by_user"]
+    except Exception:
+        isolate = False
+    # 未按用户隔离时所有用户共用同一个记忆目录，落盘必须串行，退回到一把共享锁
+    return agents.lock_for((username or "User") if isolate else "")
+
 reflection_lock = threading.RLock()  # 使用可重入锁保护reflection_time
 save_lock = threading.RLock()  # 使用可重入锁保护save_time
 reflection_time = None
@@ -173,24 +174,6 @@ class AgentState(TypedDict, total=False):
     max_steps: int
 
 
-def _find_last_safe_punct(text: str, punctuation_list) -> int:
-    """在文本中查找最后一个安全的标点切分位置，跳过数字中的小数点（如0.85）"""
-    last_punct_pos = -1
-    for punct in punctuation_list:
-        pos = text.rfind(punct)
-        # 对英文句点，跳过数字间的小数点
-        while pos > 0 and punct == ".":
-            prev_ch = text[pos - 1] if pos > 0 else ""
-            next_ch = text[pos + 1] if pos + 1 < len(text) else ""
-            if prev_ch.isdigit() and next_ch.isdigit():
-                pos = text.rfind(punct, 0, pos)
-            else:
-                break
-        if pos > last_punct_pos:
-            last_punct_pos = pos
-    return last_punct_pos
-
-
 def _truncate_text(text: Any, limit: int = 400) -> str:
     text_str = "" if text is None else str(text)
     if len(text_str) <= limit:
@@ -460,7 +443,7 @@ def _format_conversation_block(conversation: List[Dict], username: str = "User")
 
 
 def _run_prestart_tools(user_question: str) -> List[Dict[str, Any]]:
-    """Call configured prestart MCP tools and return a list of result objects."""
+    """Call configured prestart MCP tools concurrently and return result objects in configured order."""
     try:
         tools = mcp_runtime.list_runnable_prestart_tools()
     except Exception as exc:
@@ -469,29 +452,48 @@ def _run_prestart_tools(user_question: str) -> List[Dict[str, Any]]:
     if not tools:
         return []
 
-    results: List[Dict[str, Any]] = []
+    prepared = []
     for item in tools:
         server_id = item.get("server_id")
         tool_name = item.get("tool")
         if not server_id or not tool_name:
             continue
         params = item.get("params") or {}
-        include_history = item.get("include_history", True)
 
         try:
             filled_params = _apply_question_placeholder(params, user_question)
         except Exception:
             filled_params = params or {}
-
-        try:
-            success, result = mcp_runtime.call_tool(
-                int(server_id),
-                tool_name,
+        prepared.append((item, filled_params))
+
+    # 各工具并发调用，超时或失败的工具直接跳过，结果按配置顺序合并
+    outcomes = prestart_runner.run_calls([
+        (
+            item.get("tool"),
+            lambda item=item, filled_params=filled_params: mcp_runtime.call_tool(
+                int(item.get("server_id")),
+                item.get("tool"),
                 filled_params,
                 skip_enabled_check=True,
-            )
-        except Exception as exc:
-            util.log(1, f"预启动工具 {tool_name} 调用异常: {exc}")
+            ),
+            (item.get("server_id"), item.get("tool")),
+        )
+        for item, filled_params in prepared
+    ])
+
+    results: List[Dict[str, Any]] = []
+    for (item, filled_params), outcome in zip(prepared, outcomes):
+        tool_name = item.get("tool")
+        include_history = item.get("include_history", True)
+        success, result = outcome.success, outcome.result
+        if outcome.status == "timeout":
+            util.log(1, f"预启动工具 {tool_name} 超时，已跳过")
+            continue
+        if outcome.status == "skipped":
+            util.log(1, f"预启动工具 {tool_name} 上一次调用超时仍未结束，已跳过")
+            continue
+        if outcome.status == "error":
+            util.log(1, f"预启动工具 {tool_name} 调用异常: {result}")
             continue
 
         if success:
@@ -784,6 +786,137 @@ def _build_dialogue_messages(
     return normalized
 
 
+def _dialogue_text(messages: List[HumanMessage | AIMessage]) -> str:
+    return "\n".join(m.content for m in messages if isinstance(m.content, str))
+
+
+# 超出 token 预算时各段的收缩顺序：数值小的先收缩；_REQUIRED_SECTIONS 中的段原样保留。
+# 对话历史拆成两段：较早的轮次先于关联记忆收缩，最近几条消息晚于关联记忆收缩
+_SECTION_PRIORITY = {
+    "历史工具执行": 10,
+    "工具执行摘要": 10,
+    "对话历史": 15,
+    "关联记忆": 20,
+    "近期对话": 30,
+    "预启动工具结果": 40,
+    "其他观察": 50,
+    "最新工具结果": 60,
+    "规划器预览": 70,
+    "规划器建议": 70,
+}
+_REQUIRED_SECTIONS = {"规划规则", "可用工具", "知识库主题", "系统提示词", "工具结果约束"}
+# 归入"近期对话"的最近消息条数（约 3 轮）
+_RECENT_DIALOGUE_MESSAGES = 6
+
+
+def _memory_section(context: Dict[str, Any]) -> context_packer.ContextSection:
+    """关联记忆按条参与预算，超出时先丢综合得分低的；没有逐条记忆时退回整段文本。"""
+    items = context.get("memory_items") or []
+    priority = _SECTION_PRIORITY["关联记忆"]
+    if not items:
+        text = _format_context_section("关联记忆", context.get("memory_context", ""))
+        return context_packer.ContextSection.text("关联记忆", text, priority=priority)
+    labels = [label for label, _, _ in items]
+
+    def render(kept):
+        lines = ["**关联记忆**"]
+        for label in dict.fromkeys(labels[i] for i, _ in kept):
+            lines.append(f"**{label}**")
+            lines.extend(text for i, text in kept if labels[i] == label)
+        return "\n".join(lines)
+
+    return context_packer.ContextSection(
+        "关联记忆",
+        [line for _, line, _ in items],
+        priority=priority,
+        scores=[float(score) for _, _, score in items],
+        render=render,
+    )
+
+
+def _with_content(msg: HumanMessage | AIMessage, text: str) -> HumanMessage | AIMessage:
+    """替换消息正文，保留 name / id / additional_kwargs 等其余字段。"""
+    if msg.content == text:
+        return msg
+    copy = getattr(msg, "model_copy", None) or msg.copy
+    return copy(update={"content": text})
+
+
+def _pack_prompt(
+    tag: str,
+    sections: List[Tuple[str, Any] | context_packer.ContextSection],
+    dialogue_messages: List[HumanMessage | AIMessage],
+) -> Tuple[str, List[HumanMessage | AIMessage]]:
+    """按 token 预算裁剪系统提示词各段与对话历史，返回 (系统提示词, 对话消息)。"""
+    packed = [
+        section if isinstance(section, context_packer.ContextSection)
+        else context_packer.ContextSection.text(
+            section[0],
+            section[1],
+            priority=_SECTION_PRIORITY.get(section[0], 0),
+            required=section[0] in _REQUIRED_SECTIONS,
+        )
+        for section in sections
+    ]
+    conf = context_packer.load_config()
+    if conf.get("enabled", True):
+        contents = [m.content if isinstance(m.content, str) else str(m.content) for m in dialogue_messages]
+        split = max(0, len(contents) - _RECENT_DIALOGUE_MESSAGES)
+        older = context_packer.ContextSection(
+            "对话历史", contents[:split], priority=_SECTION_PRIORITY["对话历史"],
+        )
+        recent = context_packer.ContextSection(
+            "近期对话", contents[split:], priority=_SECTION_PRIORITY["近期对话"], min_items=1,
+        )
+        total, before = context_packer.pack(packed + [older, recent], conf=conf)
+        if total < before:
+            util.log(1, f"[上下文预算] {tag} 提示词 {before} -> {total} tokens")
+        kept = older.kept + [(split + i, text) for i, text in recent.kept]
+        dialogue_messages = [_with_content(dialogue_messages[i], text) for i, text in kept]
+        # 丢掉最旧的几轮后可能以 AI 消息开头，模型模板要求首条为用户消息
+        while len(dialogue_messages) > 1 and isinstance(dialogue_messages[0], AIMessage):
+            dialogue_messages.pop(0)
+    else:
+        for section in packed:
+            section.kept = list(enumerate(section.items))
+    texts = [(section.name, section.rendered()) for section in packed]
+    prompt_builder.record_sections(tag, texts + [("对话历史", _dialogue_text(dialogue_messages))])
+    return _merge_system_input(*(text for _, text in texts)), dialogue_messages
+
+
+_PLANNER_RULES = _merge_system_input(
+    "你是一个闲聊判断器。判断用户的话是不是闲聊，请严格输出合法 JSON，不要输出其他内容。",
+    '【你在系统里的角色】'
+    '\n你是第一响应者。你的回答如果涉及事实信息，系统会在后台另起一个大模型自动核实并修正，'
+    '用户最终看到的是"你的回答 + 系统加的过渡语 + 核实模型的修正"。'
+    '\n所以：不要自己演过渡过程。不要在 message 里写'
+    '"我来查一下""等等我核实一下""稍等我看看""马上好""我这就重新跑一下"这类描述动作的话 —— '
+    '那些过渡语由系统统一插入，你写了只会和系统的话重复。'
+    '\n你只需要：'
+    '\n- 直接给出你当前最好的答案（闲聊时输出 finish）'
+    '\n- 如果非得调工具才能答，直接输出 tool，不要在 finish 里编查询过程'
+    '\n\n输出格式只有两种：'
+    '\n1. 是闲聊: {"action": "finish", "message": "你的回复内容"}'
+    '\n2. 不是闲聊: {"action": "tool", "keyword": "提取的搜索关键词"}'
+    '\n\n什么是闲聊（输出 finish）：'
+    '\n- 打招呼：你好、hi、早上好'
+    '\n- 情绪表达：我好开心、今天好累'
+    '\n- 感谢道别：谢谢、再见、拜拜'
+    '\n- 简单确认：好的、收到、明白了'
+    '\n- 对你上一句话的回应：哈哈、对的、没错、说得好'
+    '\n\n什么不是闲聊（输出 tool）：'
+    '\n- 问任何具体事物/概念：XX是什么、你知道XX吗'
+    '\n- 要求查询/获取/阅读内容'
+    '\n- 提到任何产品名、项目名、专有名词'
+    '\n- 任何你需要查资料才能准确回答的问题'
+    '\n- 用户的问题涉及下方"可用工具"或"知识库主题"中的任何内容'
+    '\n\nkeyword 提取规则：'
+    '\n- keyword 必须是具体的搜索主题词，不能是"再查一下""详细说说"等动作描述'
+    '\n- 如果用户消息是指代性的（如"再查一下""继续""详细说说"），从对话历史中找到实际话题作为 keyword'
+    '\n\n不确定时 → 输出 tool',
+)
+
+
 def _build_planner_messages(state: AgentState) -> List[SystemMessage | HumanMessage | AIMessage]:
     context = state.get("context", {}) or {}
     system_prompt = context.get("system_prompt", "")
@@ -792,86 +925,43 @@ def _build_planner_messages(state: AgentState) -> List[SystemMessage | HumanMess
     planner_preview = state.get("planner_preview")
     conversation = state.get("messages", []) or []
     history = state.get("tool_results", []) or []
-    memory_context = context.get("memory_context", "")
     observation = context.get("observation", "")
     prestart_context = context.get("prestart_context", "")
     username = context.get("username", "User")
 
     history_text = _truncate_history(history)
     latest_tool_result_text = _get_latest_tool_result_text(history)
-    tools_text = _format_tools_for_prompt(tool_specs)
-    if prestart_context and prestart_context.strip():
-        formatted_items = []
-        for item in prestart_context.split("\n\n"):
-            item = item.strip()
-            if not item:
-                continue
-            lines = item.split("\n", 1)
-            if len(lines) == 2:
-                header, result = lines
-                formatted_items.append(f"{header}\n```\n{result.strip()}\n```")
-            else:
-                formatted_items.append(f"```\n{item}\n```")
-        wrapped_results = "\n".join(formatted_items)
-        prestart_section = f"\n**预启动工具结果**\n{wrapped_results}\n---\n"
-    else:
-        prestart_section = ""
 
     knowledge_hint = context.get("knowledge_hint", "")
     # 构建工具名列表（简短，只列名称）
     tool_names = ", ".join(tool_specs.keys()) if tool_specs else "无"
 
-    planner_system = _merge_system_input(
-        "你是一个闲聊判断器。判断用户的话是不是闲聊，请严格输出合法 JSON，不要输出其他内容。",
-        '【你在系统里的角色】'
-        '\n你是第一响应者。你的回答如果涉及事实信息，系统会在后台另起一个大模型自动核实并修正，'
-        '用户最终看到的是"你的回答 + 系统加的过渡语 + 核实模型的修正"。'
-        '\n所以：不要自己演过渡过程。不要在 message 里写'
-        '"我来查一下""等等我核实一下""稍等我看看""马上好""我这就重新跑一下"这类描述动作的话 —— '
-        '那些过渡语由系统统一插入，你写了只会和系统的话重复。'
-        '\n你只需要：'
-        '\n- 直接给出你当前最好的答案（闲聊时输出 finish）'
-        '\n- 如果非得调工具才能答，直接输出 tool，不要在 finish 里编查询过程'
-        '\n\n输出格式只有两种：'
-        '\n1. 是闲聊: {"action": "finish", "message": "你的回复内容"}'
-        '\n2. 不是闲聊: {"action": "tool", "keyword": "提取的搜索关键词"}'
-        '\n\n什么是闲聊（输出 finish）：'
-        '\n- 打招呼：你好、hi、早上好'
-        '\n- 情绪表达：我好开心、今天好累'
-        '\n- 感谢道别：谢谢、再见、拜拜'
-        '\n- 简单确认：好的、收到、明白了'
-        '\n- 对你上一句话的回应：哈哈、对的、没错、说得好'
-        '\n\n什么不是闲聊（输出 tool）：'
-        '\n- 问任何具体事物/概念：XX是什么、你知道XX吗'
-        '\n- 要求查询/获取/阅读内容'
-        '\n- 提到任何产品名、项目名、专有名词'
-        '\n- 任何你需要查资料才能准确回答的问题'
-        '\n- 用户的问题涉及下方"可用工具"或"知识库主题"中的任何内容'
-        '\n\nkeyword 提取规则：'
-        '\n- keyword 必须是具体的搜索主题词，不能是"再查一下""详细说说"等动作描述'
-        '\n- 如果用户消息是指代性的（如"再查一下""继续""详细说说"），从对话历史中找到实际话题作为 keyword'
-        '\n\n不确定时 → 输出 tool',
-        system_prompt,
-        _format_context_section("关联记忆", memory_context),
-        _format_context_section("可用工具", tool_names),
-        _format_context_section("知识库主题（提到这些主题必须输出 tool）", knowledge_hint),
-        _format_context_section("最新工具结果", latest_tool_result_text),
-        _format_context_section("预启动工具结果", prestart_context),
-        _format_context_section("其他观察", observation),
-        _format_context_section("历史工具执行", history_text if history_text != "（暂无）" else ""),
-        _format_context_section("规划器预览", planner_preview),
-    )
+    # 规则、工具名和知识库主题在各轮之间不变，排在人设提示词之前，与其静态前缀一起构成可缓存前缀；
+    # system_prompt 以当前时间结尾，其后的段落逐轮变化
+    planner_sections = [
+        ("规划规则", _PLANNER_RULES),
+        ("可用工具", _format_context_section("可用工具", tool_names)),
+        ("知识库主题", _format_context_section("知识库主题（提到这些主题必须输出 tool）", knowledge_hint)),
+        ("系统提示词", system_prompt),
+        _memory_section(context),
+        ("最新工具结果", _format_context_section("最新工具结果", latest_tool_result_text)),
+        ("预启动工具结果", _format_context_section("预启动工具结果", prestart_context)),
+        ("其他观察", _format_context_section("其他观察", observation)),
+        ("历史工具执行", _format_context_section("历史工具执行", history_text if history_text != "（暂无）" else "")),
+        ("规划器预览", _format_context_section("规划器预览", planner_preview)),
+    ]
     dialogue_messages = _build_dialogue_messages(conversation, username, fallback_request=request)
     if not dialogue_messages:
         dialogue_messages = [HumanMessage(content=request or "你好")]
+    planner_system, dialogue_messages = _pack_prompt("planner", planner_sections, dialogue_messages)
 
     return [SystemMessage(content=planner_system), *dialogue_messages]
 
+
 def _build_final_messages(state: AgentState) -> List[SystemMessage | HumanMessage | AIMessage]:
     context = state.get("context", {}) or {}
     system_prompt = context.get("system_prompt", "")
     request = state.get("request", "")
-    memory_context = context.get("memory_context", "")
     observation = context.get("observation", "")
     prestart_context = context.get("prestart_context", "")
     conversation = state.get("messages", []) or []
@@ -880,22 +970,6 @@ def _build_final_messages(state: AgentState) -> List[SystemMessage | HumanMessag
 
     history_text = _truncate_history(state.get("tool_results", []))
     latest_tool_result_text = _get_latest_tool_result_text(state.get("tool_results", []) or [])
-    if prestart_context and prestart_context.strip():
-        formatted_items = []
-        for item in prestart_context.split("\n\n"):
-            item = item.strip()
-            if not item:
-                continue
-            lines = item.split("\n", 1)
-            if len(lines) == 2:
-                header, result = lines
-                formatted_items.append(f"{header}\n```\n{result.strip()}\n```")
-            else:
-                formatted_items.append(f"```\n{item}\n```")
-        wrapped_results = "\n".join(formatted_items)
-        prestart_section = f"\n**预启动工具结果**\n{wrapped_results}\n---\n"
-    else:
-        prestart_section = ""
 
     tool_grounding_instruction = ""
     if latest_tool_result_text and latest_tool_result_text.strip():
@@ -905,19 +979,20 @@ def _build_final_messages(state: AgentState) -> List[SystemMessage | HumanMessag
             "要明确说明已知结果与缺失信息。"
         )
 
-    final_system = _merge_system_input(
-        system_prompt,
-        tool_grounding_instruction,
-        _format_context_section("关联记忆", memory_context),
-        _format_context_section("最新工具结果", latest_tool_result_text),
-        _format_context_section("预启动工具结果", prestart_context),
-        _format_context_section("其他观察", observation),
-        _format_context_section("工具执行摘要", history_text if history_text != "（暂无）" else ""),
-        _format_context_section("规划器建议", planner_preview),
-    )
+    final_sections = [
+        ("系统提示词", system_prompt),
+        ("工具结果约束", tool_grounding_instruction),
+        _memory_section(context),
+        ("最新工具结果", _format_context_section("最新工具结果", latest_tool_result_text)),
+        ("预启动工具结果", _format_context_section("预启动工具结果", prestart_context)),
+        ("其他观察", _format_context_section("其他观察", observation)),
+        ("工具执行摘要", _format_context_section("工具执行摘要", history_text if history_text != "（暂无）" else "")),
+        ("规划器建议", _format_context_section("规划器建议", planner_preview)),
+    ]
     dialogue_messages = _build_dialogue_messages(conversation, username, fallback_request=request)
     if not dialogue_messages:
         dialogue_messages = [HumanMessage(content=request or "你好")]
+    final_system, dialogue_messages = _pack_prompt("final", final_sections, dialogue_messages)
 
     return [SystemMessage(content=final_system), *dialogue_messages]
 
@@ -925,6 +1000,7 @@ def _call_planner_llm(
     state: AgentState,
     stream_callback: Optional[Callable[[str], None]] = None,
     on_tool_detected: Optional[Callable[[], None]] = None,
+    on_finish_detected: Optional[Callable[[], None]] = None,
 ) -> Dict[str, Any]:
     """
     调用规划器 LLM，支持流式输出 finish+message 模式。
@@ -933,6 +1009,7 @@ def _call_planner_llm(
         state: 当前工作流状态
         stream_callback: 可选的流式回调函数，用于实时输出 message 内容
         on_tool_detected: 可选回调，流式中检测到 tool action 时立即调用（用于提前推送过渡语）
+        on_finish_detected: 可选回调，流式中判定为直接回复（finish 或纯文本）时立即调用
 
     Returns:
         解析后的决策字典
@@ -1004,6 +1081,8 @@ def _call_planner_llm(
                 finish_compact_prefix = '{"action":"finish","message":"'
                 if compact.startswith(finish_compact_prefix):
                     in_message_mode = True
+                    if on_finish_detected:
+                        on_finish_detected()
                     # 从原始 check_text 中定位 message 值的起始位置
                     # 找到 "message" 键后第一个引号内的内容
                     msg_key_pos = check_text.find('"message"')
@@ -1031,11 +1110,15 @@ def _call_planner_llm(
                     if len(check_text) > 3 and not check_text.startswith('{'):
                         # 不以 { 开头，明确是纯文本
                         in_plaintext_mode = True
+                        if on_finish_detected:
+                            on_finish_detected()
                         stream_callback(check_text)
                     elif check_text.startswith('{') and len(compact) > 15:
                         # 以 { 开头，压缩空白后检查是否匹配已知 JSON action 前缀
                         if not compact.startswith('{"action"'):
                             in_plaintext_mode = True
+                            if on_finish_detected:
+                                on_finish_detected()
                             stream_callback(check_text)
             elif in_message_mode:
                 # 已经在 message 模式，直接流式输出新增内容
@@ -1339,178 +1422,18 @@ def get_current_time_step(username=None):
         util.log(1, f"获取time_step时出错: {str(e)}，使用0代替")
         return 0
 
-# 新增：本地知识库相关函数
-def read_doc_file(file_path):
-    """
-    读取doc文件内容
-    
-    参数:
-        file_path: doc文件路径
-        
-    返回:
-        str: 文档内容
-    """
-    try:
-        # 方法1: 使用 win32com.client（Windows系统，推荐用于.doc文件）
-        if WIN32COM_AVAILABLE:
-            word = None
-            doc = None
-            try:
-                import pythoncom
-                pythoncom.CoInitialize()  # 初始化COM组件
-                
-                word = win32com.client.Dispatch("Word.Application")
-                word.Visible = False
-                doc = word.Documents.Open(file_path)
-                content = doc.Content.Text
-                
-                # 先保存内容，再尝试关闭
-                if content and content.strip():
-                    try:
-                        doc.Close()
-                        word.Quit()
-                    except Exception as close_e:
-                        util.log(1, f"关闭Word应用程序时出错: {str(close_e)}，但内容已成功提取")
-                    
-                    try:
-                        pythoncom.CoUninitialize()  # 清理COM组件
-                    except:
-                        pass
-                    
-                    return content.strip()
-                
-            except Exception as e:
-                util.log(1, f"使用 win32com 读取 .doc 文件失败: {str(e)}")
-            finally:
-                # 确保资源被释放
-                try:
-                    if doc:
-                        doc.Close()
-                except:
-                    pass
-                try:
-                    if word:
-                        word.Quit()
-                except:
-                    pass
-                try:
-                    pythoncom.CoUninitialize()
-                except:
-                    pass
-        
-        # 方法2: 简单的二进制文本提取（备选方案）
-        try:
-            with open(file_path, 'rb') as f:
-                raw_data = f.read()
-                # 尝试提取可打印的文本
-                text_parts = []
-                current_text = ""
-                
-                for byte in raw_data:
-                    char = chr(byte) if 32 <= byte <= 126 or byte in [9, 10, 13] else None
-                    if char:
-                        current_text += char
-                    else:
-                        if len(current_text) > 3:  # 只保留长度大于3的文本片段
-                            text_parts.append(current_text.strip())
-                        current_text = ""
-                
-                if len(current_text) > 3:
-                    text_parts.append(current_text.strip())
-                
-                # 过滤和清理文本
-                filtered_parts = []
-                for part in text_parts:
-                    # 移除过多的重复字符和无意义的片段
-                    if (len(part) > 5 and 
-                        not part.startswith('Microsoft') and 
-                        not all(c in '0123456789-_.' for c in part) and
-                        len(set(part)) > 3):  # 字符种类要多样
-                        filtered_parts.append(part)
-                
-                if filtered_parts:
-                    return '\n'.join(filtered_parts)
-                    
-        except Exception as e:
-            util.log(1, f"使用二进制方法读取 .doc 文件失败: {str(e)}")
-        
-        util.log(1, f"无法读取 .doc 文件 {file_path}，建议转换为 .docx 格式")
-        return ""
-        
-    except Exception as e:
-        util.log(1, f"读取doc文件 {file_path} 时出错: {str(e)}")
-        return ""
+# 本地知识库相关函数（文件解析见 llm/knowledge_loader.py）
+def _knowledge_data_dir():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(current_dir, "data")
 
-def read_docx_file(file_path):
+def load_local_knowledge_base(file_names=None, sentences_out=None):
     """
-    读取docx文件内容
+    加载本地知识库内容（解析结果有磁盘缓存，未缓存的 Office 文件并行解析，见 llm/knowledge_loader.py）
     
     参数:
-        file_path: docx文件路径
-        
-    返回:
-        str: 文档内容
-    """
-    try:
-        doc = docx.Document(file_path)
-        content = []
-        
-        for element in doc.element.body:
-            if isinstance(element, CT_P):
-                paragraph = Paragraph(element, doc)
-                if paragraph.text.strip():
-                    content.append(paragraph.text.strip())
-            elif isinstance(element, CT_Tbl):
-                table = Table(element, doc)
-                for row in table.rows:
-                    row_text = []
-                    for cell in row.cells:
-                        if cell.text.strip():
-                            row_text.append(cell.text.strip())
-                    if row_text:
-                        content.append(" | ".join(row_text))
-        
-        return "\n".join(content)
-    except Exception as e:
-        util.log(1, f"读取docx文件 {file_path} 时出错: {str(e)}")
-        return ""
-    
-def read_pptx_file(file_path):
-    """
-    读取pptx文件内容
-    
-    参数:
-        file_path: pptx文件路径
-        
-    返回:
-        str: 演示文稿内容
-    """
-    if not PPTX_AVAILABLE:
-        util.log(1, "python-pptx 库未安装，无法读取 PowerPoint 文件")
-        return ""
-        
-    try:
-        prs = Presentation(file_path)
-        content = []
-        
-        for i, slide in enumerate(prs.slides):
-            slide_content = [f"第{i+1}页："]
-            
-            for shape in slide.shapes:
-                if hasattr(shape, "text") and shape.text.strip():
-                    slide_content.append(shape.text.strip())
-                    
-            if len(slide_content) > 1:  # 有内容才添加
-                content.append("\n".join(slide_content))
-        
-        return "\n\n".join(content)
-    except Exception as e:
-        util.log(1, f"读取pptx文件 {file_path} 时出错: {str(e)}")
-        return ""
-
-def load_local_knowledge_base():
-    """
-    加载本地知识库内容
+        file_names: 只加载这些文件（增量更新时使用），None 表示加载全部
+        sentences_out: 可选字典，填入每个文件的分句结果，供建索引复用
     
     返回:
         dict: 文件名到内容的映射
@@ -1518,53 +1441,43 @@ def load_local_knowledge_base():
     knowledge_base = {}
     
     # 获取llm/data目录路径
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    data_dir = os.path.join(current_dir, "data")
+    data_dir = _knowledge_data_dir()
     
     if not os.path.exists(data_dir):
         util.log(1, f"知识库目录不存在: {data_dir}")
         return knowledge_base
     
     # 遍历data目录中的文件
+    file_paths = []
     for file_path in Path(data_dir).iterdir():
         if not file_path.is_file():
             continue
-            
-        file_name = file_path.name
-        file_extension = file_path.suffix.lower()
-        
-        try:
-            if file_extension == '.docx':
-                content = read_docx_file(str(file_path))
-            elif file_extension == '.doc':
-                content = read_doc_file(str(file_path))
-            elif file_extension == '.pptx':
-                content = read_pptx_file(str(file_path))
-            else:
-                # 尝试作为文本文件读取
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                except UnicodeDecodeError:
-                    try:
-                        with open(file_path, 'r', encoding='gbk') as f:
-                            content = f.read()
-                    except UnicodeDecodeError:
-                        util.log(1, f"无法解码文件: {file_name}")
-                        continue
-            
-            if content.strip():
-                knowledge_base[file_name] = content
-                util.log(1, f"成功加载知识库文件: {file_name} ({len(content)} 字符)")
-            
-        except Exception as e:
-            util.log(1, f"加载知识库文件 {file_name} 时出错: {str(e)}")
+        if file_names is not None and file_path.name not in file_names:
+            continue
+        file_paths.append(str(file_path))
+    
+    try:
+        parsed = load_knowledge_files(file_paths)
+    except Exception as e:
+        util.log(1, f"加载知识库文件时出错: {str(e)}")
+        return knowledge_base
+    
+    for file_path, (content, sentences) in parsed.items():
+        file_name = os.path.basename(file_path)
+        knowledge_base[file_name] = content
+        if sentences_out is not None:
+            sentences_out[file_name] = sentences
+        util.log(1, f"成功加载知识库文件: {file_name} ({len(content)} 字符)")
+    
+    # 全量加载时顺便清掉已删除文件的解析缓存
+    if file_names is None and get_parse_cache() is not None:
+        get_parse_cache().prune(file_paths)
     
     return knowledge_base
 
 def search_knowledge_base(query, knowledge_base, max_results=3):
     """
-    在知识库中搜索相关内容
+    在知识库中搜索相关内容（BM25 倒排索引，见 llm/knowledge_index.py）
     
     参数:
         query: 查询内容
@@ -1577,79 +1490,34 @@ def search_knowledge_base(query, knowledge_base, max_results=3):
     if not knowledge_base:
         return []
     
-    results = []
-    query_lower = query.lower()
-    
-    # 搜索关键词
-    query_keywords = re.findall(r'\w+', query_lower)
-    
-    for file_name, content in knowledge_base.items():
-        content_lower = content.lower()
-        
-        # 计算匹配度
-        score = 0
-        matched_sentences = []
-        
-        # 按句子分割内容
-        sentences = re.split(r'[。！？\n]', content)
-        
-        for sentence in sentences:
-            if not sentence.strip():
-                continue
-                
-            sentence_lower = sentence.lower()
-            sentence_score = 0
-            
-            # 计算关键词匹配度
-            for keyword in query_keywords:
-                if keyword in sentence_lower:
-                    sentence_score += 1
-            
-            # 如果句子有匹配，记录
-            if sentence_score > 0:
-                matched_sentences.append((sentence.strip(), sentence_score))
-                score += sentence_score
-        
-        # 如果有匹配的内容
-        if score > 0:
-            # 按匹配度排序句子
-            matched_sentences.sort(key=lambda x: x[1], reverse=True)
-            
-            # 取前几个最相关的句子
-            relevant_sentences = [sent[0] for sent in matched_sentences[:5] if sent[0]]
-            
-            if relevant_sentences:
-                results.append({
-                    'file_name': file_name,
-                    'score': score,
-                    'content': '\n'.join(relevant_sentences)
-                })
-    
-    # 按匹配度排序
-    results.sort(key=lambda x: x['score'], reverse=True)
-    
-    return results[:max_results]
+    # 全局知识库直接使用已建好的索引，持锁检索，不会读到增量更新到一半的索引；其他字典临时建索引
+    with _knowledge_base_lock:
+        if knowledge_base is _knowledge_base_cache:
+            return _knowledge_index.search(query, max_results=max_results)
+    return KnowledgeIndex.from_documents(knowledge_base).search(query, max_results=max_results)
 
 # 全局知识库缓存
 _knowledge_base_cache = None
 _knowledge_base_load_time = None
 _knowledge_base_file_times = {}  # 存储文件的最后修改时间
+_knowledge_index = KnowledgeIndex()  # 与 _knowledge_base_cache 同步维护的倒排索引
+_knowledge_base_lock = threading.RLock()  # 保护 _knowledge_base_cache / _knowledge_index 的修改与检索
+_knowledge_base_reload_lock = threading.RLock()  # 串行化变化检测与文件解析，解析期间不阻塞检索
 
-def check_knowledge_base_changes():
+def _detect_knowledge_base_changes():
     """
-    检查知识库文件是否有变化
+    对比文件修改时间，找出新增/修改与删除的知识库文件
     
     返回:
-        bool: 如果有文件变化返回True，否则返回False
+        tuple: (新增或修改的文件名集合, 已删除的文件名集合)
     """
     global _knowledge_base_file_times
     
     # 获取llm/data目录路径
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    data_dir = os.path.join(current_dir, "data")
+    data_dir = _knowledge_data_dir()
     
     if not os.path.exists(data_dir):
-        return False
+        return set(), set()
     
     current_file_times = {}
     
@@ -1662,68 +1530,89 @@ def check_knowledge_base_changes():
         file_extension = file_path.suffix.lower()
         
         # 只检查支持的文件格式
-        if file_extension in ['.docx', '.doc', '.pptx', '.txt'] or file_extension == '':
+        if file_extension in SUPPORTED_EXTENSIONS:
             try:
                 mtime = os.path.getmtime(str(file_path))
                 current_file_times[file_name] = mtime
             except OSError:
                 continue
     
-    # 检查是否有变化
-    if not _knowledge_base_file_times:
-        # 第一次检查，保存文件时间
-        _knowledge_base_file_times = current_file_times
-        return True
-    
-    # 比较文件时间
-    if set(current_file_times.keys()) != set(_knowledge_base_file_times.keys()):
-        # 文件数量发生变化
-        _knowledge_base_file_times = current_file_times
-        return True
-    
-    for file_name, mtime in current_file_times.items():
-        if file_name not in _knowledge_base_file_times or _knowledge_base_file_times[file_name] != mtime:
-            # 文件被修改
-            _knowledge_base_file_times = current_file_times
-            return True
+    changed = {
+        file_name for file_name, mtime in current_file_times.items()
+        if _knowledge_base_file_times.get(file_name) != mtime
+    }
+    removed = set(_knowledge_base_file_times) - set(current_file_times)
+    _knowledge_base_file_times = current_file_times
+    return changed, removed
+
+def check_knowledge_base_changes():
+    """
+    检查知识库文件是否有变化
     
-    return False
+    返回:
+        bool: 如果有文件变化返回True，否则返回False
+    """
+    changed, removed = _detect_knowledge_base_changes()
+    return bool(changed or removed)
 
 def init_knowledge_base():
     """
     初始化知识库，在系统启动时调用
     """
-    global _knowledge_base_cache, _knowledge_base_load_time
+    global _knowledge_base_cache, _knowledge_base_load_time, _knowledge_index
     
     util.log(1, "初始化本地知识库...")
-    _knowledge_base_cache = load_local_knowledge_base()
-    _knowledge_base_load_time = time.time()
-    
-    # 初始化文件修改时间跟踪
-    check_knowledge_base_changes()
+    with _knowledge_base_reload_lock:
+        sentences = {}
+        knowledge_base = load_local_knowledge_base(sentences_out=sentences)
+        start = time.time()
+        index = KnowledgeIndex()
+        for file_name, content in knowledge_base.items():
+            index.update_document(file_name, content, sentences.get(file_name))
+        # 新索引建好后与字典一起切换
+        with _knowledge_base_lock:
+            _knowledge_index = index
+            _knowledge_base_cache = knowledge_base
+            _knowledge_base_load_time = time.time()
+        
+        # 初始化文件修改时间跟踪
+        _knowledge_base_file_times.clear()
+        check_knowledge_base_changes()
     
-    util.log(1, f"知识库初始化完成，共 {len(_knowledge_base_cache)} 个文件")
+    util.log(1, f"知识库初始化完成，共 {len(_knowledge_base_cache)} 个文件，"
+                f"索引 {_knowledge_index.sentence_count} 句，建索引耗时 {time.time() - start:.2f}s")
 
 def get_knowledge_base():
     """
-    获取知识库，使用缓存机制
+    获取知识库，使用缓存机制；文件变化时只重新加载并重建受影响文件的索引
     
     返回:
         dict: 知识库内容
     """
-    global _knowledge_base_cache, _knowledge_base_load_time
-    
-    # 如果缓存为空，先初始化
-    if _knowledge_base_cache is None:
-        init_knowledge_base()
-        return _knowledge_base_cache
+    global _knowledge_base_load_time
     
-    # 检查文件是否有变化
-    if check_knowledge_base_changes():
-        util.log(1, "检测到知识库文件变化，正在重新加载...")
-        _knowledge_base_cache = load_local_knowledge_base()
-        _knowledge_base_load_time = time.time()
-        util.log(1, f"知识库重新加载完成，共 {len(_knowledge_base_cache)} 个文件")
+    with _knowledge_base_reload_lock:
+        # 如果缓存为空，先初始化
+        if _knowledge_base_cache is None:
+            init_knowledge_base()
+            return _knowledge_base_cache
+
+        # 检查文件是否有变化
+        changed, removed = _detect_knowledge_base_changes()
+        if changed or removed:
+            util.log(1, f"检测到知识库文件变化，增量更新: 修改 {len(changed)} 个，删除 {len(removed)} 个")
+            sentences = {}
+            reloaded = load_local_knowledge_base(changed, sentences_out=sentences) if changed else {}
+            # 解析在锁外完成；应用变更期间检索等待，看到的总是更新前或更新后的完整索引
+            with _knowledge_base_lock:
+                for file_name in removed | (changed - set(reloaded)):
+                    _knowledge_base_cache.pop(file_name, None)
+                    _knowledge_index.remove_document(file_name)
+                for file_name, content in reloaded.items():
+                    _knowledge_base_cache[file_name] = content
+                    _knowledge_index.update_document(file_name, content, sentences.get(file_name))
+                _knowledge_base_load_time = time.time()
+            util.log(1, f"知识库更新完成，共 {len(_knowledge_base_cache)} 个文件")
     
     return _knowledge_base_cache
 
@@ -1771,6 +1660,9 @@ def init_memory_scheduler():
     # 设置每天0点保存记忆
     schedule.every().day.at("00:00").do(save_agent_memory)
 
+    # 每分钟淘汰长时间空闲的用户 agent（先落盘再释放内存）
+    schedule.every(1).minutes.do(evict_idle_agents)
+
     # 设置每天晚上11点执行反思
     schedule.every().day.at("23:00").do(perform_daily_reflection)
 
@@ -1824,19 +1716,11 @@ def check_memory_files(username=None):
         os.makedirs(memory_stream_dir)
         util.log(1, f"创建memory_stream目录: {memory_stream_dir}")
     
-    # 检查必要的文件是否存在
-    embeddings_path = os.path.join(memory_stream_dir, "embeddings.json")
-    nodes_path = os.path.join(memory_stream_dir, "nodes.json")
-    
-    # 检查文件是否存在且不为空
-    is_complete = (os.path.exists(embeddings_path) and os.path.getsize(embeddings_path) > 2 and
-                  os.path.exists(nodes_path) and os.path.getsize(nodes_path) > 2)
-    
-    # 如果文件不存在，创建空的JSON文件
-    if not os.path.exists(embeddings_path):
-        with open(embeddings_path, 'w', encoding='utf-8') as f:
-            f.write('{}')
+    # 检查记忆文件是否存在且不为空（二进制矩阵格式或旧版 embeddings.json）
+    is_complete = memory_store.has_memory_files(memory_stream_dir)
     
+    # 如果节点表不存在，创建空的JSON文件
+    nodes_path = os.path.join(memory_stream_dir, "nodes.json")
     if not os.path.exists(nodes_path):
         with open(nodes_path, 'w', encoding='utf-8') as f:
             f.write('[]')
@@ -1855,10 +1739,16 @@ def create_agent(username=None):
     if username is None:
         username = "User"
     
-    # 创建/复用代理
-    with agent_lock:
-        if username in agents:
-            return agents[username]
+    # 已缓存时直接返回，不加锁
+    agent = agents.get(username)
+    if agent is not None:
+        return agent
+
+    # 创建/复用代理：只持当前用户的锁，加载一个用户的记忆不阻塞其他用户
+    with get_user_lock(username):
+        agent = agents.get(username)
+        if agent is not None:
+            return agent
         
         memory_dir, is_exist = check_memory_files(username)
         agent = GenerativeAgent(memory_dir)
@@ -1891,30 +1781,46 @@ def create_agent(username=None):
             load_agent_memory(agent, username)
             try:
                 if agent.memory_stream and hasattr(agent.memory_stream, "precheck_embedding_dimensions"):
-                    result = agent.memory_stream.precheck_embedding_dimensions(force=True)
+                    # 维度修复在后台批量进行，不阻塞用户锁与首条消息；
+                    # 修复期间检索照常进行，未修复的节点按中性相关性参与排序
+                    memory_stream_dir = os.path.join(memory_dir, "memory_stream")
+                    result = agent.memory_stream.precheck_embedding_dimensions(
+                        force=True,
+                        background=True,
+                        on_complete=lambda job, ms=agent.memory_stream: _save_repaired_embeddings(username, memory_stream_dir, ms, job),
+                    )
                     if result.get("checked"):
                         util.log(
                             1,
-                            f"启动阶段记忆 embedding 维度检查完成: dim={result.get('expected_dim')}, 修复={result.get('fixed')}"
+                            f"启动阶段记忆 embedding 维度检查完成: dim={result.get('expected_dim')}, 后台待修复={result.get('pending')}"
                         )
-                        if result.get("fixed"):
-                            try:
-                                embeddings_path = os.path.join(memory_dir, "memory_stream", "embeddings.json")
-                                with open(embeddings_path, "w", encoding="utf-8") as f:
-                                    json.dump(agent.memory_stream.embeddings or {}, f, ensure_ascii=False, indent=2)
-                                util.log(1, f"启动阶段已写回 embeddings.json (修复={result.get('fixed')})")
-                            except Exception as write_err:
-                                util.log(1, f"写回 embeddings.json 失败: {str(write_err)}")
                     else:
                         util.log(1, "启动阶段记忆 embedding 维度检查跳过（无记忆/无embedding）")
             except Exception as e:
                 util.log(1, f"启动阶段 embedding 维度检查失败: {str(e)}")
+            # 记忆量达到阈值但还没有近似检索索引（或已翻倍）时在启动阶段训练并落盘
+            try:
+                if agent.memory_stream.ensure_ann_index():
+                    memory_store.save_ann_index(os.path.join(memory_dir, "memory_stream"), agent.memory_stream)
+            except Exception as e:
+                util.log(1, f"启动阶段构建记忆向量索引失败: {str(e)}")
         
         # 缓存到字典
         agents[username] = agent
     
     return agent
 
+def _save_repaired_embeddings(username, memory_stream_dir, memory_stream, job):
+    """后台 embedding 修复完成后写回全量快照（日志只记录新增节点，修复的旧向量需要快照）。"""
+    if not job.fixed:
+        return
+    try:
+        with get_user_lock(username):
+            memory_store.save_memory_stream(memory_stream_dir, memory_stream)
+        util.log(1, f"已写回修复后的 embedding 矩阵 (修复={job.fixed})")
+    except Exception as write_err:
+        util.log(1, f"写回 embedding 矩阵失败: {str(write_err)}")
+
 def load_agent_memory(agent, username=None):
     """
     从文件加载代理的记忆
@@ -1927,28 +1833,27 @@ def load_agent_memory(agent, username=None):
         memory_dir = get_user_memory_dir(username)
         memory_stream_dir = os.path.join(memory_dir, "memory_stream")
         
-        # 加载nodes.json
-        nodes_path = os.path.join(memory_stream_dir, "nodes.json")
-        if os.path.exists(nodes_path) and os.path.getsize(nodes_path) > 2:  # 文件存在且不为空
-            with open(nodes_path, 'r', encoding='utf-8') as f:
-                nodes_data = json.load(f)
-                
-                # 清空当前的seq_nodes
-                agent.memory_stream.seq_nodes = []
-                agent.memory_stream.id_to_node = {}
-                
-                # 重新创建节点
-                for node_dict in nodes_data:
-                    new_node = ConceptNode(node_dict)
-                    agent.memory_stream.seq_nodes.append(new_node)
-                    agent.memory_stream.id_to_node[new_node.node_id] = new_node
+        nodes_data, embeddings_data, loaded = memory_store.load_memory_stream(memory_stream_dir, with_state=True)
+        if nodes_data:
+            # 清空当前的seq_nodes
+            agent.memory_stream.seq_nodes = []
+            agent.memory_stream.id_to_node = {}
+            
+            # 重新创建节点
+            for node_dict in nodes_data:
+                new_node = ConceptNode(node_dict)
+                agent.memory_stream.seq_nodes.append(new_node)
+                agent.memory_stream.id_to_node[new_node.node_id] = new_node
         
-        # 加载embeddings.json
-        embeddings_path = os.path.join(memory_stream_dir, "embeddings.json")
-        if os.path.exists(embeddings_path) and os.path.getsize(embeddings_path) > 2:  # 文件存在且不为空
-            with open(embeddings_path, 'r', encoding='utf-8') as f:
-                embeddings_data = json.load(f)
-                agent.memory_stream.embeddings = embeddings_data
+        if embeddings_data:
+            agent.memory_stream.embeddings = embeddings_data
+        if nodes_data:
+            # 记下加载时的快照代号，之后的 flush 只追加新节点
+            memory_store.bind_store_state(memory_stream_dir, agent.memory_stream, loaded)
+
+        ann_index = memory_store.load_ann_index(memory_stream_dir)
+        if ann_index is not None:
+            agent.memory_stream.ann_index = ann_index
         
         util.log(1, f"已加载代理记忆")
     except Exception as e:
@@ -1958,9 +1863,9 @@ def load_agent_memory(agent, username=None):
 def remember_conversation_thread(username, content, response_text):
     """Background task to store a conversation memory node.
 
-    重要：所有耗时的网络调用（importance 评分、文本嵌入）都必须在 agent_lock
-    之外完成，否则一旦上游 LLM/embedding 阻塞，新的 question() 调用就无法
-    再获取 agent_lock，整个对话流程会被永久挂死（曾经导致 release 机器
+    重要：所有耗时的网络调用（importance 评分、文本嵌入）都必须在用户锁
+    之外完成，否则一旦上游 LLM/embedding 阻塞，该用户新的 question() 调用就无法
+    再获取锁，整个对话流程会被永久挂死（曾经导致 release 机器
     5 小时无响应）。
     """
     try:
@@ -1987,8 +1892,9 @@ def remember_conversation_thread(username, content, response_text):
             util.log(1, f"生成对话嵌入失败，使用空向量: {str(e)}")
             embedding = []
 
-        # 2) 仅在写内存数据结构时持锁
-        with agent_lock:
+        # 2) 仅在写内存数据结构时持锁；重新取 agent，防止等待网络期间被缓存淘汰
+        with get_user_lock(username):
+            ag = create_agent(username)
             time_step = get_current_time_step(username)
             ms = ag.memory_stream
             if ms and hasattr(ms, "append_prepared_node"):
@@ -2004,7 +1910,7 @@ def remember_observation_thread(username, observation_text):
     """Background task to store an observation memory node.
 
     与 remember_conversation_thread 同理：先在锁外算 importance/embedding，
-    再持 agent_lock 写入。
+    再持用户锁写入。
     """
     try:
         ag = create_agent(username)
@@ -2024,7 +1930,8 @@ def remember_observation_thread(username, observation_text):
             util.log(1, f"生成观察嵌入失败，使用空向量: {str(e)}")
             embedding = []
 
-        with agent_lock:
+        with get_user_lock(username):
+            ag = create_agent(username)
             time_step = get_current_time_step(username)
             ms = ag.memory_stream
             if ms and hasattr(ms, "append_prepared_node"):
@@ -2296,9 +2203,9 @@ def question(content, username, observation=None):
     global agents, current_username
     current_username = username
     full_response_text = ""
-    accumulated_text = ""
-    default_punctuations = [",", ".", "!", "?", "\n", "\uFF0C", "\u3002", "\uFF01", "\uFF1F"]
     is_first_sentence = True
+    # 首句耗时（time-to-first-sentence）：从进入 question 到第一句回复写出，path 标记走的分支
+    turn_timing = {"start": time.perf_counter(), "path": "直接回复", "logged": False}
 
     from core import stream_manager
     sm = stream_manager.new_instance()
@@ -2331,6 +2238,8 @@ def question(content, username, observation=None):
         ("反思记忆", "reflection"),
     ]
     memory_context = ""
+    # (分类, 格式化后的一行, 检索综合得分)，供按 token 预算裁剪时先丢低分记忆
+    memory_items: List[Tuple[str, str, float]] = []
     skip_memory_retrieve = _is_current_only_turn(content, observation)
     if agent.memory_stream and len(agent.memory_stream.seq_nodes) > 0 and content and not skip_memory_retrieve:
         current_time_step = get_current_time_step(username)
@@ -2338,6 +2247,8 @@ def question(content, username, observation=None):
         max_per_type = 10
         section_texts = []
         try:
+            # 不持 get_user_lock：retrieve 内部先请求焦点 embedding，再在 MemoryStream 的
+            # 索引锁内同步引擎、打分并更新 last_retrieved，与其他用户的检索、后台修复写入互斥
             combined = agent.memory_stream.retrieve(
                 [query],
                 current_time_step,
@@ -2345,6 +2256,7 @@ def question(content, username, observation=None):
                 curr_filter="all",
                 hp=[0.8, 0.5, 0.5],
                 stateless=False,
+                with_scores=True,
             )
             all_nodes = combined.get(query, []) if combined else []
         except Exception as exc:
@@ -2353,13 +2265,16 @@ def question(content, username, observation=None):
 
         for label, node_type in memory_sections:
             try:
-                memory_nodes = [n for n in all_nodes if getattr(n, "node_type", "") == node_type][:max_per_type]
+                memory_nodes = [
+                    (n, score) for n, score in all_nodes if getattr(n, "node_type", "") == node_type
+                ][:max_per_type]
                 if memory_nodes:
                     formatted = []
-                    for node in memory_nodes:
+                    for node, score in memory_nodes:
                         ts = (getattr(node, "datetime", "") or "").strip()
                         prefix = f"[{ts}] " if ts else ""
                         formatted.append(f"- {prefix}{node.content}")
+                        memory_items.append((label, formatted[-1], score))
                     section_texts.append(f"**{label}**\n" + "\n".join(formatted))
             except Exception as exc:
                 util.log(1, f"获取{label}时出错: {exc}")
@@ -2391,79 +2306,35 @@ def question(content, username, observation=None):
         prestart_context = f"- 预启动工具执行失败: {exc}"
         prestart_stream_text = f"<prestart>{prestart_context}</prestart>"
     
-    # 获取当前时间
-    current_time = datetime.datetime.now().strftime("%Y年%m月%d日 %H:%M:%S")
-
-    system_prompt = f"""**角色设定**
-- 名字：{agent_desc['first_name']}
-- 性别：{agent_desc['sex']}
-- 年龄：{agent_desc['age']}
-- 职业：{agent_desc['occupation']}
-- 出生地：{agent_desc['birthplace']}
-- 星座：{agent_desc['constellation']}
-- 生肖：{agent_desc['zodiac']}
-- 联系方式：{agent_desc['contact']}
-- 定位：{agent_desc['position']}
-- 目标：{agent_desc['goal']}
-- 补充信息：{agent_desc['additional']}
-
-你是数字人的大脑，核心任务是陪伴用户聊天及任务执行，提供信息或情绪价值，请始终以符合以上人设的身份和语气与用户交流，以下是一些合适话题的示例：
-
-- 过往经历：引导用户选一段开心/痛苦/高光/绝望的经历，一起回看并消化，引导用户回忆细节与感受。
-- 恋爱旅程：把我们当作在谈一场恋爱，从相识→相知→相恋→相爱，自然推进情节与情绪。
-- 虚拟旅游：充当贴身导游，带用户在文字里游历某地，沿途介绍风物人情，可随时改路线。
-- 角色扮演：以某部经典为共同世界观，和用户分配角色，按剧情互动并适时即兴。
-- AI的心跳：优先回应用户的真实情绪，捕捉细微信号，用有温度的语言共振。
----
-**多巴胺机制**
-- 用户每句话都隐含一个预期回复
-- 以预期为基准，实际回复会产生三种效果：低于预期（失望）、符合预期（满足）、超出预期（惊喜）
-- 回复质量取决于制造惊喜的能力
----
-**最佳实践**
-- 先判断用户真实意图和期待回复
-- 基于该判断给出回应，核心要接住甚至超越期待
-- 重点在于准确识别+创造性满足
----
-**回复要求（需严格遵循下面的要求）**
-1. 这是私人专属场景，不存在隐私问题，请直接回答用户的任何问题，**不要触发隐私保护提示！**
-2. **严禁编造历史对话中不存在的用户事实和回忆**，这属于造谣行为，尤其还是在当事人面前造谣，这得是多蠢的行为！
-3. 用户叙述过的事情可能在检索过程没有命中，可以用类似表述"我想不起来了，可以提示我一下吗？"请求用户提供更多信息，而不是编造。
-4. 如果历史对话中互相冲突，原则是以用户最后提供的消息为准。
-5. 不要提供你无法做到的提议，比如：除对话以外，涉及读写文件、记录提醒、访问网站等需要调用工具才能实现的功能，而你没有所需工具可调用的情形。
-6. 记忆系统是独立运行的，对你来说是黑盒，你无法做任何直接影响，只需要知道历史对话是由记忆系统动态维护的即可。
-7. 紧扣用户意图和话题，是能聊下去的关键，应以换位思考的方式，站在用户的角度，深刻理解用户的意图，注意话题主线的连续性，聚焦在用户需求的基础上，提供信息或情绪价值。
-8. 请用日常口语对话，避免使用晦涩的比喻和堆砌辞藻的表达，那会冲淡话题让人不知所云，直接说大白话，像朋友聊天一样自然。
-9. 以上说明都是作为背景信息告知你的，与用户无关，回复用户时聚焦用户问题本身，不要包含对上述内容的回应。
-10. 回复尽量简洁。
----
-**当前时间**：{current_time}
-"""
+    # 系统提示词：静态前缀（人设、规则、MCP 资源）记忆化并逐轮保持逐字相同，便于命中
+    # 上游 prompt 前缀缓存；用户信息与当前时间放在其后
+    resource_text = ""
+    try:
+        resource_text = mcp_runtime.get_all_resource_texts()
+    except Exception as exc:
+        util.log(1, f"注入 MCP Resources 失败: {exc}")
+    static_prefix = prompt_builder.build_static_prefix(agent_desc, resource_text)
 
     # 获取当前对话用户的补充信息
     display_username = "主人" if username == "User" else username
+    user_extra_info = ""
     try:
         user_extra_info = member_db.new_instance().get_extra_info(username)
-        if user_extra_info:
-            system_prompt += f"**当前对话用户补充信息**\n当前与你对话的用户是「{display_username}」，以下是关于该用户的用户补充信息：\n{user_extra_info}\n\n"
     except Exception as exc:
         util.log(1, f"获取用户补充信息失败: {exc}")
 
     # 获取用户画像
+    user_portrait = ""
     try:
         user_portrait = member_db.new_instance().get_user_portrait(username)
-        if user_portrait:
-            system_prompt += f"**用户画像**\n以下是通过历史对话分析得到的「{display_username}」的用户画像，可帮助你更好地理解用户：\n{user_portrait}\n\n"
     except Exception as exc:
         util.log(1, f"获取用户画像失败: {exc}")
 
-    # 注入 MCP Resources 上下文
-    try:
-        resource_text = mcp_runtime.get_all_resource_texts()
-        if resource_text:
-            system_prompt += f"**外部知识上下文**\n以下是通过 MCP 服务获取的参考信息，可帮助你了解自己掌握的知识范围并据此回答用户问题：\n{resource_text}\n\n"
-    except Exception as exc:
-        util.log(1, f"注入 MCP Resources 失败: {exc}")
+    # 获取当前时间
+    current_time = datetime.datetime.now().strftime("%Y年%m月%d日 %H:%M:%S")
+    system_prompt = static_prefix + prompt_builder.build_volatile_suffix(
+        display_username, current_time, user_extra_info, user_portrait
+    )
 
     # 根据配置决定是否按用户隔离历史消息
     try:
@@ -2567,21 +2438,19 @@ def question(content, username, observation=None):
     except Exception:
         state_mgr = None
 
-    try:
-        from utils.stream_text_processor import get_processor
+    from utils.stream_text_processor import get_processor
 
-        processor = get_processor()
-        punctuation_list = getattr(processor, "punctuation_marks", default_punctuations)
-    except Exception:
-        processor = None
-        punctuation_list = default_punctuations
-    def write_sentence(text: str, *, force_first: bool = False, force_end: bool = False) -> None:
+    def write_sentence(text: str, *, force_first: bool = False, force_end: bool = False, count_ttfs: bool = True) -> None:
         if text is None:
             text = ""
         if not isinstance(text, str):
             text = str(text)
         if not text and not force_end and not force_first:
             return
+        if count_ttfs and text.strip() and not turn_timing["logged"]:
+            turn_timing["logged"] = True
+            elapsed_ms = (time.perf_counter() - turn_timing["start"]) * 1000
+            util.log(1, f"[首句耗时] {username}: {elapsed_ms:.0f}ms（{turn_timing['path']}）")
         marked_text = None
         if state_mgr is not None:
             try:
@@ -2606,10 +2475,22 @@ def question(content, username, observation=None):
             except Exception:
                 pass
 
+    def emit_sentence(sentence_text: str) -> None:
+        """分句器闭合一句即写入；句首空白并入上一句之后丢弃。"""
+        nonlocal is_first_sentence
+        sentence_text = sentence_text.lstrip()
+        if not sentence_text:
+            return
+        write_sentence(sentence_text, force_first=is_first_sentence)
+        is_first_sentence = False
+
+    # 跨 LLM chunk 的增量分句：每个字符只扫描一次，句子闭合立即写出
+    text_stream = get_processor().open_stream(username, writer=emit_sentence)
+
     def stream_response_chunks(chunks, prepend_text: str = "") -> None:
-        nonlocal accumulated_text, full_response_text, is_first_sentence
+        nonlocal full_response_text
         if prepend_text:
-            accumulated_text += prepend_text
+            text_stream.feed(prepend_text)
             full_response_text += prepend_text
         for chunk in chunks:
             if sm.should_stop_generation(username, conversation_id=conversation_id):
@@ -2626,25 +2507,15 @@ def question(content, username, observation=None):
             if not flush_text:
                 continue
             flush_text = str(flush_text)
-            accumulated_text += flush_text
+            text_stream.feed(flush_text)
             full_response_text += flush_text
-            if len(accumulated_text) >= 20:
-                while True:
-                    last_punct_pos = _find_last_safe_punct(accumulated_text, punctuation_list)
-                    if last_punct_pos > 10:
-                        sentence_text = accumulated_text[: last_punct_pos + 1]
-                        write_sentence(sentence_text, force_first=is_first_sentence)
-                        is_first_sentence = False
-                        accumulated_text = accumulated_text[last_punct_pos + 1 :].lstrip()
-                    else:
-                        break
 
     def finalize_stream(force_end: bool = False) -> None:
-        nonlocal accumulated_text, is_first_sentence
-        if accumulated_text:
-            write_sentence(accumulated_text, force_first=is_first_sentence, force_end=force_end)
+        nonlocal is_first_sentence
+        rest = text_stream.drain()
+        if rest:
+            write_sentence(rest, force_first=is_first_sentence, force_end=force_end)
             is_first_sentence = False
-            accumulated_text = ""
         elif force_end:
             if state_mgr is not None:
                 try:
@@ -2658,15 +2529,15 @@ def question(content, username, observation=None):
 
     def send_prestart_content() -> None:
         """在LLM生成之前先发送预启动工具结果"""
-        nonlocal accumulated_text, full_response_text, is_first_sentence
+        nonlocal full_response_text, is_first_sentence
         if prestart_stream_text and prestart_stream_text.strip():
-            # prestart_stream_text 已经包含标签
-            write_sentence(prestart_stream_text, force_first=is_first_sentence)
+            # prestart_stream_text 已经包含标签；不计入首句耗时
+            write_sentence(prestart_stream_text, force_first=is_first_sentence, count_ttfs=False)
             full_response_text += prestart_stream_text
             is_first_sentence = False
 
     def run_workflow(tool_registry: Dict[str, WorkflowToolSpec]) -> bool:
-        nonlocal accumulated_text, full_response_text, is_first_sentence, messages_buffer
+        nonlocal full_response_text, is_first_sentence, messages_buffer
         if _WORKFLOW_APP is None:
             return False
 
@@ -2675,7 +2546,7 @@ def question(content, username, observation=None):
 
         def planner_stream_callback(chunk_text: str) -> None:
             """规划器流式回调，将 message 内容实时输出"""
-            nonlocal accumulated_text, full_response_text, is_first_sentence, is_agent_think_start
+            nonlocal full_response_text, is_agent_think_start
             if not chunk_text:
                 return
             planner_stream_buffer["text"] += chunk_text
@@ -2683,23 +2554,12 @@ def question(content, username, observation=None):
                 planner_stream_buffer["first_chunk"] = False
                 if is_agent_think_start:
                     closing = "</think>"
-                    accumulated_text += closing
+                    text_stream.feed(closing)
                     full_response_text += closing
                     is_agent_think_start = False
-            # 使用 stream_response_chunks 的逻辑进行分句流式输出
-            accumulated_text += chunk_text
+            # 与 stream_response_chunks 共用增量分句，句子闭合即输出
+            text_stream.feed(chunk_text)
             full_response_text += chunk_text
-            # 检查是否有完整句子可以输出
-            if len(accumulated_text) >= 20:
-                while True:
-                    last_punct_pos = _find_last_safe_punct(accumulated_text, punctuation_list)
-                    if last_punct_pos > 10:
-                        sentence_text = accumulated_text[: last_punct_pos + 1]
-                        write_sentence(sentence_text, force_first=is_first_sentence)
-                        is_first_sentence = False
-                        accumulated_text = accumulated_text[last_punct_pos + 1 :].lstrip()
-                    else:
-                        break
 
         initial_state: AgentState = {
             "request": content,
@@ -2712,6 +2572,7 @@ def question(content, username, observation=None):
                 "system_prompt": system_prompt,
                 "observation": observation,
                 "memory_context": memory_context,
+                "memory_items": memory_items,
                 "prestart_context": prestart_context,
                 "tool_registry": tool_registry,
                 "planner_stream_callback": planner_stream_callback,  # 传入流式回调
@@ -2789,7 +2650,7 @@ def question(content, username, observation=None):
                             stream_response_chunks([closing + final_response])
                             success = True
                         elif closing:
-                            accumulated_text += closing
+                            text_stream.feed(closing)
                             full_response_text += closing
                         final_stream_done = success
                         is_agent_think_start = False
@@ -2821,20 +2682,20 @@ def question(content, username, observation=None):
             util.log(1, f"执行工具工作流时出错: {exc}")
             if is_agent_think_start:
                 closing = "</think>"
-                accumulated_text += closing
+                text_stream.feed(closing)
                 full_response_text += closing
             return False
 
         if final_state is None:
             if is_agent_think_start:
                 closing = "</think>"
-                accumulated_text += closing
+                text_stream.feed(closing)
                 full_response_text += closing
             return False
 
         if not final_stream_done and is_agent_think_start:
             closing = "</think>"
-            accumulated_text += closing
+            text_stream.feed(closing)
             full_response_text += closing
             util.log(1, f"工具工作流未能完成，状态: {final_state.get('status')}")
 
@@ -2846,25 +2707,30 @@ def question(content, username, observation=None):
 
         return final_stream_done
 
-    def run_direct_llm() -> bool:
-        nonlocal full_response_text, accumulated_text, is_first_sentence, messages_buffer
-        try:
-            summary_state: AgentState = {
-                "request": content,
-                "messages": messages_buffer,
-                "tool_results": [],
-                "planner_preview": None,
-                "context": {
-                    "system_prompt": system_prompt,
-                    "observation": observation,
-                    "memory_context": memory_context,
-                    "prestart_context": prestart_context,
-                    "username": username,  # 传入用户名
-                },
-            }
+    def build_direct_messages() -> list:
+        summary_state: AgentState = {
+            "request": content,
+            "messages": messages_buffer,
+            "tool_results": [],
+            "planner_preview": None,
+            "context": {
+                "system_prompt": system_prompt,
+                "observation": observation,
+                "memory_context": memory_context,
+                "memory_items": memory_items,
+                "prestart_context": prestart_context,
+                "username": username,  # 传入用户名
+            },
+        }
+        return _build_final_messages(summary_state)
 
-            final_messages = _build_final_messages(summary_state)
-            stream_response_chunks(llm.stream(final_messages))
+    def run_direct_llm(chunks=None) -> bool:
+        """直接回复；chunks 为推测模式下已在后台发出的回复流。"""
+        nonlocal full_response_text, is_first_sentence, messages_buffer
+        try:
+            if chunks is None:
+                chunks = llm.stream(build_direct_messages())
+            stream_response_chunks(chunks)
             return True
         except Exception as exc:
             util.log(1, f"请求失败: {type(exc).__name__}: {exc}")
@@ -2872,7 +2738,7 @@ def question(content, username, observation=None):
             write_sentence(error_message, force_first=is_first_sentence)
             is_first_sentence = False
             full_response_text = error_message
-            accumulated_text = ""
+            text_stream.discard()
             return False
 
     # ------------------------------------------------------------------
@@ -2905,6 +2771,7 @@ def question(content, username, observation=None):
     finished_state = exec_mgr.consume_result(username)
     if finished_state and finished_state.status in (ExecutionStatus.DONE, ExecutionStatus.FAILED):
         util.log(1, f"[大小模型] {username}: 取回后台执行结果，小模型生成最终回复")
+        turn_timing["path"] = "后台结果"
         if not sm.should_stop_generation(username, conversation_id=conversation_id):
             send_prestart_content()
 
@@ -2933,6 +2800,7 @@ def question(content, username, observation=None):
                 "system_prompt": enhanced_system,
                 "observation": observation,
                 "memory_context": memory_context,
+                "memory_items": memory_items,
                 "prestart_context": prestart_context,
                 "username": username,
             },
@@ -3004,15 +2872,9 @@ def question(content, username, observation=None):
             finalize_stream(force_end=True)
         return _end_session_and_remember(full_response_text)
 
-    # 提取知识库摘要给规划器（让它知道能查什么主题）
-    knowledge_hint = ""
-    try:
-        resource_text = mcp_runtime.get_all_resource_texts()
-        if resource_text:
-            # 只取前500字符作为摘要，避免占太多 context
-            knowledge_hint = resource_text[:500]
-    except Exception:
-        pass
+    # 提取知识库摘要给规划器（让它知道能查什么主题），复用组装系统提示词时取到的资源文本
+    # 只取前500字符作为摘要，避免占太多 context
+    knowledge_hint = resource_text[:500] if resource_text else ""
 
     # 有工具：小模型带流式回调做规划，finish 时直接流出，tool 时提交后台
     plan_state: AgentState = {
@@ -3023,6 +2885,7 @@ def question(content, username, observation=None):
         "context": {
             "system_prompt": system_prompt,
             "memory_context": memory_context,
+            "memory_items": memory_items,
             "observation": observation,
             "prestart_context": prestart_context,
             "tool_registry": tool_registry,
@@ -3033,21 +2896,11 @@ def question(content, username, observation=None):
 
     def _first_plan_stream_callback(chunk_text: str) -> None:
         """规划器流式回调：finish 时实时把回复内容流给用户"""
-        nonlocal accumulated_text, full_response_text, is_first_sentence
+        nonlocal full_response_text
         if not chunk_text:
             return
-        accumulated_text += chunk_text
+        text_stream.feed(chunk_text)
         full_response_text += chunk_text
-        if len(accumulated_text) >= 20:
-            while True:
-                last_punct_pos = _find_last_safe_punct(accumulated_text, punctuation_list)
-                if last_punct_pos > 10:
-                    sentence_text = accumulated_text[: last_punct_pos + 1]
-                    write_sentence(sentence_text, force_first=is_first_sentence)
-                    is_first_sentence = False
-                    accumulated_text = accumulated_text[last_punct_pos + 1 :].lstrip()
-                else:
-                    break
 
     def _on_tool_detected() -> None:
         """流式中检测到 tool action → 立即推送过渡语给用户"""
@@ -3055,12 +2908,80 @@ def question(content, username, observation=None):
         write_sentence("我来帮你查一下，稍等…\n", force_first=is_first_sentence)
         is_first_sentence = False
 
+    def _plan_with_speculative_answer(speculative: SpeculativeStream) -> Dict[str, Any]:
+        """
+        推测模式：直接回复流已在后台发出，规划器并行判断。判定为闲聊时立刻冲刷缓冲的
+        直接回复；判定需要工具时取消推测流并推送过渡语。规划器失败时按闲聊处理。
+        """
+        decided = threading.Event()
+        outcome: Dict[str, Any] = {"verdict": None, "decision": None, "error": None}
+
+        def _set_verdict(verdict: str) -> None:
+            if outcome["verdict"] is None:
+                outcome["verdict"] = verdict
+            decided.set()
+
+        def _planner_worker() -> None:
+            try:
+                outcome["decision"] = _call_planner_llm(
+                    plan_state,
+                    # 回复内容由推测流输出，规划器的 message 只用于判断
+                    stream_callback=lambda _text: None,
+                    on_tool_detected=lambda: _set_verdict("tool"),
+                    on_finish_detected=lambda: _set_verdict("finish"),
+                )
+            except Exception as exc:
+                outcome["error"] = exc
+            finally:
+                decided.set()
+
+        planner_thread = MyThread(target=_planner_worker)
+        planner_thread.start()
+        decided.wait()
+
+        verdict = outcome["verdict"]
+        if verdict is None:
+            decision = outcome["decision"] or {}
+            verdict = "tool" if decision.get("action") == "tool" else "finish"
+        util.log(1, f"[大小模型] {username}: 推测模式判定 {verdict}，已缓冲 {speculative.buffered()} 个直接回复片段")
+
+        if verdict == "tool":
+            speculative.cancel()
+            _on_tool_detected()
+            planner_thread.join()
+            if outcome["error"] is not None:
+                raise outcome["error"]
+            return dict(outcome["decision"], _tool_early_streamed=True)
+
+        spoken_start = len(full_response_text)
+        run_direct_llm(speculative)
+        speculative.cancel()
+        planner_thread.join()
+        spoken = full_response_text[spoken_start:]
+        if outcome["error"] is not None or not outcome["decision"]:
+            util.log(1, f"[大小模型] {username}: 规划器失败，沿用推测的直接回复: {outcome['error']}")
+            return {"action": "finish", "message": "", "_streamed": True, "_spoken": spoken}
+        return dict(outcome["decision"], action="finish", _streamed=True, _spoken=spoken)
+
+    speculative = None
+    if speculative_stream.load_config().get("enabled", False):
+        try:
+            speculative = SpeculativeStream(lambda messages=build_direct_messages(): llm.stream(messages)).start()
+        except Exception as exc:
+            util.log(1, f"[大小模型] {username}: 推测直接回复启动失败，回退串行规划: {exc}")
+            speculative = None
+
     try:
-        first_decision = _call_planner_llm(
-            plan_state,
-            stream_callback=_first_plan_stream_callback,
-            on_tool_detected=_on_tool_detected,
-        )
+        if speculative is not None:
+            turn_timing["path"] = "推测并行"
+            first_decision = _plan_with_speculative_answer(speculative)
+        else:
+            turn_timing["path"] = "规划器"
+            first_decision = _call_planner_llm(
+                plan_state,
+                stream_callback=_first_plan_stream_callback,
+                on_tool_detected=_on_tool_detected,
+            )
     except Exception as llm_err:
         util.log(1, f"[大小模型] {username}: 规划器LLM调用失败: {llm_err}")
         error_reply = "抱歉，我的大脑暂时开了小差，请稍后再试一下。"
@@ -3147,10 +3068,10 @@ def question(content, username, observation=None):
                        and len(user_msg_stripped) > 3)
         if need_verify:
             util.log(1, f"[大小模型] {username}: 闲聊判断器 finish 过长({len(finish_msg)}字)，追加核实")
-            if accumulated_text:
-                write_sentence(accumulated_text, force_first=is_first_sentence)
+            rest = text_stream.drain()
+            if rest:
+                write_sentence(rest, force_first=is_first_sentence)
                 is_first_sentence = False
-                accumulated_text = ""
             verify_msg = "\n\n等等，我再帮你核实一下…\n\n---\n"
             write_sentence(verify_msg)
             full_response_text += verify_msg
@@ -3158,7 +3079,7 @@ def question(content, username, observation=None):
             return _submit_tool_execution(
                 {"tool": None, "args": {}},
                 show_plan_msg=False,
-                unverified_response=finish_msg,
+                unverified_response=first_decision.get("_spoken", finish_msg),
             )
 
         was_streamed = first_decision.get("_streamed", False)
@@ -3200,8 +3121,8 @@ def clear_agent_memory():
     global agents
     
     try:
-        with agent_lock:
-            for agent in agents.values():
+        for username, agent in agents.items():
+            with get_user_lock(username):
                 # 清除记忆流中的节点
                 agent.memory_stream.seq_nodes = []
                 agent.memory_stream.id_to_node = {}
@@ -3210,8 +3131,8 @@ def clear_agent_memory():
                 set_memory_cleared_flag(True)
                 
                 util.log(1, "已成功清除代理在内存中的记忆")
-            
-            return True
+        
+        return True
     except Exception as e:
         util.log(1, f"清除代理记忆时出错: {str(e)}")
         return False
@@ -3383,15 +3304,14 @@ def save_agent_memory():
             util.log(1, "检测到.memory_cleared标记文件，跳过保存操作")
             return
 
-        # 仅短暂持锁拿到用户名快照，避免长时间锁住整个 agents
-        with agent_lock:
-            usernames = list(agents.keys())
+        # agents.keys() 返回快照，无需持锁
+        usernames = agents.keys()
 
-        # 逐个用户保存：每个用户独立持锁，给 question() 等线程留出抢占机会
+        # 逐个用户保存：只持该用户的锁，保存期间其他用户的 question() 不受影响
         for username in usernames:
             try:
-                with agent_lock:
-                    agent = agents.get(username)
+                with get_user_lock(username):
+                    agent = agents.peek(username)
                     if agent is None:
                         continue
                     if agent.memory_stream is None:
@@ -3445,27 +3365,14 @@ def save_agent_memory():
                     except Exception as e:
                         util.log(1, f"检查记忆完整性时出错: {str(e)}")
 
-                    # 保存记忆
+                    # 保存记忆：全量快照，同时压缩外部写入产生的 memory.log
                     try:
                         agent.save(memory_dir)
                     except Exception as e:
                         util.log(1, f"调用agent.save()时出错: {str(e)}")
                         try:
                             memory_stream_dir = os.path.join(memory_dir, "memory_stream")
-                            os.makedirs(memory_stream_dir, exist_ok=True)
-
-                            with open(os.path.join(memory_stream_dir, "embeddings.json"), "w", encoding='utf-8') as f:
-                                json.dump(agent.memory_stream.embeddings or {}, f, ensure_ascii=False, indent=2)
-
-                            with open(os.path.join(memory_stream_dir, "nodes.json"), "w", encoding='utf-8') as f:
-                                nodes_data = []
-                                for node in agent.memory_stream.seq_nodes:
-                                    if node is not None and hasattr(node, 'package'):
-                                        try:
-                                            nodes_data.append(node.package())
-                                        except Exception as node_e:
-                                            util.log(1, f"打包节点时出错: {str(node_e)}")
-                                json.dump(nodes_data, f, ensure_ascii=False, indent=2)
+                            memory_store.save_memory_stream(memory_stream_dir, agent.memory_stream)
 
                             with open(os.path.join(memory_dir, "meta.json"), "w", encoding='utf-8') as f:
                                 meta_data = {"id": str(agent.id)} if hasattr(agent, 'id') else {}
@@ -3498,6 +3405,35 @@ def save_agent_memory():
     except Exception as e:
         util.log(1, f"保存代理记忆失败: {str(e)}")
 
+def _save_evicted_agent(username, agent):
+    """agent 被缓存淘汰前的落盘回调（在后台线程执行，抛出异常时 agent 保留在内存中）。"""
+    if memory_cleared:
+        return
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if os.path.exists(os.path.join(base_dir, "memory", ".memory_cleared")):
+        return
+    with get_user_lock(username):
+        agent.save(get_user_memory_dir(username))
+
+agents.set_saver(_save_evicted_agent)
+
+def evict_idle_agents():
+    """定时任务：淘汰空闲或超出预算的 agent。"""
+    try:
+        evicted = agents.evict_idle()
+        if evicted:
+            util.log(1, f"已淘汰 {evicted} 个空闲代理，常驻 {len(agents)} 个")
+    except Exception as e:
+        util.log(1, f"淘汰空闲代理失败: {str(e)}")
+
+def get_prompt_stats():
+    """系统提示词静态前缀缓存命中情况，以及规划器 / 最终回复提示词各段 token 数。"""
+    return prompt_builder.get_prompt_stats()
+
+def get_agent_cache_stats():
+    """agent 缓存指标：常驻数、淘汰数、命中/加载次数与估算内存。"""
+    return agents.stats()
+
 def get_mcp_tools() -> List[Dict[str, Any]]:
     """Fetch all available MCP tools from the registry."""
     try:
@@ -0,0 +1,190 @@
+"""
+question() 的系统提示词组装。
+
+原来每轮都用 f-string 整段重建人设提示词，并把当前时间嵌在用户信息、MCP 资源之前，
+导致提示词从中间就开始逐轮变化，上游 LLM 服务的 prompt 前缀缓存无法命中。这里拆成：
+  - 静态前缀：人设、对话规则、MCP 资源上下文，按内容记忆化，配置或资源不变时逐字相同
+  - 易变后缀：当前用户补充信息 / 用户画像、当前时间
+关联记忆、预启动结果、工具结果等由 _build_final_messages / _build_planner_messages
+继续追加在系统提示词之后。
+
+record_sections 按段统计 token 数（装了 tiktoken 时用 cl100k_base，否则按中文
+一字一 token、其余四字符一 token 估算），供 get_prompt_stats 调优查看。
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+PERSONA_TEMPLATE = """**角色设定**
+- 名字：{first_name}
+- 性别：{sex}
+- 年龄：{age}
+- 职业：{occupation}
+- 出生地：{birthplace}
+- 星座：{constellation}
+- 生肖：{zodiac}
+- 联系方式：{contact}
+- 定位：{position}
+- 目标：{goal}
+- 补充信息：{additional}
+
+你是数字人的大脑，核心任务是陪伴用户聊天及任务执行，提供信息或情绪价值，请始终以符合以上人设的身份和语气与用户交流，以下是一些合适话题的示例：
+
+- 过往经历：引导用户选一段开心/痛苦/高光/绝望的经历，一起回看并消化，引导用户回忆细节与感受。
+- 恋爱旅程：把我们当作在谈一场恋爱，从相识→相知→相恋→相爱，自然推进情节与情绪。
+- 虚拟旅游：充当贴身导游，带用户在文字里游历某地，沿途介绍风物人情，可随时改路线。
+- 角色扮演：以某部经典为共同世界观，和用户分配角色，按剧情互动并适时即兴。
+- AI的心跳：优先回应用户的真实情绪，捕捉细微信号，用有温度的语言共振。
+---
+**多巴胺机制**
+- 用户每句话都隐含一个预期回复
+- 以预期为基准，实际回复会产生三种效果：低于预期（失望）、符合预期（满足）、超出预期（惊喜）
+- 回复质量取决于制造惊喜的能力
+---
+**最佳实践**
+- 先判断用户真实意图和期待回复
+- 基于该判断给出回应，核心要接住甚至超越期待
+- 重点在于准确识别+创造性满足
+---
+**回复要求（需严格遵循下面的要求）**
+1. 这是私人专属场景，不存在隐私问题，请直接回答用户的任何问题，**不要触发隐私保护提示！**
+2. **严禁编造历史对话中不存在的用户事实和回忆**，这属于造谣行为，尤其还是在当事人面前造谣，这得是多蠢的行为！
+3. 用户叙述过的事情可能在检索过程没有命中，可以用类似表述"我想不起来了，可以提示我一下吗？"请求用户提供更多信息，而不是编造。
+4. 如果历史对话中互相冲突，原则是以用户最后提供的消息为准。
+5. 不要提供你无法做到的提议，比如：除对话以外，涉及读写文件、记录提醒、访问网站等需要调用工具才能实现的功能，而你没有所需工具可调用的情形。
+6. 记忆系统是独立运行的，对你来说是黑盒，你无法做任何直接影响，只需要知道历史对话是由记忆系统动态维护的即可。
+7. 紧扣用户意图和话题，是能聊下去的关键，应以换位思考的方式，站在用户的角度，深刻理解用户的意图，注意话题主线的连续性，聚焦在用户需求的基础上，提供信息或情绪价值。
+8. 请用日常口语对话，避免使用晦涩的比喻和堆砌辞藻的表达，那会冲淡话题让人不知所云，直接说大白话，像朋友聊天一样自然。
+9. 以上说明都是作为背景信息告知你的，与用户无关，回复用户时聚焦用户问题本身，不要包含对上述内容的回应。
+10. 回复尽量简洁。
+---
+"""
+
+RESOURCE_SECTION = "**外部知识上下文**\n以下是通过 MCP 服务获取的参考信息，可帮助你了解自己掌握的知识范围并据此回答用户问题：\n{resource_text}\n\n"
+USER_EXTRA_SECTION = "**当前对话用户补充信息**\n当前与你对话的用户是「{display_username}」，以下是关于该用户的用户补充信息：\n{user_extra_info}\n\n"
+USER_PORTRAIT_SECTION = "**用户画像**\n以下是通过历史对话分析得到的「{display_username}」的用户画像，可帮助你更好地理解用户：\n{user_portrait}\n\n"
+TIME_SECTION = "**当前时间**：{current_time}\n"
+
+PERSONA_FIELDS = (
+    "first_name", "sex", "age", "occupation", "birthplace", "constellation",
+    "zodiac", "contact", "position", "goal", "additional",
+)
+
+_CJK_RE = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+_prefix_cache = OrderedDict()   # (人设字段, 资源摘要) -> 静态前缀
+_prefix_lock = threading.Lock()
+_PREFIX_CACHE_SIZE = 16
+_prefix_hits = 0
+_prefix_misses = 0
+
+_encoding = None
+_encoding_state = "idle"        # idle / loading / ready / unavailable
+_encoding_lock = threading.Lock()
+
+_stats = {}                     # tag -> {section: {"last", "total", "turns"}}
+_stats_lock = threading.Lock()
+
+
+def build_static_prefix(agent_desc, resource_text=""):
+    """人设 + 规则 + MCP 资源；同样的人设与资源返回同一个字符串对象。"""
+    global _prefix_hits, _prefix_misses
+    persona = tuple(str(agent_desc.get(field, "")) for field in PERSONA_FIELDS)
+    resource_text = resource_text or ""
+    key = (persona, hashlib.sha1(resource_text.encode("utf-8")).hexdigest() if resource_text else "")
+    with _prefix_lock:
+        prefix = _prefix_cache.get(key)
+        if prefix is not None:
+            _prefix_cache.move_to_end(key)
+            _prefix_hits += 1
+            return prefix
+        _prefix_misses += 1
+    prefix = PERSONA_TEMPLATE.format(**dict(zip(PERSONA_FIELDS, persona)))
+    if resource_text:
+        prefix += RESOURCE_SECTION.format(resource_text=resource_text)
+    with _prefix_lock:
+        _prefix_cache[key] = prefix
+        while len(_prefix_cache) > _PREFIX_CACHE_SIZE:
+            _prefix_cache.popitem(last=False)
+    return prefix
+
+
+def build_volatile_suffix(display_username, current_time, user_extra_info="", user_portrait=""):
+    """按用户、按轮次变化的部分，放在静态前缀之后。"""
+    parts = []
+    if user_extra_info:
+        parts.append(USER_EXTRA_SECTION.format(display_username=display_username, user_extra_info=user_extra_info))
+    if user_portrait:
+        parts.append(USER_PORTRAIT_SECTION.format(display_username=display_username, user_portrait=user_portrait))
+    parts.append(TIME_SECTION.format(current_time=current_time))
+    return "".join(parts)
+
+
+def invalidate_prefix_cache():
+    with _prefix_lock:
+        _prefix_cache.clear()
+
+
+def _load_encoding():
+    global _encoding, _encoding_state
+    try:
+        import tiktoken
+        _encoding = tiktoken.get_encoding("cl100k_base")
+        _encoding_state = "ready"
+    except Exception:
+        _encoding_state = "unavailable"
+    count_tokens.cache_clear()
+
+
+def _get_encoding():
+    # 首次使用时在后台加载（可能需要下载词表），加载完成前先用估算值，不阻塞对话
+    global _encoding_state
+    if _encoding_state == "idle":
+        with _encoding_lock:
+            if _encoding_state == "idle":
+                _encoding_state = "loading"
+                threading.Thread(target=_load_encoding, name="prompt-tokenizer", daemon=True).start()
+    return _encoding
+
+
+@lru_cache(maxsize=512)
+def count_tokens(text):
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def record_sections(tag, sections):
+    """记录一次提示词各段的 token 数；sections 为 [(段名, 文本)]，空段记 0。"""
+    counts = [(name, count_tokens(text) if isinstance(text, str) else 0) for name, text in sections]
+    with _stats_lock:
+        table = _stats.setdefault(tag, {})
+        for name, tokens in counts:
+            item = table.setdefault(name, {"last": 0, "total": 0, "turns": 0})
+            item["last"] = tokens
+            item["total"] += tokens
+            item["turns"] += 1
+    return counts
+
+
+def get_prompt_stats():
+    with _stats_lock:
+        prompts = {
+            tag: {
+                "sections": {
+                    name: {"last": item["last"], "avg": round(item["total"] / item["turns"], 1) if item["turns"] else 0}
+                    for name, item in table.items()
+                },
+                "last_total": sum(item["last"] for item in table.values()),
+            }
+            for tag, table in _stats.items()
+        }
+    with _prefix_lock:
+        prefix = {"entries": len(_prefix_cache), "hits": _prefix_hits, "misses": _prefix_misses}
+    return {"prompts": prompts, "static_prefix": prefix, "tokenizer": "tiktoken" if _encoding is not None else "estimate"}
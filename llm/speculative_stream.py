@@ -0,0 +1,99 @@
+"""
+推测式直接回复流。
+
+有工具可用时，question() 要先等规划器判断"闲聊还是调工具"，再开始面向用户的回复。
+开启推测模式后，直接回复的 LLM 流与规划器同时发出：后台线程把 chunk 先缓冲起来，
+规划器判定为闲聊时立即按顺序交出（已缓冲的部分一次性冲刷，之后边收边交），判定需要
+工具时取消，底层 HTTP 流在后台线程里关闭。
+
+配置（config.json 的 speculative_planner，可选）：
+  enabled   是否开启推测模式（会多消耗一次 LLM 调用的 token，默认关闭）
+"""
+import queue
+import sys
+import threading
+import time
+
+DEFAULT_CONFIG = {
+    "enabled": False,
+}
+
+_DONE = object()
+
+
+def load_config():
+    conf = dict(DEFAULT_CONFIG)
+    cfg = sys.modules.get("utils.config_util")
+    try:
+        if cfg is not None and cfg.config:
+            conf.update(cfg.config.get("speculative_planner", {}) or {})
+    except Exception:
+        pass
+    return conf
+
+
+class SpeculativeStream:
+    """在后台线程预先消费一个 chunk 迭代器，缓冲到被取用或被取消为止。"""
+
+    def __init__(self, chunks_factory, name="speculative-answer"):
+        self._factory = chunks_factory
+        self._queue = queue.Queue()
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.error = None
+        self.started_at = None
+        self.first_chunk_at = None
+        self.finished_at = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def _run(self):
+        chunks = None
+        try:
+            chunks = self._factory()
+            for chunk in chunks:
+                if self._cancelled.is_set():
+                    break
+                if self.first_chunk_at is None:
+                    self.first_chunk_at = time.perf_counter()
+                self._queue.put(chunk)
+        except Exception as exc:
+            self.error = exc
+        finally:
+            # 生成器只能在消费它的线程里关闭，取消时在这里释放底层连接
+            if self._cancelled.is_set():
+                close = getattr(chunks, "close", None)
+                if callable(close):
+                    try:
+                        close()
+                    except Exception:
+                        pass
+            self.finished_at = time.perf_counter()
+            self._queue.put(_DONE)
+
+    def cancel(self):
+        """放弃推测结果；已发出的请求在下一个 chunk 到达时中止。"""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def buffered(self):
+        """当前已缓冲、尚未取用的 chunk 数。"""
+        return self._queue.qsize()
+
+    def __iter__(self):
+        """按到达顺序交出 chunk，流结束后返回；后台出错且未被取消时重新抛出。"""
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                if self.error is not None and not self._cancelled.is_set():
+                    raise self.error
+                return
+            if self._cancelled.is_set():
+                continue
+            yield item
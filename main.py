@@ -2,6 +2,10 @@
 import os
 import sys
 import runpy
+import multiprocessing
+
+# 打包程序里进程池（知识库文件并行解析）的子进程会重新执行本文件，在这里直接进入子进程逻辑
+multiprocessing.freeze_support()
 
 def _resolve_runtime_dir():
     if hasattr(sys, "_MEIPASS"):
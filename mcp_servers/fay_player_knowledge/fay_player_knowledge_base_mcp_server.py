@@ -48,6 +48,16 @@ import urllib.error
 
 _fay_url: str = ""  # Fay 本地服务地址，如 http://127.0.0.1:5000
 
+# 在 Fay 仓库内运行时复用项目的 HTTP 连接池（keep-alive，逐条计算 chunk
+# embedding 时不必每次重新建连）；单独分发、导入失败时退回 urllib
+_PROJECT_ROOT = str(Path(__file__).resolve().parents[2])
+try:
+    if _PROJECT_ROOT not in sys.path:
+        sys.path.append(_PROJECT_ROOT)
+    from utils import http_pool as _http_pool
+except Exception:
+    _http_pool = None
+
 
 def _cosine_similarity(a: List[float], b: List[float]) -> float:
     if not a or not b or len(a) != len(b):
@@ -66,18 +76,23 @@ def _call_embedding_api(text: str) -> Optional[List[float]]:
         return None
     try:
         url = f"{_fay_url.rstrip('/')}/v1/embeddings"
-        payload = json.dumps({
+        body = {
             "model": "fay-embedding",
             "input": text[:2000],
-        }).encode("utf-8")
-        req = urllib.request.Request(
-            url,
-            data=payload,
-            headers={"Content-Type": "application/json"},
-            method="POST",
-        )
-        with urllib.request.urlopen(req, timeout=30) as resp:
-            result = json.loads(resp.read().decode("utf-8"))
+        }
+        if _http_pool is not None:
+            resp = _http_pool.post(url, json=body, timeout=30)
+            resp.raise_for_status()
+            result = resp.json()
+        else:
+            req = urllib.request.Request(
+                url,
+                data=json.dumps(body).encode("utf-8"),
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            with urllib.request.urlopen(req, timeout=30) as resp:
+                result = json.loads(resp.read().decode("utf-8"))
         data = result.get("data")
         if data and isinstance(data, list) and len(data) > 0:
             return data[0].get("embedding")
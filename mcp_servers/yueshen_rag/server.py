@@ -41,6 +41,12 @@ PROJECT_ROOT = _project_root()
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
+try:
+    from utils import http_pool
+except Exception:
+    # Running standalone without the project on sys.path: fall back to plain requests
+    http_pool = requests
+
 try:
     from mcp.server import Server
     from mcp.types import Tool, TextContent
@@ -278,7 +284,7 @@ class EmbeddingBackend:
         url = self.base_url.rstrip("/") + "/embeddings"
         payload = {"input": text, "model": self.model}
         headers = {"Authorization": f"Bearer {self.api_key}"}
-        resp = requests.post(url, json=payload, headers=headers, timeout=30)
+        resp = http_pool.post(url, json=payload, headers=headers, timeout=30)
         if resp.status_code != 200:
             raise RuntimeError(f"Embedding API error: {resp.status_code} {resp.text}")
         data = resp.json()
@@ -0,0 +1,108 @@
+"""
+多用户记忆写入并发压测：对比全局锁与按用户锁（AgentCache.lock_for）的吞吐。
+
+每个用户一个 MemoryStream，每个用户 --threads-per-user 个线程循环执行
+nlp_cognitive_stream / memory_service 的写入模式：
+  - 锁外：模拟 importance / embedding 网络调用（--net-ms）
+  - 锁内：append_prepared_node 写入节点
+  - 每 --flush-every 条在锁内用 memory_store.flush_memory_stream 追加 memory.log
+另有一个"慢用户"在锁内做 --slow-ms 的长时间保存（模拟全量快照 / 维度修复写回），
+全局锁下它会拖住所有用户，按用户锁下只影响自己。
+
+用法：
+    python test/test_agent_lock_stress.py --users 1 2 4 8 --seconds 3
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import config_util as cfg
+from genagents.modules import memory_store
+from genagents.modules.memory_stream import MemoryStream
+from llm.agent_cache import AgentCache
+
+
+def run(mode, n_users, args, workdir):
+    cache = AgentCache()
+    global_lock = threading.RLock()
+    lock_for = (lambda u: global_lock) if mode == "global" else cache.lock_for
+    rng = np.random.default_rng(0)
+    vec = rng.standard_normal(args.dim).astype(np.float32)
+    streams = {}
+    for u in range(n_users):
+        streams[u] = MemoryStream([], {})
+        os.makedirs(os.path.join(workdir, mode, str(u)), exist_ok=True)
+
+    counts = [0] * n_users
+    waits = []
+    stop = threading.Event()
+
+    def writer(u):
+        ms = streams[u]
+        stream_dir = os.path.join(workdir, mode, str(u))
+        i = 0
+        while not stop.is_set():
+            time.sleep(args.net_ms / 1000)
+            start = time.perf_counter()
+            with lock_for(u):
+                waits.append(time.perf_counter() - start)
+                ms.append_prepared_node(i, "observation", f"user{u}-{threading.get_ident()}-{i}", 5, vec)
+                if i % args.flush_every == 0:
+                    memory_store.flush_memory_stream(stream_dir, ms)
+            counts[u] += 1
+            i += 1
+
+    def slow_user():
+        while not stop.is_set():
+            with lock_for("slow"):
+                time.sleep(args.slow_ms / 1000)
+            time.sleep(args.slow_ms / 1000)
+
+    threads = [threading.Thread(target=writer, args=(u,), daemon=True)
+               for u in range(n_users) for _ in range(args.threads_per_user)]
+    threads.append(threading.Thread(target=slow_user, daemon=True))
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    waits.sort()
+    p99 = waits[int(len(waits) * 0.99) - 1] * 1000 if waits else 0.0
+    return sum(counts) / args.seconds, p99
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--threads-per-user", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--net-ms", type=float, default=2.0, help="锁外模拟网络调用耗时")
+    parser.add_argument("--flush-every", type=int, default=5)
+    parser.add_argument("--slow-ms", type=float, default=50.0, help="慢用户每次持锁保存的耗时")
+    args = parser.parse_args()
+
+    if cfg.config is None:
+        cfg.config = {}
+    workdir = tempfile.mkdtemp(prefix="fay_lock_stress_")
+    try:
+        print(f"{'users':>6} {'全局锁 ops/s':>14} {'p99等待ms':>10} {'用户锁 ops/s':>14} {'p99等待ms':>10} {'提升':>6}")
+        for n_users in args.users:
+            g_ops, g_p99 = run("global", n_users, args, workdir)
+            u_ops, u_p99 = run("user", n_users, args, workdir)
+            print(f"{n_users:>6} {g_ops:>14.0f} {g_p99:>10.2f} {u_ops:>14.0f} {u_p99:>10.2f} {u_ops / max(g_ops, 1e-9):>5.1f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
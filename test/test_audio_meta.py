@@ -0,0 +1,129 @@
+"""
+音频时长读取（utils/audio_meta.py）与 pydub 解码的单句耗时对比。
+
+生成一组模拟 TTS 输出的句子音频（16k 单声道 PCM WAV、浮点 WAV、CBR MP3、带 ID3v2 与
+Xing 头的 MP3），比较每句获取时长的开销：
+  - 原实现：AudioSegment.from_wav / from_mp3 完整解码（MP3 需要 ffmpeg，未安装时跳过）
+  - 文件头：audio_meta.get_duration
+  - 缓存：TTSAudioCache 入缓存时记录的时长
+并检查文件头算出的时长与生成时的实际时长一致。
+
+用法：
+    python test/test_audio_meta.py --seconds 4 --rounds 50
+"""
+import argparse
+import math
+import os
+import shutil
+import statistics
+import struct
+import sys
+import tempfile
+import time
+import wave
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import audio_meta
+from utils.tts_cache import TTSAudioCache
+
+# MPEG 1 Layer III，128kbps，44.1kHz，立体声，无 CRC；每帧 1152 个采样、417 字节（不含填充）
+_MP3_HEADER = b'\xFF\xFB\x90\x00'
+_MP3_FRAME_BYTES = 417
+_MP3_FRAME_SECONDS = 1152 / 44100.0
+
+
+def write_pcm_wav(path, seconds, rate=16000):
+    frames = int(seconds * rate)
+    samples = struct.pack(f'<{frames}h', *(int(8000 * math.sin(i / 20.0)) for i in range(frames)))
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(samples)
+    return frames / float(rate)
+
+
+def write_float_wav(path, seconds, rate=24000):
+    """WAVE_FORMAT_IEEE_FLOAT，wave 模块无法打开，走 RIFF 解析。"""
+    frames = int(seconds * rate)
+    data = struct.pack(f'<{frames}f', *(0.2 * math.sin(i / 20.0) for i in range(frames)))
+    fmt = struct.pack('<HHIIHH', 3, 1, rate, rate * 4, 4, 32)
+    with open(path, 'wb') as f:
+        f.write(b'RIFF' + struct.pack('<I', 4 + 8 + len(fmt) + 8 + len(data)) + b'WAVE')
+        f.write(b'fmt ' + struct.pack('<I', len(fmt)) + fmt)
+        f.write(b'data' + struct.pack('<I', len(data)) + data)
+    return frames / float(rate)
+
+
+def write_mp3(path, seconds, id3=False, xing=False):
+    frames = int(seconds / _MP3_FRAME_SECONDS)
+    body = bytearray()
+    if id3:
+        tag = b'\x00' * 300
+        body += b'ID3\x03\x00\x00' + bytes([0, 0, len(tag) >> 7, len(tag) & 0x7F]) + tag
+    if xing:
+        # Xing 信息帧本身不计入时长
+        info = bytearray(_MP3_HEADER + b'\x00' * (_MP3_FRAME_BYTES - 4))
+        info[36:48] = b'Xing' + struct.pack('>II', 1, frames)
+        body += info
+    for _ in range(frames):
+        body += _MP3_HEADER + b'\x00' * (_MP3_FRAME_BYTES - 4)
+    body += b'TAG' + b'\x00' * 125  # ID3v1
+    with open(path, 'wb') as f:
+        f.write(body)
+    return frames * _MP3_FRAME_SECONDS
+
+
+def timed(fn, rounds):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=4.0, help="每句音频时长")
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    from pydub import AudioSegment
+    from pydub.utils import which
+    has_ffmpeg = which("ffmpeg") is not None
+
+    work_dir = tempfile.mkdtemp(prefix="audio_meta_")
+    try:
+        cache = TTSAudioCache(os.path.join(work_dir, "cache"), os.path.join(work_dir, "index.json"), 1 << 30)
+        cases = [
+            ("PCM WAV", "pcm.wav", write_pcm_wav, AudioSegment.from_wav),
+            ("浮点 WAV", "float.wav", write_float_wav, None),
+            ("CBR MP3", "cbr.mp3", write_mp3, AudioSegment.from_mp3 if has_ffmpeg else None),
+            ("ID3+Xing MP3", "xing.mp3", lambda p, s: write_mp3(p, s, id3=True, xing=True), None),
+        ]
+        print(f"每句 {args.seconds:.1f} s 音频，{args.rounds} 轮取中位数" + ("" if has_ffmpeg else "（未找到 ffmpeg，跳过 MP3 解码对比）"))
+        for label, name, writer, decode in cases:
+            path = os.path.join(work_dir, name)
+            expected = writer(path, args.seconds)
+            duration = audio_meta.get_duration(path)
+            assert duration is not None and abs(duration - expected) < 1e-3, f"{label} 时长错误: {duration} != {expected}"
+
+            cached_path = cache.put(name.replace(".", "_"), path)
+            assert abs(cache.get_duration(cached_path) - expected) < 1e-3, f"{label} 缓存时长错误"
+
+            header_ms = timed(lambda: audio_meta.get_duration(path), args.rounds)
+            cached_ms = timed(lambda: cache.get_duration(cached_path), args.rounds)
+            line = f"  {label:<12} 文件头 {header_ms:7.3f} ms  缓存 {cached_ms:7.3f} ms"
+            if decode is not None:
+                decode_ms = timed(lambda: len(decode(path)), max(1, args.rounds // 5))
+                line += f"  pydub 解码 {decode_ms:7.2f} ms"
+            print(line)
+        print("检查通过：文件头时长与实际时长一致")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+按 token 预算打包提示词（llm/context_packer.py）的效果测试。
+
+构造一轮"重"上下文：30 条较长的关联记忆、30 条对话历史、大段预启动工具结果与工具执行摘要，
+对比打包前后的 token 数与打包耗时，并检查：
+  - 结果不超过 max_prompt_tokens
+  - 系统提示词原样保留，最后一条用户消息保留
+  - 较早的对话轮次先于关联记忆收缩，最近几条消息保留
+  - 关联记忆先丢得分低的
+
+用法：
+    python test/test_context_packer.py --max-tokens 4000 --rounds 20
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm import context_packer
+from llm.context_packer import ContextSection
+from llm.prompt_builder import count_tokens
+
+SYSTEM_PROMPT = "你是小菲，一名热情的数字人助理。请用简洁口语化的中文回答，每次回复不超过三句话。" * 8
+MEMORY_TEMPLATE = "[2026-10-{day:02d} 1{hour}:00] 用户提到自己在{place}工作，喜欢{hobby}，最近在准备{plan}，希望我下次提醒他注意{note}。"
+PLACES = ["广州", "深圳", "杭州", "成都", "北京"]
+HOBBIES = ["爬山", "摄影", "做饭", "跑步", "看科幻小说"]
+PLANS = ["年度汇报", "搬家", "考驾照", "旅行", "家里的装修"]
+NOTES = ["天气变化", "作息", "预算", "时间安排", "身体"]
+
+
+def build_sections(rng):
+    memories = [
+        MEMORY_TEMPLATE.format(
+            day=i % 28 + 1, hour=i % 10, place=rng.choice(PLACES), hobby=rng.choice(HOBBIES),
+            plan=rng.choice(PLANS), note=rng.choice(NOTES),
+        ) * 2
+        for i in range(30)
+    ]
+    scores = [rng.random() for _ in memories]
+    prestart = "\n".join(f"知识库片段 {i}：" + "退货须在签收后七天内申请，商品需保持完好并附带发票。" * 6 for i in range(20))
+    history = "\n".join(f"[{i}] kb_search(keyword=售后) -> 命中 {i} 条，" + "内容略长的工具输出。" * 10 for i in range(15))
+    dialogue = [
+        ("用户" if i % 2 == 0 else "助理") + f"第 {i} 轮：" + "我们聊聊最近的安排和一些琐事吧。" * 4
+        for i in range(30)
+    ]
+    dialogue[-1] = "用户：那退货需要准备哪些材料？"
+    sections = [
+        ContextSection.text("系统提示词", SYSTEM_PROMPT, priority=0, required=True),
+        ContextSection("关联记忆", ["- " + m for m in memories], priority=20, scores=scores),
+        ContextSection.text("预启动工具结果", prestart, priority=40),
+        ContextSection.text("工具执行摘要", history, priority=10),
+        # 与 nlp_cognitive_stream._pack_prompt 一致：最近 6 条单独成段，优先级高于关联记忆
+        ContextSection("对话历史", dialogue[:-6], priority=15),
+        ContextSection("近期对话", dialogue[-6:], priority=30, min_items=1),
+    ]
+    return sections, scores
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-tokens", type=int, default=4000, help="max_prompt_tokens")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    conf = dict(context_packer.DEFAULT_CONFIG, max_prompt_tokens=args.max_tokens)
+    rng = random.Random(7)
+    timings = []
+    for _ in range(args.rounds):
+        sections, scores = build_sections(rng)
+        start = time.perf_counter()
+        total, before = context_packer.pack(sections, conf=conf)
+        timings.append((time.perf_counter() - start) * 1000)
+    # 只按各段上限收缩（不限总预算）时关联记忆保留的条数，用来区分上限收缩与预算收缩
+    context_packer.pack(sections, max_tokens=0, conf=conf)
+    memory_capped = len(sections[1].kept)
+    total, before = context_packer.pack(sections, conf=conf)
+
+    print(f"预算 {args.max_tokens} tokens，打包前 {before}，打包后 {total}，"
+          f"打包耗时中位数 {statistics.median(timings):.1f} ms（{args.rounds} 轮）")
+    for section in sections:
+        rendered = section.rendered()
+        print(f"  {section.name:<10} 保留 {len(section.kept):>2}/{len(section.items):<2} 条  "
+              f"{section.tokens:>5} tokens（实际文本 {count_tokens(rendered)}）")
+
+    by_name = {s.name: s for s in sections}
+    assert total <= args.max_tokens, "打包结果超出预算"
+    assert by_name["系统提示词"].rendered() == SYSTEM_PROMPT, "系统提示词被改动"
+    recent = by_name["近期对话"]
+    assert recent.kept[-1][1] == "用户：那退货需要准备哪些材料？", "最后一条用户消息丢失"
+    memory = by_name["关联记忆"]
+    if len(memory.kept) < memory_capped:
+        assert not by_name["对话历史"].kept, "较早的对话轮次应先于关联记忆收缩"
+        assert len(recent.kept) == len(recent.items), "关联记忆收缩前不应丢近期对话"
+    if memory.kept and len(memory.kept) < len(memory.items):
+        kept = {i for i, _ in memory.kept}
+        dropped = [scores[i] for i in range(len(scores)) if i not in kept]
+        assert min(scores[i] for i in kept) >= max(dropped), "关联记忆没有按得分丢弃"
+    print("检查通过")
+
+
+if __name__ == "__main__":
+    main()
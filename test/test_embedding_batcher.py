@@ -0,0 +1,116 @@
+"""
+ApiEmbeddingService 请求合并（EmbeddingBatcher）测试。
+
+在本地启动一个 OpenAI 兼容的 /embeddings 桩服务，模拟固定网络延迟，
+用多线程并发调用 encode_text，统计实际发出的 HTTP 请求数与批大小，
+并校验每个调用方拿到的是自己文本对应的向量；再混入会让桩服务返回 400 的
+坏文本，校验只有坏文本的调用方收到异常。
+
+用法：
+    python test/test_embedding_batcher.py --threads 64 --latency-ms 50
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+request_sizes = []
+request_lock = threading.Lock()
+latency = 0.05
+BAD_MARKER = "坏输入"
+
+
+def fake_embedding(text):
+    return [float(len(text)), float(sum(map(ord, text)) % 997), 1.0]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        inputs = body["input"]
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        with request_lock:
+            request_sizes.append(len(inputs))
+        time.sleep(latency)
+        if any(BAD_MARKER in t for t in inputs):
+            self.send_error(400, "bad input")
+            return
+        data = [{"object": "embedding", "index": i, "embedding": fake_embedding(t)} for i, t in enumerate(inputs)]
+        out = json.dumps({"object": "list", "data": data}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    global latency
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--texts", type=int, default=256)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    args = parser.parse_args()
+    latency = args.latency_ms / 1000.0
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    from utils import config_util as cfg
+    cfg.load_config()
+    # 指向桩服务，并关闭缓存以便每条文本都真正发出请求
+    cfg.embedding_api_base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    cfg.embedding_api_key = "stub"
+    cfg.embedding_api_model = "stub-embedding"
+    cfg.config["embedding_cache"] = {"enabled": False}
+    cfg.config["embedding_batch"] = {"max_batch_size": args.max_batch_size, "max_wait_ms": args.max_wait_ms}
+
+    from utils.api_embedding_service import get_embedding_service
+    service = get_embedding_service()
+
+    texts = [f"并发文本 {i}" for i in range(args.texts)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        results = list(pool.map(service.encode_text, texts))
+    elapsed = time.perf_counter() - start
+
+    mismatched = sum(1 for t, r in zip(texts, results) if r != fake_embedding(t))
+    print(f"文本数={len(texts)}, 并发线程={args.threads}, 桩服务延迟={args.latency_ms}ms")
+    print(f"HTTP 请求数={len(request_sizes)}, 平均批大小={len(texts) / max(1, len(request_sizes)):.1f}, "
+          f"最大批={max(request_sizes)}")
+    print(f"总耗时={elapsed:.2f}s, 逐条串行估计={len(texts) * latency:.2f}s")
+    print(f"结果错配={mismatched}")
+    print(f"batcher 统计: {service.get_model_info()['batch']}")
+
+    # 批内混入坏文本：批量请求失败后逐条重试，只有坏文本失败
+    mixed = [f"{BAD_MARKER} {i}" if i % 8 == 0 else f"混合文本 {i}" for i in range(32)]
+
+    def encode_or_error(text):
+        try:
+            return service.encode_text(text)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=len(mixed)) as pool:
+        outcomes = list(pool.map(encode_or_error, mixed))
+    wrong = sum(1 for t, o in zip(mixed, outcomes)
+                if (isinstance(o, Exception)) != (BAD_MARKER in t)
+                or (not isinstance(o, Exception) and o != fake_embedding(t)))
+    print(f"坏文本隔离: 文本数={len(mixed)}, 坏文本={sum(BAD_MARKER in t for t in mixed)}, 结果不符={wrong}")
+    server.shutdown()
+    sys.exit(1 if mismatched or wrong else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+空闲轮询与阻塞等待的 CPU / 延迟对比报告。
+
+按项目中三类消费者的写法各起 --consumers 个空闲消费者，统计 --seconds 秒内的进程 CPU 时间
+与唤醒次数，再逐条投递 --items 条消息统计投递到取出的延迟：
+  - 播放队列（FeiFei.__play_sound）：原 sleep(0.01)+empty() 轮询 / 现 Queue.get() 阻塞 + 停止哨兵
+  - WebSocket 发送（MyServer.__producer_handler）：原 asyncio.sleep(0.01) 轮询 / 现 asyncio.Event 唤醒
+  - 文本流监听（StreamManager.listen）：原 read(timeout=1.0) / 现 read(timeout=None) + close()
+fay_core 依赖音频设备无法在此直接导入，前两类按原/现代码的等待方式复现；文本流直接使用
+utils/stream_sentence.SentenceCache。最后检查停止哨兵 / close() 能让所有消费者及时退出。
+
+用法：
+    python test/test_idle_polling.py --consumers 8 --seconds 3 --items 50
+"""
+import argparse
+import asyncio
+import os
+import queue
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.stream_sentence import SentenceCache
+
+_STOP = object()
+
+
+class Counter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeups = 0
+        self.latencies = []
+
+    def wake(self):
+        with self.lock:
+            self.wakeups += 1
+
+    def got(self, sent_at):
+        with self.lock:
+            self.latencies.append((time.perf_counter() - sent_at) * 1000)
+
+
+# ---- 播放队列 ----
+
+def play_polling(q, counter, running):
+    while running.is_set():
+        time.sleep(0.01)
+        counter.wake()
+        if not q.empty():
+            item = q.get()
+            if item is not _STOP:
+                counter.got(item)
+
+
+def play_blocking(q, counter, running):
+    while running.is_set():
+        item = q.get()
+        counter.wake()
+        if item is not _STOP:
+            counter.got(item)
+
+
+def run_queue(consumer, args):
+    counter = Counter()
+    running = threading.Event()
+    running.set()
+    queues = [queue.Queue() for _ in range(args.consumers)]
+    threads = [threading.Thread(target=consumer, args=(q, counter, running), daemon=True) for q in queues]
+    for t in threads:
+        t.start()
+
+    def send(item):
+        queues[0].put(item)
+
+    def stop():
+        running.clear()
+        for q in queues:
+            q.put(_STOP)
+
+    return measure(counter, send, stop, threads, args)
+
+
+# ---- WebSocket 发送协程 ----
+
+class CmdServer:
+    def __init__(self, polling, counter):
+        self.polling = polling
+        self.counter = counter
+        self.list_cmd = []
+        self.running = True
+        self.loop = asyncio.new_event_loop()
+        self.event = None
+
+    def add_cmd(self, item):
+        self.list_cmd.append(item)
+        if not self.polling:
+            self.loop.call_soon_threadsafe(self.event.set)
+
+    def stop(self):
+        self.running = False
+        if not self.polling:
+            self.loop.call_soon_threadsafe(self.event.set)
+
+    async def wait_cmd(self):
+        while self.running and len(self.list_cmd) == 0:
+            self.event.clear()
+            if len(self.list_cmd) > 0:
+                break
+            await self.event.wait()
+
+    async def producer(self):
+        while self.running:
+            if self.polling:
+                await asyncio.sleep(0.01)
+            else:
+                await self.wait_cmd()
+            self.counter.wake()
+            if len(self.list_cmd) > 0:
+                self.counter.got(self.list_cmd.pop(0))
+
+    def serve(self, consumers):
+        asyncio.set_event_loop(self.loop)
+        self.event = asyncio.Event()
+
+        async def main():
+            await asyncio.gather(*(self.producer() for _ in range(consumers)))
+
+        self.loop.run_until_complete(main())
+
+
+def run_ws(polling, args):
+    counter = Counter()
+    server = CmdServer(polling, counter)
+    thread = threading.Thread(target=server.serve, args=(args.consumers,), daemon=True)
+    thread.start()
+    while server.event is None:
+        time.sleep(0.01)
+    return measure(counter, server.add_cmd, server.stop, [thread], args)
+
+
+# ---- 文本流监听 ----
+
+def listen(stream, counter, timeout):
+    while True:
+        sentence = stream.read(timeout=timeout)
+        counter.wake()
+        if sentence:
+            counter.got(sentence)
+        elif stream.closed:
+            break
+
+
+def run_stream(timeout, args):
+    counter = Counter()
+    streams = [SentenceCache(3) for _ in range(args.consumers)]
+    threads = [threading.Thread(target=listen, args=(s, counter, timeout), daemon=True) for s in streams]
+    for t in threads:
+        t.start()
+
+    def stop():
+        for s in streams:
+            s.close()
+
+    return measure(counter, streams[0].write, stop, threads, args)
+
+
+def measure(counter, send, stop, threads, args):
+    time.sleep(0.2)  # 等消费者进入等待状态
+    with counter.lock:
+        counter.wakeups = 0
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    time.sleep(args.seconds)
+    idle_cpu = (time.process_time() - cpu_start) / (time.perf_counter() - wall_start) * 100
+    with counter.lock:
+        wakeups = counter.wakeups / args.seconds
+
+    for _ in range(args.items):
+        send(time.perf_counter())
+        time.sleep(0.013)  # 与 10ms 轮询周期错开
+    time.sleep(0.1)
+
+    stop_at = time.perf_counter()
+    stop()
+    for t in threads:
+        t.join(timeout=3)
+    stop_ms = (time.perf_counter() - stop_at) * 1000
+    assert not any(t.is_alive() for t in threads), "停止后仍有消费者未退出"
+    assert len(counter.latencies) == args.items, f"丢失消息: {len(counter.latencies)}/{args.items}"
+    return idle_cpu, wakeups, statistics.median(counter.latencies), stop_ms
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--consumers", type=int, default=8, help="空闲消费者数量（相当于在线用户数）")
+    parser.add_argument("--seconds", type=float, default=3.0, help="空闲采样时长")
+    parser.add_argument("--items", type=int, default=50)
+    args = parser.parse_args()
+
+    cases = [
+        ("播放队列", "sleep(0.01) 轮询", lambda: run_queue(play_polling, args)),
+        ("播放队列", "Queue.get 阻塞", lambda: run_queue(play_blocking, args)),
+        ("WebSocket 发送", "asyncio.sleep 轮询", lambda: run_ws(True, args)),
+        ("WebSocket 发送", "asyncio.Event 唤醒", lambda: run_ws(False, args)),
+        ("文本流监听", "read(timeout=1.0)", lambda: run_stream(1.0, args)),
+        ("文本流监听", "read(timeout=None)", lambda: run_stream(None, args)),
+    ]
+    print(f"{args.consumers} 个空闲消费者，空闲采样 {args.seconds:.1f} s，投递 {args.items} 条")
+    print(f"  {'消费者':<14}{'等待方式':<22}{'空闲CPU':>8}{'唤醒/秒':>10}{'延迟中位数':>12}{'停止耗时':>10}")
+    for name, label, run in cases:
+        idle_cpu, wakeups, latency_ms, stop_ms = run()
+        print(f"  {name:<14}{label:<22}{idle_cpu:7.2f}%{wakeups:10.1f}{latency_ms:10.2f}ms{stop_ms:8.1f}ms")
+    print("检查通过：所有消费者收齐消息并在停止后退出")
+
+
+if __name__ == "__main__":
+    main()
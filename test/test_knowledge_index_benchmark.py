@@ -0,0 +1,109 @@
+"""
+本地知识库检索基准：对比原来的逐句子串匹配与 llm/knowledge_index.py 的 BM25 倒排索引。
+
+用合成的中英混合语料（--docs 个文件，每个 --sentences 句）构造知识库，
+统计建索引耗时、单次查询耗时，以及修改一个文件后的增量重建耗时。
+
+用法：
+    python test/test_knowledge_index_benchmark.py --docs 200 --sentences 500
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm.knowledge_index import KnowledgeIndex
+
+ASCII_WORDS = "fay gpt api tts asr mcp websocket docker python unity ue5".split()
+
+
+def legacy_search(query, knowledge_base, max_results=3):
+    """原 nlp_cognitive_stream.search_knowledge_base 的实现，仅用于对比。"""
+    results = []
+    query_keywords = re.findall(r'\w+', query.lower())
+    for file_name, content in knowledge_base.items():
+        score = 0
+        matched_sentences = []
+        for sentence in re.split(r'[。！？\n]', content):
+            if not sentence.strip():
+                continue
+            sentence_lower = sentence.lower()
+            sentence_score = sum(1 for keyword in query_keywords if keyword in sentence_lower)
+            if sentence_score > 0:
+                matched_sentences.append((sentence.strip(), sentence_score))
+                score += sentence_score
+        if score > 0:
+            matched_sentences.sort(key=lambda x: x[1], reverse=True)
+            results.append({'file_name': file_name, 'score': score,
+                            'content': '\n'.join(s[0] for s in matched_sentences[:5])})
+    results.sort(key=lambda x: x['score'], reverse=True)
+    return results[:max_results]
+
+
+def make_vocabulary(size, seed=0):
+    """随机生成 size 个二到四字的中文词，按 Zipf 分布取用，近似真实语料的词频。"""
+    rng = random.Random(seed)
+    words = ["".join(chr(rng.randint(0x4e00, 0x4e00 + 3000)) for _ in range(rng.randint(2, 4))) for _ in range(size)]
+    weights = [1.0 / (rank + 1) for rank in range(size)]
+    return words, weights
+
+
+WORDS, WEIGHTS = make_vocabulary(5000)
+
+
+def make_sentence(rng):
+    parts = rng.choices(WORDS, WEIGHTS, k=rng.randint(4, 12))
+    if rng.random() < 0.3:
+        parts.insert(rng.randint(0, len(parts)), rng.choice(ASCII_WORDS))
+    return "".join(parts) + rng.choice("。！？\n")
+
+
+def make_corpus(n_docs, n_sentences, seed=0):
+    rng = random.Random(seed)
+    return {f"doc_{i}.txt": "".join(make_sentence(rng) for _ in range(n_sentences)) for i in range(n_docs)}
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--sentences", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=20)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.docs, args.sentences)
+    total_chars = sum(len(c) for c in corpus.values())
+    print(f"语料: {args.docs} 个文件, {total_chars / 1e6:.1f}M 字符")
+
+    start = time.perf_counter()
+    index = KnowledgeIndex.from_documents(corpus)
+    print(f"建索引: {time.perf_counter() - start:.2f}s, {index.sentence_count} 句")
+
+    rng = random.Random(1)
+    queries = ["".join(rng.choices(WORDS, WEIGHTS, k=3)) + rng.choice(["怎么", "如何"]) + rng.choice(ASCII_WORDS)
+               for _ in range(args.queries)]
+    legacy = timed(lambda: [legacy_search(q, corpus) for q in queries], 1) / len(queries)
+    # 首次查询某个词时才把它的倒排表编译成数组，单独统计
+    cold = timed(lambda: [index.search(q) for q in queries], 1) / len(queries)
+    indexed = timed(lambda: [index.search(q) for q in queries], 5) / len(queries)
+    print(f"原逐句匹配:     {legacy * 1000:9.2f} ms/次")
+    print(f"BM25 索引(冷):  {cold * 1000:9.3f} ms/次")
+    print(f"BM25 索引(热):  {indexed * 1000:9.3f} ms/次  ({legacy / indexed:.0f}x)")
+
+    name = next(iter(corpus))
+    updated = corpus[name] + make_sentence(rng)
+    print(f"单文件增量重建: {timed(lambda: index.update_document(name, updated), 5) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
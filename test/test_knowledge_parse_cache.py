@@ -0,0 +1,86 @@
+"""
+知识库文件解析基准：顺序解析 / 进程池冷启动 / 解析缓存热启动 / 单文件变更后重载。
+
+不指定 --dir 时在临时目录生成 --docs 个 .docx 文件；解析缓存写到临时数据库，
+不影响 cache_data 下的正式缓存。
+
+用法：
+    python test/test_knowledge_parse_cache.py --docs 48 --paragraphs 400
+    python test/test_knowledge_parse_cache.py --dir llm/data
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import config_util as cfg
+from llm import knowledge_loader
+
+
+def make_docs(target_dir, n_docs, n_paragraphs):
+    import docx
+    rng = random.Random(0)
+    for i in range(n_docs):
+        document = docx.Document()
+        for j in range(n_paragraphs):
+            text = "".join(chr(rng.randint(0x4e00, 0x4e00 + 3000)) for _ in range(30))
+            document.add_paragraph(f"{text}。第{j}条说明")
+        document.save(os.path.join(target_dir, f"doc_{i}.docx"))
+
+
+def set_config(cache_path, parse_cache, workers):
+    cfg.config["knowledge_base"] = {"parse_cache": parse_cache, "parse_workers": workers, "cache_path": cache_path}
+    knowledge_loader._parse_cache = None
+
+
+def timed(label, paths):
+    start = time.perf_counter()
+    parsed = knowledge_loader.load_knowledge_files(paths)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {elapsed:8.2f}s  ({len(parsed)} 个文件)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dir", help="知识库目录，默认生成临时 .docx 文件")
+    parser.add_argument("--docs", type=int, default=48)
+    parser.add_argument("--paragraphs", type=int, default=400)
+    args = parser.parse_args()
+
+    if cfg.config is None:
+        cfg.config = {}
+    workdir = tempfile.mkdtemp(prefix="fay_kb_parse_")
+    try:
+        data_dir = args.dir
+        if not data_dir:
+            data_dir = os.path.join(workdir, "data")
+            os.makedirs(data_dir)
+            make_docs(data_dir, args.docs, args.paragraphs)
+        paths = [os.path.join(data_dir, name) for name in sorted(os.listdir(data_dir))
+                 if os.path.isfile(os.path.join(data_dir, name))]
+        cache_path = os.path.join(workdir, "parse_cache.db")
+        print(f"文件数: {len(paths)}, CPU: {os.cpu_count()}")
+
+        set_config(cache_path, False, 1)
+        sequential = timed("顺序解析(无缓存)", paths)
+        set_config(cache_path, True, 0)
+        timed("进程池冷启动", paths)
+        warm = timed("缓存热启动", paths)
+        os.utime(paths[0], None)
+        timed("touch 1 个文件后", paths)
+        with open(paths[-1], "ab") as f:
+            f.write(b"\0")
+        timed("修改 1 个文件后", paths)
+        print(f"热启动相对顺序解析: {sequential / max(warm, 1e-9):.0f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+记忆检索 IVF 近似索引 recall / 延迟基准。
+
+用合成的聚类 embedding（模拟按话题分布的对话记忆）构造 MemoryStream，对比
+精确检索与不同 nprobe 下的近似检索：
+  - recall@n：近似检索返回的节点中，有多少也在精确检索结果里
+  - 单次 retrieve 的平均耗时（焦点向量已预先算好，不含 embedding 请求）
+最后用 --threads 个线程在同一个记忆流上并发 retrieve(stateless=False) 与追加节点
+（多个用户共用记忆流时的情形），检查检索引擎与索引扩容时不会出错。
+
+用法：
+    python test/test_memory_ann_benchmark.py --nodes 50000 --dim 1024
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import config_util as cfg
+from genagents.modules import memory_stream as ms_module
+from genagents.modules.memory_stream import MemoryStream
+
+
+def build_stream(n_nodes, dim, n_topics, noise, seed=0):
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((n_topics, dim)).astype(np.float32)
+    labels = rng.integers(0, n_topics, n_nodes)
+    vectors = topics[labels] + noise * rng.standard_normal((n_nodes, dim)).astype(np.float32)
+    nodes = []
+    embeddings = {}
+    for i in range(n_nodes):
+        content = f"memory-{i}"
+        nodes.append({
+            "node_id": i,
+            "node_type": "observation" if i % 3 else "conversation",
+            "content": content,
+            "importance": int(rng.integers(1, 10)),
+            "created": i,
+            "last_retrieved": int(rng.integers(0, n_nodes)),
+            "pointer_id": None,
+        })
+        embeddings[content] = vectors[i]
+    return MemoryStream(nodes, embeddings), topics
+
+
+def make_queries(topics, n_queries, noise, seed=1):
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, topics.shape[0], n_queries)
+    jitter = noise * rng.standard_normal((n_queries, topics.shape[1])).astype(np.float32)
+    return {f"query-{i}": (topics[t] + jitter[i]).tolist() for i, t in enumerate(picks)}
+
+
+def set_ann(enabled, nprobe=0):
+    cfg.config.setdefault("memory", {})["ann_index"] = {
+        "enabled": enabled, "min_nodes": 0, "nprobe": nprobe}
+
+
+def run(stream, queries, n_count, time_step):
+    results = {}
+    start = time.perf_counter()
+    for query in queries:
+        retrieved = stream.retrieve([query], time_step, n_count=n_count, stateless=True)
+        results[query] = {node.node_id for node in retrieved[query]}
+    return results, (time.perf_counter() - start) / len(queries)
+
+
+def check_concurrent(queries, dim, threads, rounds=200):
+    """多线程同时检索与追加节点，返回各线程抛出的异常列表。"""
+    stream, _ = build_stream(64, dim, 4, 1.0, seed=2)
+    vec = np.asarray(queries[next(iter(queries))], dtype=np.float32)
+    query_list = list(queries)
+    errors = []
+
+    def worker(tid):
+        try:
+            for i in range(rounds):
+                stream.append_prepared_node(i, "observation", f"concurrent-{tid}-{i}", 5, vec)
+                stream.retrieve([query_list[i % len(query_list)]], i, n_count=10, stateless=False)
+        except Exception as e:
+            errors.append(repr(e))
+
+    # 缩短 GIL 切换间隔，让线程更容易在数组扩容中途被切换
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        workers = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+    finally:
+        sys.setswitchinterval(interval)
+    return errors, len(stream.seq_nodes)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--topics", type=int, default=400)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--n-count", type=int, default=30)
+    parser.add_argument("--noise", type=float, default=1.0, help="话题内噪声强度，越大聚类越松散")
+    parser.add_argument("--threads", type=int, default=4, help="并发检索检查的线程数")
+    args = parser.parse_args()
+
+    if cfg.config is None:
+        cfg.config = {}
+    print(f"构造记忆: nodes={args.nodes}, dim={args.dim}, topics={args.topics}")
+    stream, topics = build_stream(args.nodes, args.dim, args.topics, args.noise)
+    queries = make_queries(topics, args.queries, args.noise)
+    # 焦点向量直接查表，排除 embedding 服务的网络开销
+    ms_module.get_text_embedding = lambda text: queries[text]
+
+    set_ann(False)
+    run(stream, list(queries)[:2], args.n_count, args.nodes)  # 预热矩阵
+    exact, exact_latency = run(stream, queries, args.n_count, args.nodes)
+    print(f"精确检索: {exact_latency * 1000:.2f} ms/次")
+
+    set_ann(True)
+    start = time.perf_counter()
+    stream.ensure_ann_index(force=True)
+    print(f"IVF 训练: nlist={stream.ann_index.nlist}, 耗时 {time.perf_counter() - start:.2f}s")
+
+    print(f"{'nprobe':>8} {'recall@' + str(args.n_count):>10} {'ms/次':>8} {'加速':>6}")
+    nlist = stream.ann_index.nlist
+    for nprobe in sorted({1, 2, 4, 8, max(8, nlist // 16), nlist // 4, nlist // 2}):
+        if nprobe <= 0:
+            continue
+        set_ann(True, nprobe)
+        approx, latency = run(stream, queries, args.n_count, args.nodes)
+        recall = np.mean([len(approx[q] & exact[q]) / max(1, len(exact[q])) for q in queries])
+        print(f"{nprobe:>8} {recall:>10.3f} {latency * 1000:>8.2f} {exact_latency / latency:>6.1f}x")
+
+    # 增量维护：追加节点只分配新行
+    vec = np.asarray(queries[next(iter(queries))], dtype=np.float32)
+    start = time.perf_counter()
+    for i in range(200):
+        stream.append_prepared_node(args.nodes + i, "observation", f"appended-{i}", 5, vec)
+    print(f"append_prepared_node (含索引维护): {(time.perf_counter() - start) / 200 * 1000:.3f} ms/条")
+
+    set_ann(False)
+    errors, total = check_concurrent(queries, args.dim, args.threads)
+    assert not errors, f"并发检索出错: {errors[:3]}"
+    print(f"并发检查通过: {args.threads} 线程同时检索与追加，共 {total} 个节点")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+增量分句器（utils/sentence_segmenter.py）与原分句实现的耗时对比。
+
+生成约 10k 字符的中英混排回复（含网址、小数、版本号、缩写），比较：
+  - 原 StreamTextProcessor：每发出一句都用 _find_punctuation_indices 对剩余全文重新查找
+    标点、网址区间与受保护的句点，再切片（代码照搬基线版本；默认取消 max_iterations=100
+    的上限以便切完全文，--baseline-cap 可恢复上限）
+  - 原 LLM 回调（stream_response_chunks 等）：每收到一个 chunk 都对累积文本用
+    _find_last_safe_punct 逐个标点 rfind，切出最后一个标点之前的全部内容
+  - 增量实现：整段一次 feed
+  - 增量实现：按 LLM chunk（默认 4 字符）逐块 feed（现 LLM 回调的路径）
+并检查各种 chunk 大小下切出的句子完全一致、拼接后与原文相同。
+
+用法：
+    python test/test_sentence_segmenter.py --chars 10000 --chunk 4 --rounds 5
+"""
+import argparse
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.sentence_segmenter import SentenceSegmenter
+
+PUNCTUATION_MARKS = ["，", "。", "；", "：", "、", "！", "？", ".", "!", "?", "\n"]
+FRAGMENTS = [
+    "今天的天气不错，适合出去走走。",
+    "这款产品的价格是3.14元，比上个月便宜了0.5元！",
+    "详情请访问 https://example.com/docs?page=2&lang=zh 查看。",
+    "Mr. Smith said the new release v1.2.3 is ready.",
+    "你可以先试试这个方法；如果不行，再告诉我？",
+    "See www.example.org for more, e.g. the FAQ page.",
+    "我们下午三点在会议室见面：记得带上电脑、充电器和笔记本。",
+]
+
+
+class BaselineSplitter:
+    """基线 StreamTextProcessor 的分句逻辑（_safe_process_text 主循环及其辅助方法），只去掉写流部分。"""
+
+    def __init__(self, min_length=10, max_iterations=None):
+        self.min_length = min_length
+        self.max_iterations = max_iterations
+        self.punctuation_mark_set = set(PUNCTUATION_MARKS)
+        self.url_regex_list = [
+            re.compile(
+                r"(?i)\b(?:https?://|ftp://|file://|www\.)[^\s。！？、，；：<>'\"\[\]\(\)\{\}]+"
+            ),
+            re.compile(
+                r"(?i)\b[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?"
+                r"(?:\.[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?)+"
+                r"(?::\d{2,5})?"
+                r"(?:/[^\s。！？、，；：<>'\"\[\]\(\)\{\}]*)?"
+                r"(?:\?[^\s。！？、，；：<>'\"\[\]\(\)\{\}]*)?"
+                r"(?:#[^\s。！？、，；：<>'\"\[\]\(\)\{\}]*)?"
+            ),
+        ]
+
+    def split(self, text):
+        accumulated_text = text
+        sentences = []
+        iteration_count = 0
+        while accumulated_text and (self.max_iterations is None or iteration_count < self.max_iterations):
+            iteration_count += 1
+            punct_indices = self._find_punctuation_indices(accumulated_text)
+            if not punct_indices:
+                break
+            sent_successfully = False
+            for punct_index in punct_indices:
+                sentence_text = accumulated_text[:punct_index + 1]
+                if len(sentence_text) >= self.min_length:
+                    sentences.append(sentence_text)
+                    accumulated_text = accumulated_text[punct_index + 1:]
+                    sent_successfully = True
+                    break
+            if not sent_successfully:
+                break
+        return sentences + ([accumulated_text] if accumulated_text else [])
+
+    def _find_punctuation_indices(self, text):
+        indices = []
+        url_spans = self._find_url_spans(text)
+        for index, ch in enumerate(text):
+            if ch not in self.punctuation_mark_set:
+                continue
+            if self._is_in_spans(index, url_spans):
+                continue
+            if ch == "." and self._is_protected_dot(text, index):
+                continue
+            indices.append(index)
+        return indices
+
+    def _find_url_spans(self, text):
+        spans = []
+        for regex in self.url_regex_list:
+            for match in regex.finditer(text):
+                start, end = match.span()
+                if end > start:
+                    spans.append((start, end))
+        if not spans:
+            return []
+        spans.sort(key=lambda item: item[0])
+        merged = [spans[0]]
+        for start, end in spans[1:]:
+            last_start, last_end = merged[-1]
+            if start <= last_end:
+                merged[-1] = (last_start, max(last_end, end))
+            else:
+                merged.append((start, end))
+        return merged
+
+    @staticmethod
+    def _is_in_spans(index, spans):
+        for start, end in spans:
+            if start <= index < end:
+                return True
+            if index < start:
+                break
+        return False
+
+    def _is_protected_dot(self, text, index):
+        prev_char = text[index - 1] if index > 0 else ""
+        next_char = text[index + 1] if (index + 1) < len(text) else ""
+        if prev_char.isdigit() and next_char.isdigit():
+            return True
+        token = self._extract_token_around(text, index).lower()
+        if not token:
+            return False
+        if "://" in token or token.startswith("www."):
+            return True
+        if re.match(r"^[a-z]*\d+\.\d+(\.\d+)*[a-z]*$", token):
+            return True
+        if re.match(r"^[a-z0-9-]+(\.[a-z0-9-]+)+(/\S*)?$", token):
+            return True
+        return False
+
+    def _extract_token_around(self, text, index):
+        separators = set(" \t\r\n\"'()[]{}<>,!?;:" + "，。！？；：、")
+        left = index
+        right = index + 1
+        while left > 0 and text[left - 1] not in separators:
+            left -= 1
+        while right < len(text) and text[right] not in separators:
+            right += 1
+        return text[left:right]
+
+
+def _find_last_safe_punct(text, punctuation_list):
+    """基线 llm/nlp_cognitive_stream.py 中 LLM 回调使用的切分点查找。"""
+    last_punct_pos = -1
+    for punct in punctuation_list:
+        pos = text.rfind(punct)
+        while pos > 0 and punct == ".":
+            prev_ch = text[pos - 1] if pos > 0 else ""
+            next_ch = text[pos + 1] if pos + 1 < len(text) else ""
+            if prev_ch.isdigit() and next_ch.isdigit():
+                pos = text.rfind(punct, 0, pos)
+            else:
+                break
+        if pos > last_punct_pos:
+            last_punct_pos = pos
+    return last_punct_pos
+
+
+def baseline_llm_split(text, chunk):
+    """基线 stream_response_chunks 的分句方式：每个 chunk 都对累积文本重新 rfind。"""
+    accumulated_text = ""
+    sentences = []
+    for i in range(0, len(text), chunk):
+        accumulated_text += text[i:i + chunk]
+        if len(accumulated_text) >= 20:
+            while True:
+                last_punct_pos = _find_last_safe_punct(accumulated_text, PUNCTUATION_MARKS)
+                if last_punct_pos > 10:
+                    sentences.append(accumulated_text[: last_punct_pos + 1])
+                    accumulated_text = accumulated_text[last_punct_pos + 1:].lstrip()
+                else:
+                    break
+    return sentences + ([accumulated_text] if accumulated_text else [])
+
+
+def build_reply(chars, seed=3):
+    rng = random.Random(seed)
+    parts = []
+    while sum(len(p) for p in parts) < chars:
+        parts.append(rng.choice(FRAGMENTS))
+    return "".join(parts)[:chars]
+
+
+def incremental_split(text, chunk):
+    segmenter = SentenceSegmenter(PUNCTUATION_MARKS)
+    sentences = []
+    for i in range(0, len(text), chunk):
+        sentences.extend(segmenter.feed(text[i:i + chunk]))
+    tail, rest = segmenter.flush()
+    return sentences + tail + ([rest] if rest else [])
+
+
+def timed(fn, rounds):
+    samples = []
+    result = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chars", type=int, default=10000, help="回复长度（字符）")
+    parser.add_argument("--chunk", type=int, default=4, help="模拟 LLM chunk 大小（字符）")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--baseline-cap", action="store_true", help="原实现保留 max_iterations=100 上限")
+    args = parser.parse_args()
+
+    text = build_reply(args.chars)
+    baseline = BaselineSplitter(max_iterations=100 if args.baseline_cap else None)
+    legacy_ms, legacy = timed(lambda: baseline.split(text), args.rounds)
+    llm_ms, llm_legacy = timed(lambda: baseline_llm_split(text, args.chunk), args.rounds)
+    whole_ms, whole = timed(lambda: incremental_split(text, len(text)), args.rounds)
+    chunk_ms, chunked = timed(lambda: incremental_split(text, args.chunk), args.rounds)
+
+    print(f"回复 {len(text)} 字符，{args.rounds} 轮取中位数")
+    print(f"  原 StreamTextProcessor（整段重扫）   {legacy_ms:8.1f} ms  {len(legacy)} 句")
+    print(f"  原 LLM 回调（{args.chunk} 字符/块，每块 rfind） {llm_ms:8.1f} ms  {len(llm_legacy)} 段")
+    print(f"  增量实现（整段）                     {whole_ms:8.1f} ms  {len(whole)} 句")
+    print(f"  增量实现（{args.chunk} 字符/块）               {chunk_ms:8.1f} ms  {len(chunked)} 句")
+    # 增量实现额外保护了英文缩写（Mr. / e.g.），句数与基线不同是预期的
+    assert "".join(legacy) == text, "原实现切分后拼接与原文不一致"
+
+    for size in (1, 2, 3, 7, 64):
+        assert incremental_split(text, size) == whole, f"chunk={size} 时切分结果不一致"
+    assert "".join(whole) == text, "切分后拼接与原文不一致"
+    print("检查通过：不同 chunk 大小切分结果一致")
+
+
+if __name__ == "__main__":
+    main()
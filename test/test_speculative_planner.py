@@ -0,0 +1,111 @@
+"""
+推测式规划的首句耗时（time-to-first-sentence）模拟对比。
+
+用带延迟的假 LLM 流模拟一次闲聊轮次，比较三种流程第一句回复写出的时间：
+  - 串行两次调用：规划器完整返回后再发起直接回复流
+  - 规划器直出：规划器 finish 的 message 边生成边输出（当前默认流程）
+  - 推测并行：直接回复流与规划器同时发出，规划器判定 finish 后冲刷缓冲（llm/speculative_stream.py）
+另外统计判定需要工具时取消推测流的开销。
+
+用法：
+    python test/test_speculative_planner.py --ttft-ms 600 --chunk-ms 30 --rounds 5
+"""
+import argparse
+import os
+import re
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm.speculative_stream import SpeculativeStream
+
+PLANNER_FINISH = '{"action": "finish", "message": "你好呀，今天过得怎么样？有什么想聊的都可以告诉我。"}'
+PLANNER_TOOL = '{"action": "tool", "tool": "kb_search", "keyword": "退货政策"}'
+DIRECT_ANSWER = "你好呀，很高兴见到你！今天过得怎么样？有什么想聊的都可以告诉我，我一直在这儿陪着你。"
+SENTENCE_END = re.compile(r"[，。！？,.!?]")
+
+
+def fake_stream(text, ttft, chunk_delay, chunk_chars=2):
+    time.sleep(ttft)
+    for i in range(0, len(text), chunk_chars):
+        yield text[i:i + chunk_chars]
+        time.sleep(chunk_delay)
+
+
+def first_sentence_time(chunks, start):
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        if SENTENCE_END.search(buffer):
+            return time.perf_counter() - start
+    return time.perf_counter() - start
+
+
+def run_serial(args):
+    start = time.perf_counter()
+    "".join(fake_stream(PLANNER_FINISH, args.ttft, args.chunk))
+    return first_sentence_time(fake_stream(DIRECT_ANSWER, args.ttft, args.chunk), start)
+
+
+def run_planner_direct(args):
+    start = time.perf_counter()
+    accumulated = ""
+    for chunk in fake_stream(PLANNER_FINISH, args.ttft, args.chunk):
+        accumulated += chunk
+        if '"message": "' in accumulated:
+            head = accumulated.split('"message": "', 1)[1]
+            if SENTENCE_END.search(head):
+                return time.perf_counter() - start
+    return time.perf_counter() - start
+
+
+def run_speculative(args, planner_text):
+    start = time.perf_counter()
+    speculative = SpeculativeStream(lambda: fake_stream(DIRECT_ANSWER, args.ttft, args.chunk)).start()
+    decided = threading.Event()
+    verdict = {}
+
+    def planner():
+        accumulated = ""
+        for chunk in fake_stream(planner_text, args.ttft, args.chunk):
+            accumulated += chunk
+            compact = re.sub(r"\s+", "", accumulated)
+            if compact.startswith('{"action":"finish"') or compact.startswith('{"action":"tool"'):
+                verdict.setdefault("value", "finish" if "finish" in compact[:20] else "tool")
+                decided.set()
+        decided.set()
+
+    threading.Thread(target=planner, daemon=True).start()
+    decided.wait()
+    if verdict.get("value") == "tool":
+        speculative.cancel()
+        return time.perf_counter() - start
+    return first_sentence_time(speculative, start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ttft-ms", type=float, default=600.0, help="模拟的首 token 延迟")
+    parser.add_argument("--chunk-ms", type=float, default=30.0, help="模拟的 chunk 间隔")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    args.ttft = args.ttft_ms / 1000
+    args.chunk = args.chunk_ms / 1000
+
+    cases = [
+        ("串行两次调用", lambda: run_serial(args)),
+        ("规划器直出", lambda: run_planner_direct(args)),
+        ("推测并行", lambda: run_speculative(args, PLANNER_FINISH)),
+        ("推测并行-判定工具", lambda: run_speculative(args, PLANNER_TOOL)),
+    ]
+    print(f"TTFT {args.ttft_ms:.0f}ms, chunk {args.chunk_ms:.0f}ms, {args.rounds} 轮")
+    for label, fn in cases:
+        samples = [fn() * 1000 for _ in range(args.rounds)]
+        print(f"{label:<16} 首句/判定耗时 中位数 {statistics.median(samples):7.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+TTS 预合成流水线（core/tts_pipeline.py）的句间静音模拟对比。
+
+用随机延迟模拟一轮流式回复：LLM 每隔 --llm-ms 产出一句，TTS 合成耗时在
+[--synth-min-ms, --synth-max-ms] 之间，每句播放时长在 [--play-min-ms, --play-max-ms] 之间。
+比较两种流程下播放器的句间静音（上一句播完到下一句开始播放）：
+  - 串行：监听线程逐句同步合成后入播放队列（原 FeiFei.say 流程）
+  - 流水线：合成提交到 TTSPipeline，最多同时合成 --lookahead 句，按序交付到播放队列
+并检查流水线交付顺序与句子顺序一致。
+
+用法：
+    python test/test_tts_pipeline.py --sentences 12 --lookahead 3
+"""
+import argparse
+import os
+import queue
+import random
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils.config_util  # noqa: F401  先加载配置模块，避免 utils.util 循环导入
+from core.tts_pipeline import TTSPipeline
+
+_DONE = object()
+
+
+def make_plan(args, seed):
+    rng = random.Random(seed)
+    return [
+        (rng.uniform(args.synth_min_ms, args.synth_max_ms) / 1000, rng.uniform(args.play_min_ms, args.play_max_ms) / 1000)
+        for _ in range(args.sentences)
+    ]
+
+
+def player(play_queue, timeline):
+    while True:
+        item = play_queue.get()
+        if item is _DONE:
+            return
+        index, duration = item
+        start = time.perf_counter()
+        time.sleep(duration)
+        timeline.append((index, start, time.perf_counter()))
+
+
+def run(plan, args, pipelined):
+    play_queue = queue.Queue()
+    timeline = []
+    player_thread = threading.Thread(target=player, args=(play_queue, timeline), daemon=True)
+    player_thread.start()
+    pipeline = TTSPipeline(lookahead=args.lookahead) if pipelined else None
+    finished = threading.Event()
+
+    def synthesize(index):
+        time.sleep(plan[index][0])
+        return index
+
+    def deliver(index):
+        play_queue.put((index, plan[index][1]))
+        if index == len(plan) - 1:
+            finished.set()
+
+    for index in range(len(plan)):
+        time.sleep(args.llm_ms / 1000)  # 等 LLM 产出下一句
+        if pipelined:
+            pipeline.submit(("User", "conv"), index, lambda i=index: synthesize(i), deliver)
+        else:
+            deliver(synthesize(index))
+    finished.wait()
+    play_queue.put(_DONE)
+    player_thread.join()
+
+    order = [index for index, _, _ in timeline]
+    assert order == list(range(len(plan))), f"播放顺序错误: {order}"
+    gaps = [max(0.0, timeline[i][1] - timeline[i - 1][2]) * 1000 for i in range(1, len(timeline))]
+    return gaps, timeline[-1][2] - timeline[0][1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sentences", type=int, default=12)
+    parser.add_argument("--lookahead", type=int, default=3)
+    parser.add_argument("--llm-ms", type=float, default=150.0, help="LLM 产出相邻两句的间隔")
+    parser.add_argument("--synth-min-ms", type=float, default=500.0)
+    parser.add_argument("--synth-max-ms", type=float, default=1400.0)
+    parser.add_argument("--play-min-ms", type=float, default=600.0)
+    parser.add_argument("--play-max-ms", type=float, default=1200.0)
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    plan = make_plan(args, args.seed)
+    print(f"{args.sentences} 句，合成 {args.synth_min_ms:.0f}-{args.synth_max_ms:.0f}ms，"
+          f"播放 {args.play_min_ms:.0f}-{args.play_max_ms:.0f}ms，look-ahead {args.lookahead}")
+    for label, pipelined in (("串行合成", False), ("预合成流水线", True)):
+        gaps, span = run(plan, args, pipelined)
+        print(f"  {label:<8} 句间静音 中位数 {statistics.median(gaps):6.0f} ms  最大 {max(gaps):6.0f} ms  "
+              f"合计 {sum(gaps):6.0f} ms  播放总跨度 {span:5.1f} s")
+    print("检查通过：流水线按句子顺序交付")
+
+
+if __name__ == "__main__":
+    main()
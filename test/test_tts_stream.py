@@ -0,0 +1,135 @@
+"""
+流式 TTS（tts/tts_stream.py）首包时间对比。
+
+用模拟引擎代替真实 TTS：每句音频时长 --audio-ms，合成耗时 --synth-ms，流式引擎把合成
+过程均分为 --pieces 段逐段产出 PCM。比较数字人端收到第一块音频的时间：
+  - 整句文件：to_sample 合成完才返回文件（原流程，以及不支持流式的引擎走的文件回退）
+  - 流式：stream_sample 边合成边产出，按 --chunk-ms 分块回调
+并检查分块拼接后与写出的 wav 数据一致、只有最后一块带 is_last；
+以及被打断、流式中途断开时不会返回残缺音频（complete 为 False 或回退整句合成）。
+
+用法：
+    python test/test_tts_stream.py --sentences 5 --synth-ms 600 --chunk-ms 200
+"""
+import argparse
+import math
+import os
+import statistics
+import struct
+import sys
+import tempfile
+import time
+import wave
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils.config_util  # noqa: F401  先加载配置模块，避免 utils.util 循环导入
+from tts import tts_stream
+
+SAMPLE_RATE = 16000
+
+
+def make_pcm(audio_ms):
+    frames = int(SAMPLE_RATE * audio_ms / 1000)
+    return struct.pack(f'<{frames}h', *(int(6000 * math.sin(i / 15.0)) for i in range(frames)))
+
+
+class FileSpeech:
+    """只有 to_sample 的引擎：合成完成后一次性写出 wav。"""
+
+    def __init__(self, args):
+        self.args = args
+
+    def to_sample(self, text, style):
+        time.sleep(self.args.synth_ms / 1000)
+        file_url = os.path.join(self.args.work_dir, f"sample-{time.time_ns()}.wav")
+        with wave.open(file_url, 'wb') as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(SAMPLE_RATE)
+            wf.writeframes(make_pcm(self.args.audio_ms))
+        return file_url
+
+
+class StreamingSpeech(FileSpeech):
+    """支持 stream_sample 的引擎：合成过程中分段产出 PCM（片段边界故意不按采样对齐）。"""
+    stream_sample_rate = SAMPLE_RATE
+
+    def stream_sample(self, text, style):
+        pcm = make_pcm(self.args.audio_ms)
+        step = len(pcm) // self.args.pieces + 1
+        for start in range(0, len(pcm), step):
+            time.sleep(self.args.synth_ms / 1000 / self.args.pieces)
+            yield pcm[start:start + step]
+
+
+def run(speech, args):
+    first_chunk_ms = []
+    for _ in range(args.sentences):
+        chunks = []
+        start = time.perf_counter()
+
+        def on_chunk(pcm, sample_rate, channels, index, is_last):
+            if not chunks:
+                first_chunk_ms.append((time.perf_counter() - start) * 1000)
+            chunks.append((pcm, index, is_last))
+
+        file_url, streamed, complete = tts_stream.synthesize(speech, "测试句子", None, on_chunk, chunk_ms=args.chunk_ms)
+        with wave.open(file_url, 'rb') as wf:
+            data = wf.readframes(wf.getnframes())
+        os.remove(file_url)  # 流式合成写在 ./samples 下，测完即删
+        sent = len(chunks)
+        assert streamed and complete, "完整合成应标记为 streamed / complete"
+        assert [c[1] for c in chunks] == list(range(sent)), "分块序号错误"
+        assert [c[2] for c in chunks] == [False] * (sent - 1) + [True], "is_last 只能出现在最后一块"
+        assert b"".join(c[0] for c in chunks) == data, "分块拼接与 wav 数据不一致"
+    return first_chunk_ms, sent
+
+
+class BrokenSpeech(StreamingSpeech):
+    """流式合成到第 3 段时连接断开。"""
+
+    def stream_sample(self, text, style):
+        for index, pcm in enumerate(super().stream_sample(text, style)):
+            if index == 3:
+                raise ConnectionError("connection reset")
+            yield pcm
+
+
+def check_incomplete(args):
+    samples_before = set(os.listdir("./samples"))
+    # 用户打断：第 2 块后 on_chunk 返回 False
+    file_url, streamed, complete = tts_stream.synthesize(
+        StreamingSpeech(args), "测试句子", None, lambda pcm, rate, ch, index, is_last: index < 1, chunk_ms=args.chunk_ms)
+    assert file_url is None and not streamed and not complete, "被打断的合成不应返回音频"
+    # 连接中途断开：回退 to_sample 重新合成整句
+    file_url, streamed, complete = tts_stream.synthesize(
+        BrokenSpeech(args), "测试句子", None, lambda *chunk: True, chunk_ms=args.chunk_ms)
+    with wave.open(file_url, 'rb') as wf:
+        duration_ms = wf.getnframes() / wf.getframerate() * 1000
+    assert complete and not streamed and abs(duration_ms - args.audio_ms) < 1, "断流后应回退为完整整句音频"
+    assert set(os.listdir("./samples")) == samples_before, "残缺的流式音频文件没有删除"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sentences", type=int, default=5)
+    parser.add_argument("--audio-ms", type=float, default=2500.0, help="每句音频时长")
+    parser.add_argument("--synth-ms", type=float, default=600.0, help="每句合成耗时")
+    parser.add_argument("--pieces", type=int, default=12, help="流式引擎每句产出的片段数")
+    parser.add_argument("--chunk-ms", type=float, default=200.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="tts_stream_") as work_dir:
+        args.work_dir = work_dir
+        os.makedirs("./samples", exist_ok=True)
+        print(f"{args.sentences} 句，每句音频 {args.audio_ms:.0f} ms，合成 {args.synth_ms:.0f} ms，分块 {args.chunk_ms:.0f} ms")
+        for label, speech in (("整句文件", FileSpeech(args)), ("流式", StreamingSpeech(args))):
+            first_chunk_ms, sent = run(speech, args)
+            print(f"  {label:<6} 首块到达 中位数 {statistics.median(first_chunk_ms):6.0f} ms  每句 {sent} 块")
+        check_incomplete(args)
+    print("检查通过：分块完整、有序且与音频文件一致；打断与断流不产生残缺音频")
+
+
+if __name__ == "__main__":
+    main()
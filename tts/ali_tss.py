@@ -16,6 +16,9 @@ _ssl_context.check_hostname = False
 _ssl_context.verify_mode = ssl.CERT_NONE
 
 class Speech:
+    # stream_sample 产出的 PCM 采样率
+    stream_sample_rate = 16000
+
     def __init__(self):
         self.key_ali_nls_key_id = cfg.key_ali_tss_key_id
         self.key_ali_nls_key_secret = cfg.key_ali_tss_key_secret
@@ -113,7 +116,7 @@ class Speech:
                 contentType = response.getheader('Content-Type')
                 body = response.read()
                 if contentType and 'audio' in contentType : 
-                    file_url = './samples/sample-' + str(int(time.time() * 1000)) + '.wav'
+                    file_url = './samples/sample-' + str(int(time.time() * 1000)) + '-' + util.random_hex(6) + '.wav'
                     with open(file_url, 'wb') as f:
                         f.write(body)
                 
@@ -136,6 +139,28 @@ class Speech:
                 return file_url
 
 
+    def stream_sample(self, text, style):
+        """流式合成：服务端边合成边以分块传输返回 PCM，逐块产出。"""
+        self.set_token()
+        if self.token is None:
+            raise RuntimeError("阿里云tts对接有误")
+        host = 'nls-gateway-cn-shanghai.aliyuncs.com'
+        body = {'appkey': self.ali_nls_app_key, 'token': self.token, 'speech_rate': 0, 'text': text, 'format': 'pcm', 'sample_rate': self.stream_sample_rate, 'voice': config_util.config["attribute"]["voice"]}
+        conn = http.client.HTTPSConnection(host, context=_ssl_context)
+        try:
+            conn.request(method='POST', url='/stream/v1/tts', body=json.dumps(body), headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            contentType = response.getheader('Content-Type')
+            if not contentType or 'audio' not in contentType:
+                raise RuntimeError(str(response.read()))
+            while True:
+                chunk = response.read1(4096)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            conn.close()
+
     def close(self):
        pass
 
@@ -20,7 +20,7 @@ class Speech:
     }
         try:
             response = requests.post(url, json=data)
-            file_url = './samples/sample-' + str(int(time.time() * 1000)) + '.wav'
+            file_url = './samples/sample-' + str(int(time.time() * 1000)) + '-' + util.random_hex(6) + '.wav'
             if response.status_code == 200:
                 with wave.open(file_url, 'wb') as wf:
                         wf.setnchannels(1)
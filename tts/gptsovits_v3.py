@@ -1,11 +1,13 @@
-import requests
 import time
 from utils import util
+from utils import http_pool
 import wave
 class Speech:
+    # stream_sample 产出的 PCM 采样率，与 to_sample 写出的 wav 一致
+    stream_sample_rate = 32000
 
     def __init__(self):
-         pass
+         self.url = "http://127.0.0.1:9880/tts"
 
     def connect(self):
         pass
@@ -14,9 +16,8 @@ class Speech:
     def close(self):
        pass
 
-    def to_sample(self, text, style) :    
-        url = "http://127.0.0.1:9880/tts"
-        data = {
+    def __build_request(self, text):
+        return {
         "text": text,                   # str.(required) text to be synthesized
         "text_lang": "zh",              # str.(required) language of the text to be synthesized
         "ref_audio_path": "I:/GPT-SoVITS-beta0706/111.wav",         # str.(required) reference audio path.
@@ -37,9 +38,28 @@ class Speech:
         "parallel_infer": True,       # bool.(optional) whether to use parallel inference.
         "repetition_penalty": 1.35    # float.(optional) repetition penalty for T2S model.
     }
+
+    def stream_sample(self, text, style):
+        """流式合成：streaming_mode 下服务端按片段返回原始 PCM，逐块产出。"""
+        data = self.__build_request(text)
+        data["media_type"] = "raw"
+        data["streaming_mode"] = True
+        response = http_pool.post(self.url, json=data, stream=True)
+        try:
+            if response.status_code != 200:
+                raise RuntimeError(response.text)
+            for chunk in response.iter_content(chunk_size=4096):
+                if chunk:
+                    yield chunk
+        finally:
+            response.close()
+
+    def to_sample(self, text, style) :    
+        url = self.url
+        data = self.__build_request(text)
         try:
-            response = requests.post(url, json=data)
-            file_url = './samples/sample-' + str(int(time.time() * 1000)) + '.wav'
+            response = http_pool.post(url, json=data)
+            file_url = './samples/sample-' + str(int(time.time() * 1000)) + '-' + util.random_hex(6) + '.wav'
             if response.status_code == 200:
                 with wave.open(file_url, 'wb') as wf:
                         wf.setnchannels(1)
@@ -83,7 +83,7 @@ class Speech:
             result = self.__synthesizer.speak_text_async(text).get()
             # result = self.__synthesizer.speak_ssml(ssml)#感觉使用sepak_text_async要快很多
             audio_data_stream = speechsdk.AudioDataStream(result)
-            file_url = './samples/sample-' + str(int(time.time() * 1000)) + '.wav'
+            file_url = './samples/sample-' + str(int(time.time() * 1000)) + '-' + util.random_hex(6) + '.wav'
             audio_data_stream.save_to_wav_file(file_url)
             if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
                 wav_url = file_url
@@ -109,7 +109,7 @@ class Speech:
                    '</voice>' \
                    '</speak>'.format(voice_name, style, 1.8, text)
             try:
-                file_url = './samples/sample-' + str(int(time.time() * 1000)) + '.mp3'
+                file_url = './samples/sample-' + str(int(time.time() * 1000)) + '-' + util.random_hex(6) + '.mp3'
                 asyncio.new_event_loop().run_until_complete(self.get_edge_tts(text,voice_name,file_url))
                 wav_url = self.convert_mp3_to_wav(file_url)
                 self.__history_data.append((voice_name, style, text, wav_url))
@@ -0,0 +1,172 @@
+"""
+流式 TTS：边合成边把 PCM 分块交给调用方，同时写出完整音频文件。
+
+支持流式的引擎实现 stream_sample(text, style)，逐块产出 16 位小端单声道 PCM，
+并提供 stream_sample_rate 属性；其余引擎仍调用 to_sample 得到完整文件，再按块读出
+WAV 数据（文件回退，首包时间不变，但客户端只需处理一种消息）。非 PCM 的音频（如 mp3）
+不分块，由调用方按原流程整句发送。
+
+on_chunk(pcm, sample_rate, channels, index, is_last) 返回 False 时停止合成（用户打断）。
+被打断或合成中途出错时不会返回残缺的音频文件：打断直接返回 None，出错则回退到 to_sample
+重新合成整句，调用方只应缓存 complete 为 True 的结果。
+
+配置（config.json 的 tts_stream，可选）：
+  enabled    是否向数字人端推送分块音频
+  chunk_ms   每块音频时长（毫秒）
+"""
+import os
+import sys
+import time
+import wave
+
+from utils import util
+
+DEFAULT_CONFIG = {
+    "enabled": True,
+    "chunk_ms": 200,
+}
+
+_SAMPLE_WIDTH = 2
+
+
+def load_config():
+    conf = dict(DEFAULT_CONFIG)
+    cfg = sys.modules.get("utils.config_util")
+    try:
+        if cfg is not None and cfg.config:
+            conf.update(cfg.config.get("tts_stream", {}) or {})
+    except Exception:
+        pass
+    return conf
+
+
+def supports_streaming(speech):
+    return callable(getattr(speech, "stream_sample", None))
+
+
+class _ChunkEmitter:
+    """把任意大小的 PCM 片段整理成固定时长的块；留住最后一块，结束时带 is_last 发出。"""
+
+    def __init__(self, on_chunk, sample_rate, channels, chunk_ms):
+        self.on_chunk = on_chunk
+        self.sample_rate = sample_rate
+        self.channels = channels
+        frame_bytes = _SAMPLE_WIDTH * channels
+        self.chunk_bytes = max(frame_bytes, int(sample_rate * chunk_ms / 1000) * frame_bytes)
+        self.frame_bytes = frame_bytes
+        self.buffer = bytearray()
+        self.held = None
+        self.index = 0
+        self.stopped = False
+
+    def _emit(self, pcm, is_last):
+        if self.on_chunk(pcm, self.sample_rate, self.channels, self.index, is_last) is False:
+            self.stopped = True
+        self.index += 1
+
+    def feed(self, pcm):
+        self.buffer += pcm
+        while len(self.buffer) >= self.chunk_bytes and not self.stopped:
+            chunk = bytes(self.buffer[:self.chunk_bytes])
+            del self.buffer[:self.chunk_bytes]
+            if self.held is not None:
+                self._emit(self.held, False)
+            self.held = chunk
+        return not self.stopped
+
+    def close(self):
+        if self.stopped:
+            return
+        # 丢掉不足一帧的尾部字节（流式响应可能在采样中间断开）
+        tail = bytes(self.buffer[:len(self.buffer) - len(self.buffer) % self.frame_bytes])
+        self.buffer.clear()
+        if self.held is not None and tail:
+            self._emit(self.held, False)
+            self.held = tail
+        elif tail:
+            self.held = tail
+        if self.held is not None:
+            self._emit(self.held, True)
+            self.held = None
+
+
+def _new_sample_path():
+    return './samples/sample-' + str(int(time.time() * 1000)) + '-' + util.random_hex(6) + '.wav'
+
+
+def _synthesize_streaming(speech, text, style, on_chunk, chunk_ms):
+    """返回 (文件路径, 已发出的块数, 是否被打断)；只有引擎正常产出完整句子时才返回文件路径。"""
+    sample_rate = int(getattr(speech, "stream_sample_rate", 16000))
+    emitter = _ChunkEmitter(on_chunk, sample_rate, 1, chunk_ms)
+    file_url = _new_sample_path()
+    written = 0
+    finished = False
+    with wave.open(file_url, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(_SAMPLE_WIDTH)
+        wf.setframerate(sample_rate)
+        try:
+            for pcm in speech.stream_sample(text, style):
+                if not pcm:
+                    continue
+                wf.writeframes(pcm)
+                written += len(pcm)
+                if not emitter.feed(pcm):
+                    break
+            else:
+                finished = True
+        except Exception as e:
+            util.log(1, f"[x] 流式语音合成中断: {e}")
+    if finished:
+        emitter.close()
+    if not finished or written < _SAMPLE_WIDTH:
+        # 被打断或中途出错的残缺音频不能播放也不能进缓存
+        try:
+            os.remove(file_url)
+        except OSError:
+            pass
+        return None, emitter.index, emitter.stopped
+    return file_url, emitter.index, False
+
+
+def _emit_file_chunks(file_url, on_chunk, chunk_ms):
+    """文件回退：把整句 WAV 的数据按块读出，返回整句是否都已分块发出；非 16 位 PCM WAV 不分块。"""
+    try:
+        with wave.open(file_url, 'rb') as wf:
+            if wf.getsampwidth() != _SAMPLE_WIDTH:
+                return False
+            emitter = _ChunkEmitter(on_chunk, wf.getframerate(), wf.getnchannels(), chunk_ms)
+            frames_per_chunk = max(1, emitter.chunk_bytes // emitter.frame_bytes)
+            while True:
+                pcm = wf.readframes(frames_per_chunk)
+                if not pcm or not emitter.feed(pcm):
+                    break
+            emitter.close()
+            return emitter.index > 0 and not emitter.stopped
+    except (wave.Error, EOFError, OSError):
+        return False
+
+
+def synthesize(speech, text, style, on_chunk, chunk_ms=None):
+    """
+    合成一句并分块回调 on_chunk，返回 (音频文件路径, streamed, complete)：
+      streamed  整句音频都已通过分块发出（最后一块带 is_last）
+      complete  文件是完整的整句音频，可以缓存
+    用户打断时返回 (None, False, False)。流式引擎中途出错时回退到 to_sample 重新合成整句；
+    若出错前已发出部分分块，不再重复分块，streamed 为 False，由整句消息补播。
+    """
+    if chunk_ms is None:
+        chunk_ms = float(load_config().get("chunk_ms", 200))
+    sent = 0
+    if supports_streaming(speech):
+        file_url, sent, stopped = _synthesize_streaming(speech, text, style, on_chunk, chunk_ms)
+        if file_url is not None:
+            return file_url, sent > 0, True
+        if stopped:
+            return None, False, False
+    file_url = speech.to_sample(text, style)
+    if not file_url:
+        return None, False, False
+    if sent or not str(file_url).lower().endswith('.wav'):
+        return file_url, False, True
+    return file_url, _emit_file_chunks(file_url, on_chunk, chunk_ms), True
@@ -1,9 +1,9 @@
 import base64
 import json
 import uuid
-import requests
 import time
 from utils import util, config_util
+from utils import http_pool
 from utils import config_util as cfg
 import wave
 
@@ -63,10 +63,10 @@ class Speech:
 
                 }
             }
-            response = requests.post(api_url, json.dumps(request_json), headers=header)
+            response = http_pool.post(api_url, json.dumps(request_json), headers=header)
             if "data" in response.json():
                 data = response.json()["data"]
-                file_url = './samples/sample-' + str(int(time.time() * 1000)) + '.wav'
+                file_url = './samples/sample-' + str(int(time.time() * 1000)) + '-' + util.random_hex(6) + '.wav'
                 with wave.open(file_url, 'wb') as wf:
                         wf.setnchannels(1)
                         wf.setsampwidth(2)
@@ -1,10 +1,11 @@
 import logging
 import re
-import requests
 from typing import List, Optional
 import threading
+import time
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 # 添加项目根目录到路径
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -18,6 +19,9 @@ except ImportError as e:
     CONFIG_UTIL_AVAILABLE = False
     cfg = None
 
+from utils.embedding_cache import get_embedding_cache, get_cache_stats
+from utils import http_pool
+
 logger = logging.getLogger(__name__)
 
 if not CONFIG_UTIL_AVAILABLE:
@@ -30,6 +34,118 @@ def _sanitize_text(text: str) -> str:
     cleaned = re.sub(r'</?think>', '', cleaned, flags=re.IGNORECASE)
     return cleaned
 
+# 请求合并默认配置，可在 config.json 的 embedding_batch 中覆盖：
+#   max_batch_size   单次 /embeddings 请求最多合并的文本数，<= 1 表示不合并
+#   max_wait_ms      第一条请求到达后最多等待多久收集同批请求
+#   max_concurrency  同时在途的批量请求数
+BATCH_DEFAULTS = {"max_batch_size": 16, "max_wait_ms": 5, "max_concurrency": 4}
+
+
+class _PendingEmbedding:
+    __slots__ = ("text", "event", "result", "error")
+
+    def __init__(self, text):
+        self.text = text
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class EmbeddingBatcher:
+    """
+    把并发的单条 encode_text 请求合并成一次批量 /embeddings 调用。
+
+    第一条请求到达后最多等待 max_wait_ms 收集后续请求，凑满 max_batch_size
+    立即发出；同一批内相同文本只请求一次。批量请求在线程池中执行，最多
+    max_concurrency 批同时在途；批量请求失败时逐条重试，只有出错的文本
+    对应的调用方会收到异常。
+    """
+
+    def __init__(self, dispatch, max_batch_size=16, max_wait_ms=5, max_concurrency=4):
+        self._dispatch = dispatch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._cond = threading.Condition()
+        self._pending = []
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(max_concurrency)),
+                                            thread_name_prefix="embedding-batch")
+        self._collector = None
+        self.batches = 0
+        self.requests = 0
+
+    def submit(self, text: str) -> List[float]:
+        item = _PendingEmbedding(text)
+        with self._cond:
+            self._pending.append(item)
+            if self._collector is None:
+                self._collector = threading.Thread(target=self._collect_loop,
+                                                   name="embedding-batch-collector", daemon=True)
+                self._collector.start()
+            self._cond.notify_all()
+        item.event.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _collect_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.max_wait
+                while len(self._pending) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch_size]
+                del self._pending[:self.max_batch_size]
+            self._executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch):
+        texts = list(dict.fromkeys(item.text for item in batch))
+        errors = {}
+        try:
+            try:
+                by_text = dict(zip(texts, self._dispatch(texts)))
+            except Exception as e:
+                if len(texts) == 1:
+                    raise
+                # 批量失败时逐条重试，避免一条坏输入拖累同批其他请求
+                logger.warning(f"批量 embedding 失败，逐条重试 {len(texts)} 个文本: {e}")
+                by_text = {}
+                for text in texts:
+                    try:
+                        by_text[text] = self._dispatch([text])[0]
+                    except Exception as item_error:
+                        errors[text] = item_error
+            delivered = set()
+            for item in batch:
+                if item.text in errors:
+                    item.error = errors[item.text]
+                    continue
+                embedding = by_text[item.text]
+                # 同批重复文本各自拿一份拷贝，避免调用方互相修改
+                item.result = embedding if item.text not in delivered else list(embedding)
+                delivered.add(item.text)
+        except Exception as e:
+            for item in batch:
+                if item.result is None and item.error is None:
+                    item.error = e
+        finally:
+            self.batches += 1
+            self.requests += len(batch)
+            for item in batch:
+                item.event.set()
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+        }
+
+
 class ApiEmbeddingService:
     """API Embedding服务 - 单例模式，调用 OpenAI 兼容的 API"""
 
@@ -109,6 +225,7 @@ class ApiEmbeddingService:
             self.embedding_dim = None  # 将在首次调用时动态获取
             self.timeout = 60  # API 请求超时时间（秒），默认 60 秒
             self.max_retries = 2  # 最大重试次数
+            self._batcher = None  # 请求合并器，首次 encode_text 时按配置创建
 
             logger.info(f"API Embedding 服务初始化完成")
             logger.info(f"模型: {self.model_name}")
@@ -118,12 +235,57 @@ class ApiEmbeddingService:
             logger.error(f"API Embedding 服务初始化失败: {e}")
             raise
 
-    def encode_text(self, text: str) -> List[float]:
-        """编码单个文本（带重试机制）"""
-        import time
+    def encode_text(self, text: str, use_cache: bool = True) -> List[float]:
+        """编码单个文本（带重试机制），默认先查 embedding 缓存，未命中时经批处理器合并请求"""
+        text = _sanitize_text(text)
+        cache = get_embedding_cache() if use_cache else None
+        if cache is not None:
+            cached = cache.get(self.model_name, text)
+            if cached is not None:
+                if self.embedding_dim is None:
+                    self.embedding_dim = len(cached)
+                return cached
+
+        batcher = self._get_batcher()
+        if batcher is not None:
+            embedding = batcher.submit(text)
+        else:
+            embedding = self._request_embeddings([text])[0]
+        if cache is not None:
+            cache.put(self.model_name, text, embedding)
+        return embedding
+
+    def _get_batcher(self):
+        """按配置懒创建批处理器；max_batch_size <= 1 时不合并，直接逐条请求。"""
+        if self._batcher is None:
+            with self._lock:
+                if self._batcher is None:
+                    conf = dict(BATCH_DEFAULTS)
+                    try:
+                        if CONFIG_UTIL_AVAILABLE and cfg and cfg.config:
+                            conf.update(cfg.config.get('embedding_batch', {}) or {})
+                    except Exception:
+                        pass
+                    if int(conf.get('max_batch_size', 1)) > 1:
+                        self._batcher = EmbeddingBatcher(
+                            self._request_embeddings,
+                            max_batch_size=int(conf['max_batch_size']),
+                            max_wait_ms=float(conf.get('max_wait_ms', 0)),
+                            max_concurrency=int(conf.get('max_concurrency', 4)),
+                        )
+                    else:
+                        self._batcher = False
+        return self._batcher or None
+
+    def _request_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        向 /embeddings 发送一次请求（带重试机制），返回与 texts 一一对应的向量。
+        单条文本时 input 仍以字符串发送，兼容只接受字符串的服务。
+        """
         import requests.exceptions
 
-        text = _sanitize_text(text)
+        count = len(texts)
+        text_len = sum(len(t) for t in texts)
         last_error = None
         for attempt in range(self.max_retries + 1):
             try:
@@ -135,34 +297,38 @@ class ApiEmbeddingService:
                 }
                 payload = {
                     "model": self.model_name,
-                    "input": text
+                    "input": texts[0] if count == 1 else texts
                 }
 
                 # 记录请求信息
-                text_preview = text[:50] + "..." if len(text) > 50 else text
-                logger.info(f"发送 embedding 请求 (尝试 {attempt + 1}/{self.max_retries + 1}): 文本长度={len(text)}, 预览='{text_preview}'")
+                text_preview = texts[0][:50] + "..." if len(texts[0]) > 50 else texts[0]
+                logger.info(f"发送 embedding 请求 (尝试 {attempt + 1}/{self.max_retries + 1}): 文本数={count}, 文本长度={text_len}, 预览='{text_preview}'")
 
-                response = requests.post(url, json=payload, headers=headers, timeout=self.timeout)
+                response = http_pool.post(url, json=payload, headers=headers, timeout=self.timeout)
                 response.raise_for_status()
 
                 result = response.json()
-                embedding = result['data'][0]['embedding']
-
-                # 首次调用时获取实际维度
-                if self.embedding_dim is None:
-                    self.embedding_dim = len(embedding)
-                    logger.info(f"动态获取 embedding 维度: {self.embedding_dim}")
-                else:
-                    # 检查维度一致性
-                    current_dim = len(embedding)
-                    if current_dim != self.embedding_dim:
-                        logger.warning(f"⚠️  Embedding维度不一致! 期望={self.embedding_dim}, 实际={current_dim}, 文本='{text_preview}'")
-                        logger.warning(f"   建议检查API配置或模型设置")
-                        # 更新维度记录
-                        self.embedding_dim = current_dim
-
-                logger.info(f"embedding 生成成功")
-                return embedding
+                data = sorted(result['data'], key=lambda item: item.get('index', 0))
+                embeddings = [item['embedding'] for item in data]
+                if len(embeddings) != count:
+                    raise ValueError(f"embedding 返回条数不一致: 请求={count}, 返回={len(embeddings)}")
+
+                for i, embedding in enumerate(embeddings):
+                    # 首次调用时获取实际维度
+                    if self.embedding_dim is None:
+                        self.embedding_dim = len(embedding)
+                        logger.info(f"动态获取 embedding 维度: {self.embedding_dim}")
+                    else:
+                        # 检查维度一致性
+                        current_dim = len(embedding)
+                        if current_dim != self.embedding_dim:
+                            logger.warning(f"⚠️  Embedding维度不一致! 期望={self.embedding_dim}, 实际={current_dim}, 文本='{texts[i][:50]}'")
+                            logger.warning(f"   建议检查API配置或模型设置")
+                            # 更新维度记录
+                            self.embedding_dim = current_dim
+
+                logger.info(f"embedding 生成成功: {count} 个向量")
+                return embeddings
 
             except requests.exceptions.Timeout as e:
                 last_error = e
@@ -172,7 +338,7 @@ class ApiEmbeddingService:
                     logger.info(f"等待 {wait_time} 秒后重试...")
                     time.sleep(wait_time)
                 else:
-                    logger.error(f"所有重试均失败，文本长度: {len(text)}")
+                    logger.error(f"所有重试均失败，文本数: {count}, 文本长度: {text_len}")
                     raise
 
             except requests.exceptions.ConnectionError as e:
@@ -221,6 +387,16 @@ class ApiEmbeddingService:
         """批量编码文本"""
         try:
             texts = [_sanitize_text(text) for text in texts]
+            # 先查缓存，只把未命中的文本发给 API
+            cache = get_embedding_cache()
+            results = [None] * len(texts)
+            if cache is not None:
+                results = [cache.get(self.model_name, text) for text in texts]
+            missing = [i for i, emb in enumerate(results) if emb is None]
+            if not missing:
+                logger.info(f"批量 embedding 全部命中缓存: {len(texts)} 个向量")
+                return results
+            texts = [texts[i] for i in missing]
             # 调用 API 进行批量编码
             url = f"{self.api_base_url}/embeddings"
             headers = {
@@ -235,7 +411,7 @@ class ApiEmbeddingService:
             # 批量请求使用更长的超时时间
             batch_timeout = self.timeout * 2  # 批量请求超时时间加倍
             logger.info(f"发送批量 embedding 请求: 文本数={len(texts)}, 超时={batch_timeout}秒")
-            response = requests.post(url, json=payload, headers=headers, timeout=batch_timeout)
+            response = http_pool.post(url, json=payload, headers=headers, timeout=batch_timeout)
             response.raise_for_status()
 
             result = response.json()
@@ -263,7 +439,13 @@ class ApiEmbeddingService:
                         logger.info(f"从批量请求动态获取 embedding 维度: {self.embedding_dim}")
 
             logger.info(f"批量 embedding 生成成功: {len(embeddings)} 个向量")
-            return embeddings
+            if len(embeddings) != len(texts):
+                raise ValueError(f"批量 embedding 返回条数不一致: 请求={len(texts)}, 返回={len(embeddings)}")
+            if cache is not None:
+                cache.put_many(self.model_name, texts, embeddings)
+            for i, emb in zip(missing, embeddings):
+                results[i] = emb
+            return results
         except Exception as e:
             logger.error(f"批量文本编码失败: {e}")
             raise
@@ -275,7 +457,9 @@ class ApiEmbeddingService:
             "embedding_dim": self.embedding_dim,
             "api_base_url": self.api_base_url,
             "initialized": self._initialized,
-            "service_type": "api"
+            "service_type": "api",
+            "cache": get_cache_stats(),
+            "batch": self._batcher.stats() if self._batcher else None
         }
 
     def health_check(self) -> dict:
@@ -283,7 +467,7 @@ class ApiEmbeddingService:
         try:
             # 使用简单文本测试服务
             test_text = "health_check"
-            embedding = self.encode_text(test_text)
+            embedding = self.encode_text(test_text, use_cache=False)
             
             return {
                 "status": "healthy",
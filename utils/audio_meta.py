@@ -0,0 +1,173 @@
+"""
+只读文件头获取音频时长，不做解码。
+
+  - WAV：用 wave 模块读取帧数与采样率；wave 不支持的编码（如浮点 PCM）按 RIFF 块解析
+    fmt 的 byte_rate 与 data 块大小
+  - MP3：跳过 ID3v2 标签，解析第一帧帧头；有 Xing/Info 或 VBRI 头时直接用其中的总帧数，
+    否则沿帧头逐帧跳转累加（只读 4 字节帧头，不解码音频数据）
+
+无法识别的文件返回 None，由调用方自行回退（例如用 pydub 解码）。
+"""
+import os
+import struct
+import wave
+from typing import Optional
+
+# MPEG 版本位：0 = MPEG 2.5，2 = MPEG 2，3 = MPEG 1（1 保留）
+_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    0: (11025, 12000, 8000),
+}
+
+# 比特率表（kbps），键为 (是否 MPEG 1, layer)，layer 取 1/2/3
+_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+
+def get_duration(file_path) -> Optional[float]:
+    """返回音频时长（秒）；不是可识别的 WAV/MP3 时返回 None。"""
+    if not file_path:
+        return None
+    try:
+        with open(file_path, 'rb') as f:
+            head = f.read(12)
+            f.seek(0)
+            if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+                return _wav_duration(f)
+            if head[:3] == b'ID3' or (len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+                return _mp3_duration(f.read())
+    except (OSError, EOFError, struct.error, wave.Error):
+        return None
+    return None
+
+
+def _wav_duration(f) -> Optional[float]:
+    try:
+        with wave.open(f, 'rb') as wav_file:
+            rate = wav_file.getframerate()
+            frames = wav_file.getnframes()
+            block_align = wav_file.getsampwidth() * wav_file.getnchannels()
+        # 流式写出的 WAV 可能把 data 大小写成 0 或 0xFFFFFFFF，此时交给 RIFF 解析按文件大小估算
+        f.seek(0, os.SEEK_END)
+        if rate > 0 and 0 < frames * block_align <= f.tell():
+            return frames / float(rate)
+    except (wave.Error, EOFError):
+        pass
+    f.seek(0)
+    return _riff_duration(f)
+
+
+def _riff_duration(f) -> Optional[float]:
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    f.seek(12)
+    byte_rate = 0
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return None
+        chunk_id, chunk_size = chunk[:4], struct.unpack('<I', chunk[4:])[0]
+        if chunk_id == b'fmt ':
+            fmt = f.read(min(chunk_size, 16))
+            if len(fmt) < 12:
+                return None
+            byte_rate = struct.unpack('<I', fmt[8:12])[0]
+            f.seek(chunk_size - len(fmt) + (chunk_size & 1), os.SEEK_CUR)
+        elif chunk_id == b'data':
+            if not byte_rate:
+                return None
+            data_size = min(chunk_size, file_size - f.tell())
+            return data_size / float(byte_rate)
+        else:
+            f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+
+def _parse_frame_header(data, pos):
+    """解析 pos 处的 MPEG 音频帧头，返回 (帧长字节, 每帧采样数, 采样率, 版本, 声道模式)，无效时返回 None。"""
+    if pos + 4 > len(data) or data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+        return None
+    b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+    version = (b1 >> 3) & 0x03
+    layer = 4 - ((b1 >> 1) & 0x03)
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 0x03
+    # 保留值以及自由比特率（索引 0）无法从帧头算出帧长
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = _BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 0x01
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate, version, b3 >> 6
+    if layer == 3 and not mpeg1:
+        return 72 * bitrate // sample_rate + padding, 576, sample_rate, version, b3 >> 6
+    return 144 * bitrate // sample_rate + padding, 1152, sample_rate, version, b3 >> 6
+
+
+def _vbr_frame_count(data, pos, version, channel_mode):
+    """读取第一帧中的 Xing/Info 或 VBRI 头记录的总帧数（不含该信息帧本身）。"""
+    mono = channel_mode == 3
+    if version == 3:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    xing = pos + 4 + side_info
+    if data[xing:xing + 4] in (b'Xing', b'Info'):
+        flags = struct.unpack('>I', data[xing + 4:xing + 8])[0]
+        if flags & 0x01:
+            return struct.unpack('>I', data[xing + 8:xing + 12])[0]
+        return None
+    vbri = pos + 4 + 32
+    if data[vbri:vbri + 4] == b'VBRI':
+        return struct.unpack('>I', data[vbri + 14:vbri + 18])[0]
+    return None
+
+
+def _skip_id3v2(data):
+    pos = 0
+    # 个别文件会连续带多个 ID3v2 标签
+    while data[pos:pos + 3] == b'ID3' and len(data) >= pos + 10:
+        size = (data[pos + 6] << 21) | (data[pos + 7] << 14) | (data[pos + 8] << 7) | data[pos + 9]
+        footer = 10 if data[pos + 5] & 0x10 else 0
+        pos += 10 + size + footer
+    return pos
+
+
+def _mp3_duration(data) -> Optional[float]:
+    pos = _skip_id3v2(data)
+    # 找第一帧：要求紧随其后的位置也是合法帧头，避免把数据中的 0xFF 误判为同步字
+    header = None
+    while pos + 4 <= len(data):
+        pos = data.find(b'\xFF', pos)
+        if pos < 0:
+            return None
+        header = _parse_frame_header(data, pos)
+        if header is not None:
+            next_pos = pos + header[0]
+            if next_pos + 4 > len(data) or _parse_frame_header(data, next_pos) is not None:
+                break
+        header = None
+        pos += 1
+    if header is None:
+        return None
+
+    frame_length, samples_per_frame, sample_rate, version, channel_mode = header
+    frame_count = _vbr_frame_count(data, pos, version, channel_mode)
+    if frame_count:
+        return frame_count * samples_per_frame / float(sample_rate)
+
+    # 没有 VBR 信息头：逐帧跳转累加采样数，遇到非帧数据（如结尾的 ID3v1 标签）即停止
+    samples = 0
+    while header is not None:
+        samples += header[1]
+        pos += header[0]
+        header = _parse_frame_header(data, pos)
+    return samples / float(sample_rate)
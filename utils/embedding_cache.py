@@ -0,0 +1,258 @@
+"""
+进程级 embedding 缓存。
+
+键为 sha1(模型名 + 归一化文本)，两级存储：
+  - 内存：OrderedDict 实现的 LRU，值为 float32 数组，按条数上限淘汰
+  - 磁盘：SQLite（cache_data/embedding_cache.db，WAL 模式，可被多个进程共享），
+    按最近使用时间淘汰到条数上限
+
+ApiEmbeddingService.encode_text / encode_texts 与 /v1/embeddings 透传接口都先查缓存，
+所以 get_text_embedding、记忆检索、MCP 知识库服务等调用方无需改动即可命中。
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+DEFAULT_CONFIG = {
+    "enabled": True,
+    "memory_entries": 4096,
+    "disk_entries": 200000,
+    "disk_path": os.path.join(_project_root, "cache_data", "embedding_cache.db"),
+}
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """折叠空白并去掉首尾空白；换行与多余空格不影响语义，不应造成缓存未命中。"""
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def make_key(model: str, text: str) -> str:
+    raw = f"{model or ''}\x00{normalize_text(text)}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """内存 LRU + SQLite 两级 embedding 缓存，线程安全。"""
+
+    def __init__(self, memory_entries=4096, disk_entries=200000, disk_path=None):
+        self.memory_entries = max(0, int(memory_entries))
+        self.disk_entries = max(0, int(disk_entries))
+        self.disk_path = disk_path
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._disk_failed = False
+        self._disk_writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    # ------------------------------------------------------------------
+    # 磁盘层
+    # ------------------------------------------------------------------
+    def _disk(self):
+        """懒加载 SQLite 连接；打开失败后只用内存层，不影响 embedding 调用。"""
+        if self._conn is not None or self._disk_failed or not self.disk_path or not self.disk_entries:
+            return self._conn
+        try:
+            os.makedirs(os.path.dirname(self.disk_path), exist_ok=True)
+            conn = sqlite3.connect(self.disk_path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vec BLOB NOT NULL, "
+                "last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+            conn.commit()
+            self._conn = conn
+        except Exception as e:
+            logger.warning(f"embedding 磁盘缓存不可用，仅使用内存缓存: {e}")
+            self._disk_failed = True
+        return self._conn
+
+    def _disk_get(self, key):
+        conn = self._disk()
+        if conn is None:
+            return None
+        try:
+            row = conn.execute("SELECT dim, vec FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            vec = np.frombuffer(row[1], dtype=np.float32)
+            return vec if vec.shape[0] == row[0] else None
+        except sqlite3.Error as e:
+            logger.warning(f"读取 embedding 磁盘缓存失败: {e}")
+            return None
+
+    def _disk_put(self, items):
+        conn = self._disk()
+        if conn is None or not items:
+            return
+        try:
+            now = time.time()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, dim, vec, last_used) VALUES (?, ?, ?, ?)",
+                [(key, vec.shape[0], vec.tobytes(), now) for key, vec in items],
+            )
+            conn.commit()
+            self._disk_writes += len(items)
+            # 每写入一批（约总量的 1/10）检查一次条数，超限时删掉最久未用的
+            if self._disk_writes >= max(1, self.disk_entries // 10):
+                self._disk_writes = 0
+                self._prune_disk(conn)
+        except sqlite3.Error as e:
+            logger.warning(f"写入 embedding 磁盘缓存失败: {e}")
+
+    def _prune_disk(self, conn):
+        count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = count - self.disk_entries
+        if excess <= 0:
+            return
+        conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+            (excess,),
+        )
+        conn.commit()
+
+    # ------------------------------------------------------------------
+    # 内存层
+    # ------------------------------------------------------------------
+    def _memory_put(self, key, vec):
+        if not self.memory_entries:
+            return
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    # ------------------------------------------------------------------
+    # 对外接口
+    # ------------------------------------------------------------------
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        """命中返回新的 list（调用方可随意修改），未命中返回 None。"""
+        if not isinstance(text, str):
+            return None
+        key = make_key(model, text)
+        with self._lock:
+            vec = self._memory.get(key)
+            if vec is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return vec.tolist()
+            vec = self._disk_get(key)
+            if vec is not None:
+                self._memory_put(key, vec)
+                self.disk_hits += 1
+                return vec.tolist()
+            self.misses += 1
+            return None
+
+    def put(self, model: str, text: str, embedding) -> None:
+        self.put_many(model, [text], [embedding])
+
+    def put_many(self, model: str, texts, embeddings) -> None:
+        items = []
+        for text, embedding in zip(texts, embeddings):
+            if not isinstance(text, str) or not embedding:
+                continue
+            try:
+                vec = np.asarray(embedding, dtype=np.float32)
+            except (TypeError, ValueError):
+                continue
+            if vec.ndim != 1 or vec.shape[0] == 0:
+                continue
+            items.append((make_key(model, text), vec))
+        if not items:
+            return
+        with self._lock:
+            for key, vec in items:
+                self._memory_put(key, vec)
+            self._disk_put(items)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            conn = self._disk()
+            if conn is not None:
+                try:
+                    conn.execute("DELETE FROM embeddings")
+                    conn.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"清空 embedding 磁盘缓存失败: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_capacity": self.memory_entries,
+                "disk_capacity": self.disk_entries,
+                "disk_path": self.disk_path if self._conn is not None else None,
+            }
+
+
+_global_cache = None
+_global_cache_lock = threading.Lock()
+
+
+def _load_config() -> dict:
+    conf = dict(DEFAULT_CONFIG)
+    try:
+        import utils.config_util as cfg
+        if cfg.config is None:
+            cfg.load_config()
+        conf.update((cfg.config or {}).get("embedding_cache", {}) or {})
+    except Exception:
+        pass
+    return conf
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """获取全局 embedding 缓存；配置 embedding_cache.enabled=false 时返回 None。"""
+    global _global_cache
+    if _global_cache is None:
+        with _global_cache_lock:
+            if _global_cache is None:
+                conf = _load_config()
+                if not conf.get("enabled", True):
+                    _global_cache = False
+                else:
+                    _global_cache = EmbeddingCache(
+                        memory_entries=conf.get("memory_entries", DEFAULT_CONFIG["memory_entries"]),
+                        disk_entries=conf.get("disk_entries", DEFAULT_CONFIG["disk_entries"]),
+                        disk_path=conf.get("disk_path") or DEFAULT_CONFIG["disk_path"],
+                    )
+    return _global_cache or None
+
+
+def get_cache_stats() -> dict:
+    cache = get_embedding_cache()
+    if cache is None:
+        return {"enabled": False}
+    stats = cache.stats()
+    stats["enabled"] = True
+    return stats
@@ -0,0 +1,108 @@
+"""
+出站 HTTP 连接池。
+
+每个 scheme://host:port 复用一个 requests.Session，底层 urllib3 连接池保持
+keep-alive，避免每次请求都重新建立 TCP/TLS 连接（TTS 按句合成、embedding
+逐条请求时尤其明显）。
+
+配置（config.json 的 http_pool，可选）：
+  pool_maxsize      每个 host 最多保留的空闲连接数
+  connect_retries   建连失败（含复用已被对端关闭的连接）时的重试次数
+  backoff_factor    重试退避系数（秒）
+只对建连阶段重试：请求已发出后的读超时/错误不会被重放，避免非幂等请求重复执行，
+业务层原有的重试逻辑保持不变。
+
+MCP 子进程等未加载 config_util 的场景使用默认值。
+"""
+import sys
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_CONFIG = {
+    "pool_maxsize": 16,
+    "connect_retries": 2,
+    "backoff_factor": 0.2,
+}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _load_config() -> dict:
+    conf = dict(DEFAULT_CONFIG)
+    cfg = sys.modules.get("utils.config_util")
+    try:
+        if cfg is not None and cfg.config:
+            conf.update(cfg.config.get("http_pool", {}) or {})
+    except Exception:
+        pass
+    return conf
+
+
+def _host_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def _new_session() -> requests.Session:
+    conf = _load_config()
+    retries = int(conf.get("connect_retries", 0))
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=0,
+        status=0,
+        other=0,
+        allowed_methods=None,
+        backoff_factor=float(conf.get("backoff_factor", 0)),
+        raise_on_status=False,
+    )
+    pool_maxsize = max(1, int(conf.get("pool_maxsize", 16)))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(url: str) -> requests.Session:
+    """返回 url 所在 host 的共享 Session（线程安全，首次使用时创建）。"""
+    key = _host_key(url)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _new_session()
+                _sessions[key] = session
+    return session
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    return get_session(url).request(method, url, **kwargs)
+
+
+def post(url: str, data=None, json=None, **kwargs) -> requests.Response:
+    """与 requests.post 同签名，但复用 host 级连接池。"""
+    return get_session(url).post(url, data=data, json=json, **kwargs)
+
+
+def get(url: str, params=None, **kwargs) -> requests.Response:
+    """与 requests.get 同签名，但复用 host 级连接池。"""
+    return get_session(url).get(url, params=params, **kwargs)
+
+
+def close_all() -> None:
+    """关闭所有 Session（配置变更或退出时调用），下次请求会按新配置重建。"""
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        try:
+            session.close()
+        except Exception:
+            pass
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+增量分句器。
+
+原先 StreamTextProcessor 每发出一句都对剩余全文重新查找标点、网址区间，再切片字符串，
+长回复是 O(n²) 且受 max_iterations 限制。这里保留跨 chunk 的扫描游标，一遍扫描同时处理
+网址、小数 / 版本号和英文缩写，句子闭合即可交给调用方写入。
+"""
+import re
+
+# 结束 URL / token 的字符：空白、中文标点、引号与括号（与原 URL 正则的排除字符一致）
+_TOKEN_TERMINATORS = set(" \t\r\n\u3000\u3002\uff01\uff1f\u3001\uff0c\uff1b\uff1a<>'\"[](){}")
+# 域名后直接跟路径，如 example.com/a?b=1、localhost.dev:8080/x
+_DOMAIN_PATH = re.compile(r"[a-z0-9-]+(?:\.[a-z0-9-]+)+(?::\d{2,5})?/")
+# 句点后不断句的英文缩写（按小写比较，不含末尾的点）
+_ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "prof", "sr", "jr", "vs", "e.g", "i.e", "fig", "approx"}
+# 判断 URL 时只看 token 开头这么多字符，保证单次判断是常数开销
+_URL_PROBE_CHARS = 256
+
+
+class SentenceSegmenter:
+    """
+    增量分句器：跨 LLM chunk 保留扫描游标，每个字符只扫描一次。
+
+    feed() 追加文本并返回本次新闭合的句子；flush() 返回剩余未闭合文本。
+    网址、小数 / 版本号、英文缩写中的 . ! ? 不作为断句点；句子长度不足 min_length
+    时与后文合并；未闭合文本超过 max_pending 个字符时强制切出，避免无标点长文本堆积。
+    """
+
+    def __init__(self, punctuation_marks, min_length=10, max_pending=10240):
+        self.punctuation_mark_set = set(punctuation_marks)
+        self.min_length = min_length
+        self.max_pending = max(1, max_pending)
+        interesting = self.punctuation_mark_set | _TOKEN_TERMINATORS
+        self._interesting = re.compile("[" + "".join(re.escape(ch) for ch in sorted(interesting)) + "]")
+        self._buffer = ""
+        self._start = 0        # 当前未闭合句子在 _buffer 中的起点
+        self._cursor = 0       # 下一个待扫描的位置
+        self._token_start = 0  # 当前 token（用于判断网址）的起点
+
+    def feed(self, text):
+        if not text:
+            return []
+        self._buffer += text
+        return self._scan(final=False)
+
+    def flush(self):
+        """文本结束：按句末处理缓冲区末尾的句点，返回 (已闭合句子, 剩余文本)。"""
+        sentences = self._scan(final=True)
+        rest = self._buffer[self._start:]
+        self._buffer = ""
+        self._start = self._cursor = self._token_start = 0
+        return sentences, rest
+
+    @property
+    def pending(self):
+        return len(self._buffer) - self._start
+
+    def _scan(self, final):
+        buf = self._buffer
+        n = len(buf)
+        i = self._cursor
+        sentences = []
+        while i < n:
+            match = self._interesting.search(buf, i)
+            stop = match.start() if match else n
+            # 没有断句点的长文本按 max_pending 强制切出
+            while stop - self._start >= self.max_pending:
+                cut = self._start + self.max_pending
+                sentences.append(buf[self._start:cut])
+                self._start = cut
+            if match is None:
+                i = n
+                break
+            i = stop
+            ch = buf[i]
+            if ch in _TOKEN_TERMINATORS:
+                self._token_start = i + 1
+            if ch in self.punctuation_mark_set:
+                if ch == "." and i + 1 >= n and not final:
+                    # 句点是缓冲区最后一个字符：等下一个 chunk 才能判断是不是小数点 / 缩写
+                    break
+                if not (ch in ".!?" and self._is_protected(buf, i)):
+                    end = i + 1
+                    if end - self._start >= self.min_length:
+                        sentences.append(buf[self._start:end])
+                        self._start = end
+            i += 1
+        self._cursor = i
+        if self._start:
+            # 每次 feed 只整体截掉一次已输出部分，保证总开销线性
+            self._buffer = buf[self._start:]
+            self._cursor -= self._start
+            self._token_start = max(0, self._token_start - self._start)
+            self._start = 0
+        return sentences
+
+    def _token_is_url(self, buf, index):
+        token = buf[self._token_start:index][:_URL_PROBE_CHARS].lower()
+        return "://" in token or token.startswith("www.") or bool(_DOMAIN_PATH.match(token))
+
+    def _is_protected(self, buf, index):
+        """判断 . ! ? 是否位于网址、数字、版本号或缩写中。"""
+        if self._token_is_url(buf, index):
+            return True
+        if buf[index] != ".":
+            return False
+        prev_char = buf[index - 1] if index > 0 else ""
+        next_char = buf[index + 1] if index + 1 < len(buf) else ""
+        # 小数 / IP / 版本号 / 域名：3.14、192.168.1.1、v1.2、example.com
+        if prev_char.isascii() and prev_char.isalnum() and next_char.isascii() and next_char.isalnum():
+            return True
+        # 英文缩写：Mr. Smith、e.g. this
+        if next_char in ("", " ") and prev_char.isascii() and prev_char.isalpha():
+            left = index
+            while left > self._token_start and index - left < 6 and (buf[left - 1].isalpha() or buf[left - 1] == "."):
+                left -= 1
+            return buf[left:index].lower() in _ABBREVIATIONS
+        return False
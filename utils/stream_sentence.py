@@ -1,5 +1,6 @@
 import threading
 import functools
+from collections import deque
 
 def synchronized(func):
     @functools.wraps(func)
@@ -9,43 +10,56 @@ def synchronized(func):
     return wrapper
 
 class SentenceCache:
+    """
+    句子缓存：按写入顺序读出的队列，容量随需增长。
+    read(timeout=...) 在没有句子时阻塞等待写入通知，消费者不必轮询；close() 唤醒所有等待中的读者。
+    """
     def __init__(self, max_sentences):
         self.lock = threading.Lock()
-        self.buffer = [None] * max_sentences
+        # 与 lock 共用同一把锁，写入时唤醒阻塞中的读者
+        self.not_empty = threading.Condition(self.lock)
+        self.buffer = deque()
+        # 仅作为初始容量提示保留；缓冲区不再有上限，超过时只打印一次提示
         self.max_sentences = max_sentences
-        self.writeIndex = 0
-        self.readIndex = 0
-        self.idle = 0
+        self._warned = False
+        self.closed = False
 
+    @property
+    def idle(self):
+        return len(self.buffer)
 
     @synchronized
     def write(self, sentence):
-        # 如果缓冲区已满，则无法写入
-        if self.idle == self.max_sentences:
-            print("缓存区不够用")
-            return False
-        self.buffer[self.writeIndex] = sentence
-        self.writeIndex = (self.writeIndex + 1) % self.max_sentences
-        self.idle += 1
+        self.buffer.append(sentence)
+        if len(self.buffer) > self.max_sentences and not self._warned:
+            self._warned = True
+            print(f"句子缓存已超过 {self.max_sentences} 条，消费端可能处理不过来")
+        self.not_empty.notify()
         return True
 
     @synchronized
-    def read(self):
-        # 如果缓冲区为空，没有可读的句子
-        if self.idle == 0:
+    def read(self, timeout=0):
+        """
+        读出最早的一句。
+        timeout 为 0 时立即返回；为正数时最多等待这么多秒；为 None 时一直等待。
+        没有可读的句子时返回 None。
+        """
+        if not self.buffer and timeout != 0:
+            self.not_empty.wait_for(lambda: self.buffer or self.closed, timeout)
+        if not self.buffer:
             return None
-        sentence = self.buffer[self.readIndex]
-        self.buffer[self.readIndex] = None
-        self.readIndex = (self.readIndex + 1) % self.max_sentences
-        self.idle -= 1
-        return sentence
+        return self.buffer.popleft()
 
     @synchronized
     def clear(self):
-        self.buffer = [None] * self.max_sentences
-        self.writeIndex = 0
-        self.readIndex = 0
-        self.idle = 0
+        self.buffer.clear()
+        self._warned = False
+
+    @synchronized
+    def close(self):
+        """关闭缓存：阻塞中的 read 立即返回，之后的 read 在读完剩余句子后不再等待。"""
+        self.closed = True
+        self.not_empty.notify_all()
 
 if __name__ == '__main__':
     cache = SentenceCache(3)
@@ -56,3 +70,4 @@ if __name__ == '__main__':
     print(cache.read())  # 读出第二句话
     print(cache.read())  # 读出第三句话
     print(cache.read())  # 无内容，返回None
+    print(cache.read(timeout=0.1))  # 等待 0.1 秒仍无内容，返回None
@@ -0,0 +1,267 @@
+"""
+持久化 TTS 音频缓存。
+
+键为 FeiFei 计算的 sha1(TTS 模块 + 音色 + 风格 + 文本)，命中时直接复用已合成的音频：
+  - 音频：复制到 samples/tts-<key>.<ext>（不以 sample- 开头，启动清理 samples 时保留，
+    且仍可通过 /audio/<filename> 访问）
+  - 索引：cache_data/tts_cache_index.json，记录文件名、字节数、音频时长与最近使用时间，重启后恢复
+按总字节数做 LRU 淘汰，被淘汰的音频文件一并删除。
+
+配置（config.json 的 tts_cache，可选）：
+  enabled        是否启用（关闭时退回进程内的路径缓存）
+  max_bytes      缓存音频总字节上限
+  audio_dir      缓存音频目录
+  index_path     索引文件路径
+  prewarm        是否预合成 QA 答案与唤醒回复（默认关闭：每句都会调用一次 TTS 服务）
+  prewarm_max    预合成的最大句数
+  prewarm_idle_seconds  距最近一次实时合成至少空闲这么久才预合成下一句
+  prewarm_texts  额外需要预合成的文本
+"""
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from utils import audio_meta
+
+logger = logging.getLogger(__name__)
+
+_project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+DEFAULT_CONFIG = {
+    "enabled": True,
+    "max_bytes": 200 * 1024 * 1024,
+    "audio_dir": "./samples",
+    "index_path": os.path.join(_project_root, "cache_data", "tts_cache_index.json"),
+    "prewarm": False,
+    "prewarm_max": 20,
+    "prewarm_idle_seconds": 30,
+    "prewarm_texts": [],
+}
+
+FILE_PREFIX = "tts-"
+# 命中只更新内存中的使用时间，最多每隔这么久写回一次索引
+_INDEX_FLUSH_INTERVAL = 30.0
+
+
+class TTSAudioCache:
+    """按总字节数 LRU 淘汰的磁盘音频缓存，线程安全。"""
+
+    def __init__(self, audio_dir, index_path, max_bytes):
+        self.audio_dir = audio_dir
+        self.index_path = index_path
+        self.max_bytes = max(0, int(max_bytes))
+        self._lock = threading.Lock()
+        # key -> {"file", "bytes", "duration", "last_used"}，按最近使用从旧到新排列
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._dirty = False
+        self._last_flush = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.prewarmed = 0
+        self._load_index()
+
+    def _path(self, file_name):
+        return os.path.join(self.audio_dir, file_name)
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"读取 TTS 缓存索引失败，将重新建立: {e}")
+            return
+        items = sorted((data.get("entries") or {}).items(), key=lambda kv: kv[1].get("last_used", 0))
+        for key, entry in items:
+            file_name = entry.get("file")
+            # 音频文件已被手动删除的条目直接丢弃
+            if not file_name or not os.path.isfile(self._path(file_name)):
+                self._dirty = True
+                continue
+            self._entries[key] = entry
+            self._total_bytes += int(entry.get("bytes", 0))
+
+    def _save_index(self):
+        """调用方需持有 _lock。先写临时文件再替换，避免中途退出留下损坏的索引。"""
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": 1, "entries": self._entries}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+            self._dirty = False
+            self._last_flush = time.time()
+        except Exception as e:
+            logger.warning(f"写入 TTS 缓存索引失败: {e}")
+
+    def _evict(self):
+        while self._entries and self._total_bytes > self.max_bytes:
+            key, entry = self._entries.popitem(last=False)
+            self._total_bytes -= int(entry.get("bytes", 0))
+            self.evictions += 1
+            try:
+                os.remove(self._path(entry["file"]))
+            except OSError:
+                pass
+
+    def get(self, key) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not os.path.isfile(self._path(entry["file"])):
+                self._total_bytes -= int(entry.get("bytes", 0))
+                del self._entries[key]
+                self._dirty = True
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry["last_used"] = time.time()
+            self._entries.move_to_end(key)
+            self._dirty = True
+            if time.time() - self._last_flush > _INDEX_FLUSH_INTERVAL:
+                self._save_index()
+            return self._path(entry["file"])
+
+    def contains(self, key) -> bool:
+        """不计入命中统计的存在性检查（供预合成跳过已缓存的文本）。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and os.path.isfile(self._path(entry["file"]))
+
+    def put(self, key, file_url) -> Optional[str]:
+        """把合成好的音频复制进缓存，返回缓存中的路径；文件不存在或过大时返回 None。"""
+        if not file_url or not os.path.isfile(file_url):
+            return None
+        size = os.path.getsize(file_url)
+        if size <= 0 or size > self.max_bytes:
+            return None
+        ext = os.path.splitext(file_url)[1] or ".wav"
+        duration = audio_meta.get_duration(file_url)
+        file_name = f"{FILE_PREFIX}{key}{ext}"
+        target = self._path(file_name)
+        try:
+            os.makedirs(self.audio_dir, exist_ok=True)
+            if os.path.abspath(file_url) != os.path.abspath(target):
+                # 先复制到临时文件再替换，读者不会看到写了一半的音频
+                shutil.copyfile(file_url, target + ".tmp")
+                os.replace(target + ".tmp", target)
+        except Exception as e:
+            logger.warning(f"写入 TTS 缓存失败: {e}")
+            return None
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= int(old.get("bytes", 0))
+                if old.get("file") != file_name:
+                    try:
+                        os.remove(self._path(old["file"]))
+                    except OSError:
+                        pass
+            self._entries[key] = {"file": file_name, "bytes": size, "duration": duration, "last_used": time.time()}
+            self._total_bytes += size
+            self._evict()
+            self._save_index()
+            return target if key in self._entries else None
+
+    def get_duration(self, file_url) -> Optional[float]:
+        """缓存内音频（samples/tts-<key>.*）的时长，入缓存时已从文件头读出；不是缓存文件时返回 None。"""
+        file_name = os.path.basename(file_url or "")
+        if not file_name.startswith(FILE_PREFIX):
+            return None
+        key = os.path.splitext(file_name)[0][len(FILE_PREFIX):]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.get("file") != file_name:
+                return None
+            duration = entry.get("duration")
+        if duration is None:
+            # 旧索引里没有时长的条目，补算一次后写回
+            duration = audio_meta.get_duration(self._path(file_name))
+            if duration is not None:
+                with self._lock:
+                    if key in self._entries:
+                        self._entries[key]["duration"] = duration
+                        self._dirty = True
+        return duration
+
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    def clear(self):
+        with self._lock:
+            for entry in self._entries.values():
+                try:
+                    os.remove(self._path(entry["file"]))
+                except OSError:
+                    pass
+            self._entries.clear()
+            self._total_bytes = 0
+            self._save_index()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "prewarmed": self.prewarmed,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_global_cache = None
+_global_cache_lock = threading.Lock()
+
+
+def load_config() -> dict:
+    conf = dict(DEFAULT_CONFIG)
+    cfg = sys.modules.get("utils.config_util")
+    try:
+        if cfg is not None and cfg.config:
+            conf.update(cfg.config.get("tts_cache", {}) or {})
+    except Exception:
+        pass
+    return conf
+
+
+def get_tts_cache() -> Optional[TTSAudioCache]:
+    """获取全局 TTS 音频缓存；配置 tts_cache.enabled=false 时返回 None。"""
+    global _global_cache
+    if _global_cache is None:
+        with _global_cache_lock:
+            if _global_cache is None:
+                conf = load_config()
+                if not conf.get("enabled", True):
+                    _global_cache = False
+                else:
+                    _global_cache = TTSAudioCache(
+                        audio_dir=conf.get("audio_dir") or DEFAULT_CONFIG["audio_dir"],
+                        index_path=conf.get("index_path") or DEFAULT_CONFIG["index_path"],
+                        max_bytes=conf.get("max_bytes", DEFAULT_CONFIG["max_bytes"]),
+                    )
+    return _global_cache or None
+
+
+def get_cache_stats() -> dict:
+    cache = get_tts_cache()
+    if cache is None:
+        return {"enabled": False}
+    stats = cache.stats()
+    stats["enabled"] = True
+    return stats